@@ -0,0 +1,193 @@
+"""
+Command line application to search for keywords in IFRC documents, without the GUI.
+
+Results are written as each document is searched, so they can be followed while long searches are running.
+
+Example:
+    python batch_search.py "C:\\Appeal documents" keywords.txt --word-pad 10 --format csv --output results.csv
+"""
+import os
+import sys
+import argparse
+import multiprocessing
+import settings
+from document_searcher import DocumentSearcher
+from word_cache import WordCache
+from corpus_index import CorpusIndex
+from result_sink import RESULT_SINKS, get_result_sink, open_result_sink
+from query import QueryError, compile_keywords
+from search_journal import SearchJournal
+from search_modes import SEARCH_MODES, get_search_mode
+
+# Set up logging
+logger = settings.get_logger("batch")
+
+
+def read_keywords(keywords_file):
+    """
+    Read keywords from a text file, with one keyword or key phrase per line. Empty lines are ignored.
+    """
+    with open(keywords_file, encoding='utf-8') as f:
+        return [word.strip() for word in f.read().split('\n') if word.strip()!='']
+
+
+def run_search(search_folder, keywords, word_pad=10, output=sys.stdout, output_format=None, workers=1, use_cache=True, use_index=False, metrics_path=None, profile_path=None,
+               include=None, exclude=None, deduplicate=True, use_journal=True, resume=False, time_limit=settings.DOCUMENT_TIME_LIMIT, memory_limit=settings.DOCUMENT_MEMORY_LIMIT,
+               mode=None):
+    """
+    Search for keywords in the documents of a folder, writing the results of each document to the output as soon as it has been searched.
+
+    Parameters
+    ----------
+    search_folder : str (required)
+        Path to the folder to search, including subfolders.
+
+    keywords : list (required)
+        The keywords to search for.
+
+    word_pad : int (default=10)
+        The number of words to be returned either side of the found keyword.
+
+    output : str or file object (default=sys.stdout)
+        Path of the file to write the results to, or an open text file.
+
+    output_format : str (default=None)
+        Format to write the results in, one of 'csv', 'jsonl' or 'parquet'. If None, the format is taken from the file extension of the output, or is CSV.
+
+    workers : int (default=1)
+        Number of documents to search in parallel.
+
+    use_cache : bool (default=True)
+        Whether to use the word cache of extracted documents.
+
+    use_index : bool (default=False)
+        Whether to update and search using the corpus index, so that only pages which may contain the keywords are searched.
+
+    metrics_path : str (default=None)
+        If given, the time of each stage of the search is saved to this JSON file.
+
+    profile_path : str (default=None)
+        If given, the search is profiled with cProfile, searching in the current process, and the profile is saved to this file.
+
+    include, exclude : list (default=None)
+        Glob patterns of the files to include and exclude, as in DocumentFinder.
+
+    deduplicate : bool (default=True)
+        Whether to search copies of the same document only once, writing the results of the first copy for each copy.
+
+    use_journal : bool (default=True)
+        Whether to save the results of each document to the search journal as the search goes, so that the search can be resumed if it does not finish.
+
+    resume : bool (default=False)
+        Whether to resume an unfinished search with the same folder, keywords and word padding from the journal, only searching the documents not searched before.
+
+    time_limit : float (default=settings.DOCUMENT_TIME_LIMIT)
+        Maximum time in seconds to search each document, after which it is skipped. If None, documents are not limited in time.
+
+    memory_limit : int (default=settings.DOCUMENT_MEMORY_LIMIT)
+        Maximum memory in bytes used to search each document, after which it is skipped. If None, memory is not limited.
+
+    mode : SearchMode (default=None)
+        Limits on the results to find in each document, from search_modes.get_search_mode, so that triage searches stop searching each document early. If None, all results are found.
+
+    Returns
+    -------
+    results_summary : dict
+        Number of documents searched, keywords found, documents with keywords found, documents skipped, copies of documents not searched again, and documents taken from the journal of an unfinished search, and a summary of the time of the search.
+    """
+    searcher = DocumentSearcher(word_cache=WordCache() if use_cache else None, workers=workers, index=CorpusIndex() if use_index else None, profile_path=profile_path, deduplicate=deduplicate,
+                                time_limit=time_limit, memory_limit=memory_limit, mode=mode)
+    results_summary = {'searched': 0, 'keywords': 0, 'documents': 0, 'skipped': 0}
+    journal = SearchJournal() if use_journal else None
+    with open_result_sink(output, output_format=output_format, buffer_seconds=1) as sink:
+        for filepath, results, instances, warning in searcher.search_folder(search_folder=search_folder, keywords=keywords, word_pad=word_pad, include=include, exclude=exclude,
+                                                                            journal=journal, resume=resume):
+            results_summary['searched'] += 1
+            if warning:
+                logger.warning(warning)
+                print(warning, file=sys.stderr)
+            if results is None:
+                results_summary['skipped'] += 1
+                continue
+            if results:
+                sink.write(results)
+                results_summary['keywords'] += len(results)
+                results_summary['documents'] += 1
+    results_summary['duplicates'] = len(searcher.duplicates)
+    results_summary['resumed'] = searcher.metrics.counts.get('resumed', 0)
+    results_summary['metrics'] = searcher.metrics.summary()
+    if metrics_path:
+        searcher.metrics.dump(metrics_path, search_folder=search_folder, keywords=len(keywords), workers=searcher.workers, index=use_index)
+    return results_summary
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Search for keywords in the PDF documents of a folder, including subfolders.')
+    parser.add_argument('folder', help='Folder containing the documents to search.')
+    parser.add_argument('keywords_file', help='Text file of keywords, key phrases or queries to search for, one per line.')
+    parser.add_argument('--word-pad', type=int, default=10, help='Number of words to return either side of the keywords found (default: 10).')
+    parser.add_argument('--format', choices=sorted(RESULT_SINKS), default=None, help='Output format (default: from the output file extension, or csv).')
+    parser.add_argument('--output', default='-', help='File to write the results to, or - for stdout (default: -).')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Number of documents to search in parallel (default: number of CPUs).')
+    parser.add_argument('--no-cache', action='store_true', help='Do not read or save extracted words in the word cache.')
+    parser.add_argument('--index', action='store_true', help='Update the corpus index with new and changed documents, and use it to only search pages which may contain the keywords.')
+    parser.add_argument('--include', action='append', help='Glob pattern of the file names to search, can be given more than once (default: *.pdf).')
+    parser.add_argument('--exclude', action='append', help='Glob pattern of the file or folder names, or paths relative to the folder, to skip. Can be given more than once.')
+    parser.add_argument('--no-dedup', action='store_true', help='Search every file, even if it has the same content as another file.')
+    parser.add_argument('--resume', action='store_true', help='Resume the last search of the folder with the same keywords and word padding if it did not finish, only searching the documents not searched before.')
+    parser.add_argument('--no-journal', action='store_true', help='Do not save the results of each document to the search journal, so the search can not be resumed.')
+    parser.add_argument('--time-limit', type=float, default=settings.DOCUMENT_TIME_LIMIT, help=f'Maximum seconds to search each document, after which it is skipped, or 0 for no limit (default: {settings.DOCUMENT_TIME_LIMIT}).')
+    parser.add_argument('--memory-limit', type=int, default=settings.DOCUMENT_MEMORY_LIMIT//(1024*1024), help=f'Maximum MB of memory to search each document, after which it is skipped, or 0 for no limit (default: {settings.DOCUMENT_MEMORY_LIMIT//(1024*1024)}).')
+    parser.add_argument('--mode', choices=list(SEARCH_MODES), default='all', help='Results to find in each document: all results, the first result of each keyword, or only the first result, to find which documents contain keywords. '
+                                                                                 'The search of a document stops once its results have been found (default: all).')
+    parser.add_argument('--max-hits-per-keyword', type=int, help='Maximum number of results of each keyword in each document.')
+    parser.add_argument('--max-hits-per-document', type=int, help='Maximum number of results in each document.')
+    parser.add_argument('--text-blocks', dest='text_blocks', action='store_const', const=True, help='Get the text around each keyword found (default: only in the all mode).')
+    parser.add_argument('--no-text-blocks', dest='text_blocks', action='store_const', const=False, help='Do not get the text around each keyword found, which is faster.')
+    parser.add_argument('--metrics', help='JSON file to save the time of each stage of the search to.')
+    parser.add_argument('--profile', help='File to save a cProfile profile of the search to. Documents are searched in one process when profiling.')
+    args = parser.parse_args(args)
+
+    if not os.path.isdir(args.folder):
+        parser.error(f'{args.folder} is not a folder')
+    try:
+        keywords = read_keywords(args.keywords_file)
+    except OSError as err:
+        parser.error(f'Could not read {args.keywords_file}: {err}')
+    if not keywords:
+        parser.error(f'No keywords found in {args.keywords_file}')
+    try:
+        compile_keywords(keywords)
+    except QueryError as err:
+        parser.error(str(err))
+    for limit in ('max_hits_per_keyword', 'max_hits_per_document'):
+        if (getattr(args, limit) is not None) and (getattr(args, limit) < 1):
+            parser.error(f'--{limit.replace("_", "-")} must be at least 1')
+    mode = get_search_mode(args.mode, max_hits_per_keyword=args.max_hits_per_keyword, max_hits_per_document=args.max_hits_per_document, text_blocks=args.text_blocks)
+    output = sys.stdout if args.output == '-' else args.output
+    try:
+        get_result_sink(output, args.format).check_output(output)
+    except (ImportError, ValueError) as err:
+        parser.error(str(err))
+
+    if not (args.resume or args.no_journal):
+        unfinished = SearchJournal().unfinished_documents(args.folder, keywords, args.word_pad, mode=mode)
+        if unfinished:
+            print(f'The last search of {args.folder} for these keywords did not finish, after searching {unfinished} documents. Searching again from the start: use --resume to only search the remaining documents.', file=sys.stderr)
+
+    logger.info(f'Batch keyword searching starting in {args.folder}')
+    if args.output == '-':
+        sys.stdout.reconfigure(newline='')
+    results_summary = run_search(args.folder, keywords, word_pad=args.word_pad, output=output, output_format=args.format, workers=args.workers, use_cache=not args.no_cache,
+                                 use_index=args.index, metrics_path=args.metrics, profile_path=args.profile, include=args.include, exclude=args.exclude, deduplicate=not args.no_dedup,
+                                 use_journal=not args.no_journal, resume=args.resume, time_limit=args.time_limit or None,
+                                 memory_limit=args.memory_limit*1024*1024 or None, mode=mode)
+    logger.info(f'Batch keyword searching finished: {results_summary}')
+    print(f'{results_summary["keywords"]} keywords found in {results_summary["documents"]} documents ({results_summary["searched"]} searched, {results_summary["skipped"]} skipped, {results_summary["duplicates"]} copies not searched again, {results_summary["resumed"]} resumed)', file=sys.stderr)
+    if results_summary['metrics']:
+        print(results_summary['metrics'], file=sys.stderr)
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    main()
@@ -0,0 +1,469 @@
+"""
+Benchmarks of extracting words and searching documents, run on a generated corpus of PDF documents without the GUI.
+
+Generate a corpus, then run the benchmarks, saving the results as a baseline to compare later runs with:
+    python benchmark.py generate benchmark_corpus --documents 50 --pages 20
+    python benchmark.py run benchmark_corpus --save-baseline baseline.json
+    python benchmark.py run benchmark_corpus --baseline baseline.json
+
+The time to import the GUI and command line modules, which affects how quickly the application starts, is measured with:
+    python benchmark.py startup
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+import fitz
+import settings
+from document import Document
+from document_searcher import DocumentSearcher, find_documents
+from word_cache import WordCache
+
+# Set up logging
+logger = settings.get_logger("benchmark")
+
+# Keywords added to the generated documents and searched for by the benchmarks
+BENCHMARK_KEYWORDS = ['cholera', 'red cross', 'flood response', 'vaccination campaign', 'shelter']
+
+# Words used to fill the generated documents, none of which contain the keywords
+FILLER_WORDS = ('the of and to in for on with by from at as is are was were this that these those community health '
+                'water sanitation hygiene emergency appeal operation volunteers branch national society people '
+                'affected districts support distribution assessment needs response plan budget months target '
+                'households women children food security livelihoods protection coordination partners').split()
+
+# Details of the corpus are saved in this file in the corpus folder
+CORPUS_DETAILS_FILENAME = 'benchmark_corpus.json'
+
+# Modules timed by the startup benchmark, and the slow to load libraries each must not import when it is imported
+STARTUP_MODULES = {
+    'search_for_keywords': ['fitz', 'pyarrow'],
+    'batch_search': ['PySimpleGUI', 'pyarrow'],
+    'document_searcher': ['PySimpleGUI', 'pyarrow'],
+}
+HEAVY_MODULES = ['fitz', 'PySimpleGUI', 'pyarrow']
+
+# Code run in a new process to time importing a module, printing the time and the heavy modules loaded as JSON
+IMPORT_TIMER = '''
+import sys, json, time
+start = time.perf_counter()
+import {module}
+print(json.dumps({{'seconds': time.perf_counter()-start, 'loaded': [name for name in {heavy!r} if name in sys.modules]}}))
+'''
+
+
+def generate_document(filepath, pages, lines, words_per_line, hit_rate, footers, page_numbers, rand):
+    """
+    Generate a PDF document of random text containing the benchmark keywords.
+
+    Parameters
+    ----------
+    filepath : str (required)
+        Path to save the document to.
+
+    pages : int (required)
+        Number of pages.
+
+    lines : int (required)
+        Number of lines of text on each page.
+
+    words_per_line : int (required)
+        Number of words on each line.
+
+    hit_rate : float (required)
+        Chance of each word being replaced by one of the keywords.
+
+    footers : bool (required)
+        Whether to add an IFRC security footer at the bottom of each page.
+
+    page_numbers : bool (required)
+        Whether to add a page number line at the bottom of each page.
+
+    rand : random.Random (required)
+        Random number generator, so that the corpus is the same each time it is generated with the same seed.
+
+    Returns
+    -------
+    hits : int
+        Number of keywords added to the document.
+    """
+    doc = fitz.open()
+    hits = 0
+    fontsize = 10
+    for pageno in range(pages):
+        page = doc.new_page()
+        line_height = min(2*fontsize, (page.rect.height-120)/max(lines, 1))
+        for line in range(lines):
+            words = []
+            for _ in range(words_per_line):
+                if rand.random() < hit_rate:
+                    words.append(rand.choice(BENCHMARK_KEYWORDS))
+                    hits += 1
+                else:
+                    words.append(rand.choice(FILLER_WORDS))
+            page.insert_text((50, 60+line*line_height), ' '.join(words), fontsize=fontsize)
+        if footers:
+            page.insert_text((50, page.rect.height-50), rand.choice(['Public', 'Internal', 'Restricted']), fontsize=8)
+        if page_numbers:
+            page.insert_text((page.rect.width/2, page.rect.height-30), str(pageno+1), fontsize=8)
+    os.makedirs(os.path.dirname(os.path.abspath(filepath)), exist_ok=True)
+    doc.save(filepath, garbage=1)
+    doc.close()
+    return hits
+
+
+def generate_corpus(folder, documents=20, pages=10, lines=40, words_per_line=12, hit_rate=0.01, footers=True, page_numbers=True, subfolders=3, seed=1):
+    """
+    Generate a corpus of PDF documents to run the benchmarks on, replacing any previous corpus in the folder.
+
+    The details of the corpus are saved in the folder, so that benchmark results can be compared on the same corpus.
+
+    Parameters
+    ----------
+    folder : str (required)
+        Folder to save the documents in.
+
+    documents : int (default=20)
+        Number of documents.
+
+    pages, lines, words_per_line, hit_rate, footers, page_numbers
+        As in generate_document.
+
+    subfolders : int (default=3)
+        Number of subfolders to spread the documents over, to exercise the search of subfolders.
+
+    seed : int (default=1)
+        Seed of the random text.
+
+    Returns
+    -------
+    details : dict
+        Details of the corpus, including the number of keywords added.
+    """
+    if os.path.isdir(folder):
+        if not os.path.isfile(os.path.join(folder, CORPUS_DETAILS_FILENAME)):
+            raise ValueError(f'{folder} is not a benchmark corpus, so will not be replaced')
+        shutil.rmtree(folder)
+    rand = random.Random(seed)
+    details = {'documents': documents, 'pages': pages, 'lines': lines, 'words_per_line': words_per_line, 'hit_rate': hit_rate,
+               'footers': footers, 'page_numbers': page_numbers, 'subfolders': subfolders, 'seed': seed, 'keywords': 0}
+    for i in range(documents):
+        subfolder = f'folder_{i%subfolders}' if subfolders else ''
+        details['keywords'] += generate_document(os.path.join(folder, subfolder, f'document_{i:05d}.pdf'), pages, lines, words_per_line,
+                                                 hit_rate, footers, page_numbers, rand)
+    with open(os.path.join(folder, CORPUS_DETAILS_FILENAME), 'w', encoding='utf-8') as f:
+        json.dump(details, f, indent=2)
+    return details
+
+
+def peak_rss():
+    """
+    Get the peak resident memory in MB of this process and its finished worker processes, or None if it is not available on this platform.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    # Linux reports the peak in kB, macOS in bytes
+    scale = 1024*1024 if sys.platform.startswith('darwin') else 1024
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss + resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(usage/scale, 1)
+
+
+class BenchmarkWindow:
+    """
+    Stands in for the GUI window, so that DocumentSearcher.search_for_keywords can be run without the GUI. Keeps the last event sent to the window.
+    """
+    def __init__(self):
+        self.last_event = None
+
+    def write_event_value(self, key, value):
+        self.last_event = (key, value)
+
+
+def time_stage(function, repeat):
+    """
+    Run a benchmark stage a number of times, returning the fastest time in seconds and the number of hits of the last run.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        hits = function()
+        times.append(time.perf_counter()-start)
+    return min(times), hits
+
+
+def run_benchmarks(folder, keywords=BENCHMARK_KEYWORDS, word_pad=10, workers=1, repeat=3):
+    """
+    Run the benchmarks on a corpus.
+
+    The stages are:
+    'get_words': Document.get_words on each document.
+    'search': Document.search_for_keywords on each document, including extracting the words.
+    'search_cached': Document.search_for_keywords on each document, reading the words from a word cache.
+    'search_folder': DocumentSearcher.search_for_keywords on the corpus, as run by the GUI, with the number of workers given.
+
+    Parameters
+    ----------
+    folder : str (required)
+        Folder of the corpus.
+
+    keywords : list (default=BENCHMARK_KEYWORDS)
+        Keywords to search for.
+
+    word_pad : int (default=10)
+        Number of words to return either side of the keywords found.
+
+    workers : int (default=1)
+        Number of worker processes for the search_folder stage.
+
+    repeat : int (default=3)
+        Number of times to run each stage. The fastest run is reported.
+
+    Returns
+    -------
+    report : dict
+        Details of the corpus and the run, and for each stage the time in seconds, documents, pages and hits per second, and the peak memory so far in MB.
+    """
+    filepaths = find_documents(folder)
+    total_pages = 0
+    for filepath in filepaths:
+        doc = Document(filepath=filepath)
+        total_pages += doc.total_pages
+        doc.close()
+
+    def get_words():
+        for filepath in filepaths:
+            doc = Document(filepath=filepath)
+            doc.get_words()
+            doc.close()
+        return None
+
+    def search(word_cache=None):
+        hits = 0
+        for filepath in filepaths:
+            doc = Document(filepath=filepath, word_cache=word_cache)
+            hits += len(doc.search_for_keywords(keywords=keywords, word_pad=word_pad)[0])
+            doc.close()
+        return hits
+
+    def search_folder():
+        settings.init()
+        settings.searching = True
+        DocumentSearcher(workers=workers).search_for_keywords(filepaths, folder, keywords, word_pad, BenchmarkWindow())
+        return len(settings.keyword_results)
+
+    cache_dir = tempfile.mkdtemp()
+    try:
+        word_cache = WordCache(path=os.path.join(cache_dir, 'word_cache.sqlite'))
+        search(word_cache) # Fill the word cache
+        stages = {
+            'get_words': get_words,
+            'search': search,
+            'search_cached': lambda: search(word_cache),
+            'search_folder': search_folder,
+        }
+        report = {'corpus': corpus_details(folder), 'documents': len(filepaths), 'pages': total_pages, 'workers': workers, 'repeat': repeat, 'stages': {}}
+        for name, function in stages.items():
+            seconds, hits = time_stage(function, repeat)
+            report['stages'][name] = {
+                'seconds': round(seconds, 4),
+                'docs_per_second': round(len(filepaths)/seconds, 2) if seconds else None,
+                'pages_per_second': round(total_pages/seconds, 2) if seconds else None,
+                'hits_per_second': round(hits/seconds, 2) if (seconds and hits is not None) else None,
+                'hits': hits,
+                'peak_rss_mb': peak_rss(),
+            }
+            logger.info(f'Benchmark stage {name}: {report["stages"][name]}')
+        word_cache.close()
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    return report
+
+
+def time_startup(modules=STARTUP_MODULES, repeat=5):
+    """
+    Time importing modules in new Python processes, as when the application or command line search starts, and check that they do not load slow libraries they do not need.
+
+    Parameters
+    ----------
+    modules : dict (default=STARTUP_MODULES)
+        Dict where the keys are the modules to import, and the values are lists of the libraries each must not load.
+
+    repeat : int (default=5)
+        Number of times to import each module, keeping the fastest time.
+
+    Returns
+    -------
+    report : dict
+        Report with the fastest import time of each module as a stage, as in run_benchmarks, with the heavy libraries loaded by each module, and the libraries loaded which should not be.
+    """
+    report = {'repeat': repeat, 'stages': {}}
+    for module, forbidden in modules.items():
+        stage = {'seconds': None, 'loaded': [], 'unexpected': [], 'error': None}
+        for _ in range(repeat):
+            process = subprocess.run([sys.executable, '-c', IMPORT_TIMER.format(module=module, heavy=HEAVY_MODULES)],
+                                     cwd=settings.CURRENT_DIR, capture_output=True, text=True)
+            if process.returncode != 0:
+                stage['error'] = (process.stderr.strip().splitlines() or ['Import failed'])[-1]
+                break
+            result = json.loads(process.stdout.strip().splitlines()[-1])
+            stage['seconds'] = result['seconds'] if stage['seconds'] is None else min(stage['seconds'], result['seconds'])
+            stage['loaded'] = result['loaded']
+        if stage['seconds'] is not None:
+            stage['seconds'] = round(stage['seconds'], 4)
+        stage['unexpected'] = [name for name in stage['loaded'] if name in forbidden]
+        report['stages'][f'import {module}'] = stage
+    return report
+
+
+def format_startup_report(report):
+    """
+    Format a startup report as a table of text.
+    """
+    lines = [f'Import times, best of {report["repeat"]}', f'{"module":<30}{"seconds":>10}  heavy libraries loaded']
+    for name, stage in report['stages'].items():
+        if stage['error']:
+            lines.append(f'{name:<30}{"-":>10}  could not import: {stage["error"]}')
+            continue
+        loaded = ', '.join([f'{library} (UNEXPECTED)' if library in stage['unexpected'] else library for library in stage['loaded']]) or 'none'
+        lines.append(f'{name:<30}{stage["seconds"]:>10}  {loaded}')
+    return '\n'.join(lines)
+
+
+def corpus_details(folder):
+    """
+    Read the details saved when the corpus was generated, or None if the folder is not a generated corpus.
+    """
+    try:
+        with open(os.path.join(folder, CORPUS_DETAILS_FILENAME), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def compare_reports(report, baseline, tolerance=0.1):
+    """
+    Compare the times of each stage with a baseline report.
+
+    Parameters
+    ----------
+    report : dict (required)
+        Report of the current run, as returned by run_benchmarks.
+
+    baseline : dict (required)
+        Report of the baseline run.
+
+    tolerance : float (default=0.1)
+        Fraction by which a stage can be slower than the baseline before it is reported as a regression.
+
+    Returns
+    -------
+    lines : list
+        Lines of text describing the change of each stage.
+
+    regressions : list
+        Names of the stages which are slower than the baseline by more than the tolerance.
+    """
+    lines = []
+    regressions = []
+    if report.get('corpus') != baseline.get('corpus'):
+        lines.append('Warning: the corpus is different from the baseline corpus')
+    for name, stage in report['stages'].items():
+        baseline_stage = baseline.get('stages', {}).get(name)
+        if stage['seconds'] is None:
+            lines.append(f'{name}: not measured')
+            continue
+        if not baseline_stage or not baseline_stage['seconds']:
+            lines.append(f'{name}: no baseline')
+            continue
+        ratio = stage['seconds']/baseline_stage['seconds']
+        if ratio > 1+tolerance:
+            regressions.append(name)
+        lines.append(f'{name}: {baseline_stage["seconds"]:.3f}s -> {stage["seconds"]:.3f}s ({ratio:.2f}x time){" REGRESSION" if ratio > 1+tolerance else ""}')
+    return lines, regressions
+
+
+def format_report(report):
+    """
+    Format a report as a table of text.
+    """
+    lines = [f'{report["documents"]} documents, {report["pages"]} pages, {report["workers"]} workers, best of {report["repeat"]}',
+             f'{"stage":<15}{"seconds":>10}{"docs/s":>10}{"pages/s":>10}{"hits/s":>12}{"peak MB":>10}']
+    for name, stage in report['stages'].items():
+        values = [stage['seconds'], stage['docs_per_second'], stage['pages_per_second'], stage['hits_per_second'], stage['peak_rss_mb']]
+        values = ['-' if value is None else value for value in values]
+        lines.append(f'{name:<15}{values[0]:>10}{values[1]:>10}{values[2]:>10}{values[3]:>12}{values[4]:>10}')
+    return '\n'.join(lines)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Generate a benchmark corpus of PDF documents, or run the benchmarks on it.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    generate_parser = subparsers.add_parser('generate', help='Generate a corpus of PDF documents.')
+    generate_parser.add_argument('folder', help='Folder to generate the corpus in. A previous corpus in the folder is replaced.')
+    generate_parser.add_argument('--documents', type=int, default=20, help='Number of documents (default: 20).')
+    generate_parser.add_argument('--pages', type=int, default=10, help='Pages in each document (default: 10).')
+    generate_parser.add_argument('--lines', type=int, default=40, help='Lines of text on each page (default: 40).')
+    generate_parser.add_argument('--words-per-line', type=int, default=12, help='Words on each line (default: 12).')
+    generate_parser.add_argument('--hit-rate', type=float, default=0.01, help='Chance of each word being a keyword (default: 0.01).')
+    generate_parser.add_argument('--no-footers', action='store_true', help='Do not add security footers.')
+    generate_parser.add_argument('--no-page-numbers', action='store_true', help='Do not add page numbers.')
+    generate_parser.add_argument('--seed', type=int, default=1, help='Seed of the random text (default: 1).')
+
+    run_parser = subparsers.add_parser('run', help='Run the benchmarks on a corpus.')
+    run_parser.add_argument('folder', help='Folder of the corpus.')
+    run_parser.add_argument('--workers', type=int, default=1, help='Number of worker processes for the folder search (default: 1).')
+    run_parser.add_argument('--repeat', type=int, default=3, help='Number of times to run each stage (default: 3).')
+    run_parser.add_argument('--baseline', help='Baseline report to compare with.')
+    run_parser.add_argument('--save-baseline', help='File to save the report to, to use as a baseline.')
+    run_parser.add_argument('--tolerance', type=float, default=0.1, help='Fraction slower than the baseline to report as a regression (default: 0.1).')
+
+    startup_parser = subparsers.add_parser('startup', help='Time importing the GUI and command line modules.')
+    startup_parser.add_argument('--repeat', type=int, default=5, help='Number of times to import each module (default: 5).')
+    startup_parser.add_argument('--baseline', help='Baseline startup report to compare with.')
+    startup_parser.add_argument('--save-baseline', help='File to save the report to, to use as a baseline.')
+    startup_parser.add_argument('--tolerance', type=float, default=0.2, help='Fraction slower than the baseline to report as a regression (default: 0.2).')
+    args = parser.parse_args(args)
+
+    if args.command == 'generate':
+        try:
+            details = generate_corpus(args.folder, documents=args.documents, pages=args.pages, lines=args.lines, words_per_line=args.words_per_line,
+                                      hit_rate=args.hit_rate, footers=not args.no_footers, page_numbers=not args.no_page_numbers, seed=args.seed)
+        except ValueError as err:
+            parser.error(str(err))
+        print(f'{details["documents"]} documents generated in {args.folder} with {details["keywords"]} keywords')
+        return 0
+
+    if args.command == 'startup':
+        report = time_startup(repeat=max(1, args.repeat))
+        print(format_startup_report(report))
+    else:
+        if not os.path.isdir(args.folder):
+            parser.error(f'{args.folder} is not a folder')
+        report = run_benchmarks(args.folder, workers=args.workers, repeat=max(1, args.repeat))
+        print(format_report(report))
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        lines, regressions = compare_reports(report, baseline, tolerance=args.tolerance)
+        print('\n'.join(lines))
+        if regressions:
+            return 1
+    if any(stage.get('unexpected') for stage in report['stages'].values()):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,399 @@
+"""
+Inverted index of the words of a collection of documents
+
+The index can be built or updated from the command line:
+    python corpus_index.py "C:\\Appeal documents"
+"""
+import os
+import sys
+import sqlite3
+import argparse
+import threading
+import settings
+from document import Document
+from document_searcher import find_documents
+from keyword_matcher import KeywordMatcher
+from query import Query, compile_keywords, is_query
+from word_cache import WordCache
+
+# Set up logging
+logger = settings.get_logger("corpus_index")
+
+
+class CorpusIndex:
+    """
+    SQLite positional inverted index of the words of documents, recording the document, page, word position and rect of each word.
+
+    The index is used to find the pages which may contain keywords, so that new keyword lists only need to search those pages.
+    Documents are re-indexed if their size or modification time has changed.
+    The terms are also indexed by their trigrams (with SQLite FTS5), so that the terms containing a keyword can be found without reading every term.
+
+    Parameters
+    ----------
+    path : str (default=settings.CORPUS_INDEX_PATH)
+        Path to the SQLite database file. It is created if it does not exist.
+    """
+    def __init__(self, path=settings.CORPUS_INDEX_PATH):
+        self.path = path
+        self.local = threading.local()
+
+
+    def __getstate__(self):
+        # SQLite connections can not be shared, so only pass the path when sending the index to another process
+        return {'path': self.path}
+
+
+    def __setstate__(self, state):
+        self.__init__(path=state['path'])
+
+
+    @property
+    def connection(self):
+        """
+        SQLite connection for the current thread, opened and set up on first use.
+        """
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS documents (id INTEGER PRIMARY KEY, path TEXT UNIQUE, size INTEGER, mtime INTEGER)')
+            connection.execute('CREATE TABLE IF NOT EXISTS terms (id INTEGER PRIMARY KEY, term TEXT UNIQUE)')
+            connection.execute('CREATE TABLE IF NOT EXISTS postings (term_id INTEGER, document_id INTEGER, pageno INTEGER, word INTEGER, x0 REAL, y0 REAL, x1 REAL, y1 REAL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS postings_term ON postings (term_id)')
+            connection.execute('CREATE INDEX IF NOT EXISTS postings_document ON postings (document_id)')
+            self.local.trigrams = self.create_trigrams(connection)
+            self.local.connection = connection
+        return connection
+
+
+    def create_trigrams(self, connection):
+        """
+        Create the trigram index of the terms if it does not exist, adding the terms already in the index. New terms are added to it by a trigger.
+
+        Returns
+        -------
+        trigrams : bool
+            Whether the trigram index can be used. If the SQLite library does not have the FTS5 trigram tokenizer, terms are found by reading every term.
+        """
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            exists = connection.execute("SELECT 1 FROM sqlite_master WHERE name='term_trigrams'").fetchone()
+            if not exists:
+                connection.execute("CREATE VIRTUAL TABLE term_trigrams USING fts5(term, tokenize='trigram')")
+                connection.execute('INSERT INTO term_trigrams (rowid, term) SELECT id, term FROM terms')
+                connection.execute('CREATE TRIGGER IF NOT EXISTS terms_insert AFTER INSERT ON terms BEGIN INSERT INTO term_trigrams (rowid, term) VALUES (new.id, new.term); END')
+            connection.commit()
+            return True
+        except sqlite3.OperationalError as err:
+            connection.rollback()
+            logger.warning('Could not create the trigram index of the terms', extra={'error': str(err)})
+            return False
+
+
+    def indexed_documents(self):
+        """
+        Get the documents in the index.
+
+        Returns
+        -------
+        documents : dict
+            Dict where the keys are the absolute paths of the documents, and the values are (size, modification time) tuples.
+        """
+        return {path: (size, mtime) for path, size, mtime in self.connection.execute('SELECT path, size, mtime FROM documents')}
+
+
+    def update(self, filepaths, word_cache=None, should_stop=None):
+        """
+        Index the documents which are not in the index or have changed since they were indexed.
+
+        Parameters
+        ----------
+        filepaths : list (required)
+            Paths of the documents to index.
+
+        word_cache : WordCache (default=None)
+            Cache of words extracted from documents.
+
+        should_stop : function (default=None)
+            Function returning True if the update should be stopped.
+
+        Returns
+        -------
+        update_summary : dict
+            Number of documents indexed, unchanged, and which failed to be indexed.
+        """
+        indexed = self.indexed_documents()
+        update_summary = {'indexed': 0, 'unchanged': 0, 'failed': 0}
+        for filepath in filepaths:
+            if should_stop and should_stop():
+                break
+            if not filepath.lower().endswith('.pdf'):
+                continue
+            try:
+                stat = os.stat(filepath)
+                if indexed.get(os.path.abspath(filepath)) == (stat.st_size, stat.st_mtime_ns):
+                    update_summary['unchanged'] += 1
+                    continue
+                self.index_document(filepath, word_cache=word_cache)
+                update_summary['indexed'] += 1
+            except Exception as err:
+                logger.exception('Error indexing document', extra={'filepath': filepath})
+                update_summary['failed'] += 1
+        return update_summary
+
+
+    def index_document(self, filepath, word_cache=None):
+        """
+        Add a document to the index, replacing any previous entry.
+
+        Parameters
+        ----------
+        filepath : str (required)
+            Path to the document.
+
+        word_cache : WordCache (default=None)
+            Cache of words extracted from documents.
+        """
+        # Get the file details before extracting the words, so that changes made during extraction are found by the next update
+        stat = os.stat(filepath)
+        doc = Document(filepath=filepath, word_cache=word_cache)
+        postings = []
+        try:
+            for pageno, words in doc.iter_page_words():
+                for i, word in enumerate(words):
+                    for term in KeywordMatcher.normalise(word[4]).split():
+                        postings.append((term, pageno, i) + tuple(word[:4]))
+        finally:
+            doc.close()
+
+        # Get the ids of the terms, adding new terms
+        terms = list({posting[0] for posting in postings})
+        with self.connection:
+            self.connection.executemany('INSERT OR IGNORE INTO terms (term) VALUES (?)', [(term, ) for term in terms])
+        term_ids = {}
+        for i in range(0, len(terms), 500):
+            batch = terms[i:i+500]
+            term_ids.update(self.connection.execute(f'SELECT term, id FROM terms WHERE term IN ({",".join("?"*len(batch))})', batch).fetchall())
+
+        # Replace the document postings
+        path = os.path.abspath(filepath)
+        with self.connection:
+            self.remove_document(path, commit=False)
+            document_id = self.connection.execute('INSERT INTO documents (path, size, mtime) VALUES (?, ?, ?)', (path, stat.st_size, stat.st_mtime_ns)).lastrowid
+            self.connection.executemany('INSERT INTO postings VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                        [(term_ids[posting[0]], document_id) + posting[1:] for posting in postings])
+
+
+    def remove_document(self, path, commit=True):
+        """
+        Remove a document from the index.
+
+        Parameters
+        ----------
+        path : str (required)
+            Absolute path of the document.
+
+        commit : bool (default=True)
+            Whether to commit the change. If False, the change is part of the current transaction.
+        """
+        row = self.connection.execute('SELECT id FROM documents WHERE path=?', (path, )).fetchone()
+        if row is not None:
+            self.connection.execute('DELETE FROM postings WHERE document_id=?', row)
+            self.connection.execute('DELETE FROM documents WHERE id=?', row)
+            if commit:
+                self.connection.commit()
+
+
+    def prune(self, search_folder=None):
+        """
+        Remove documents from the index which no longer exist.
+
+        Parameters
+        ----------
+        search_folder : str (default=None)
+            If given, only documents in this folder are checked.
+
+        Returns
+        -------
+        removed : int
+            Number of documents removed.
+        """
+        folder = None if search_folder is None else os.path.join(os.path.abspath(search_folder), '')
+        removed = [path for path in self.indexed_documents() if ((folder is None) or path.startswith(folder)) and not os.path.isfile(path)]
+        with self.connection:
+            for path in removed:
+                self.remove_document(path, commit=False)
+        return len(removed)
+
+
+    def find_pages(self, keywords, path=None):
+        """
+        Find the pages of the indexed documents which may contain the keywords.
+
+        A page may contain a keyword if, for every word of the keyword, the page has a word containing it. This allows for keywords found inside longer words, as with fitz page.search_for.
+        A page may match a query if it has a word containing one of the words of the terms of the query.
+
+        Parameters
+        ----------
+        keywords : list (required)
+            The keywords to search for.
+
+        path : str (default=None)
+            Absolute path of a document. If given, only the pages of this document are found.
+
+        Returns
+        -------
+        pages : dict
+            Dict where the keys are the absolute paths of the documents, and the values are sets of page numbers (starting from 0).
+        """
+        pages = {}
+        for keyword in keywords:
+            if is_query(keyword):
+                keyword_pages = set()
+                for term in set(KeywordMatcher.normalise(' '.join(Query(keyword).words())).split()):
+                    keyword_pages |= self.term_pages(term, path=path)
+            else:
+                keyword_pages = None
+                for term in set(KeywordMatcher.normalise(keyword).split()):
+                    term_pages = self.term_pages(term, path=path)
+                    keyword_pages = term_pages if keyword_pages is None else keyword_pages & term_pages
+            for page_path, pageno in keyword_pages or []:
+                pages.setdefault(page_path, set()).add(pageno)
+        return pages
+
+
+    def term_pages(self, term, path=None):
+        """
+        Find the pages of the indexed documents which have a word containing a term.
+
+        Terms of at least three characters are found with the trigram index. Shorter terms are found by reading every term.
+
+        Parameters
+        ----------
+        term : str (required)
+            Normalised term to find.
+
+        path : str (default=None)
+            Absolute path of a document. If given, only the pages of this document are found.
+
+        Returns
+        -------
+        pages : set
+            Set of (absolute path, page number) tuples.
+        """
+        connection = self.connection
+        if self.local.trigrams and (len(term) >= 3):
+            term_ids = "SELECT rowid FROM term_trigrams WHERE term_trigrams MATCH ?"
+            params = ['"' + term.replace('"', '""') + '"']
+        else:
+            term_ids = "SELECT id FROM terms WHERE term LIKE ? ESCAPE '\\'"
+            params = ['%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%']
+        sql = ('SELECT DISTINCT documents.path, postings.pageno FROM postings '
+               'JOIN documents ON documents.id=postings.document_id '
+               f'WHERE postings.term_id IN ({term_ids})')
+        if path is not None:
+            sql += ' AND documents.path=?'
+            params.append(path)
+        return set(connection.execute(sql, params))
+
+
+    def prefilter(self, filepaths, keywords, word_cache=None, should_stop=None):
+        """
+        Find the pages of each document which may contain the keywords, yielding each file as soon as it is found so that the files can be searched while the folder is still being read.
+
+        Only the given pages of documents which are in the index and have not changed need to be searched, giving the same results as searching all pages.
+        New and changed documents are searched in full. With a word cache, they are indexed after they have been searched, from the words saved by the search, with index_after.
+        Without a word cache, they are indexed before they are searched.
+
+        Parameters
+        ----------
+        filepaths : iterable (required)
+            Paths of the documents to search.
+
+        keywords : list, KeywordMatcher or QueryMatcher (required)
+            The keywords or queries to search for.
+
+        word_cache : WordCache (default=None)
+            Cache of words extracted from documents.
+
+        should_stop : function (default=None)
+            Function returning True if the search should be stopped.
+
+        Yields
+        ------
+        filepath : str
+            Path of the document.
+
+        pages : set
+            Page numbers (starting from 0) which may contain the keywords, which may be empty. None if the document must be searched in full.
+
+        index_after : bool
+            Whether the document should be indexed with index_after once it has been searched.
+        """
+        keywords = compile_keywords(keywords).keywords
+        indexed = self.indexed_documents()
+        candidate_pages = self.find_pages(keywords)
+        for filepath in filepaths:
+            if should_stop and should_stop():
+                return
+            path = os.path.abspath(filepath)
+            try:
+                stat = os.stat(filepath)
+                unchanged = indexed.get(path) == (stat.st_size, stat.st_mtime_ns)
+            except OSError:
+                unchanged = False
+            if unchanged:
+                yield filepath, candidate_pages.get(path, set()), False
+            elif not filepath.lower().endswith('.pdf'):
+                yield filepath, None, False
+            elif word_cache is not None:
+                yield filepath, None, True
+            else:
+                try:
+                    self.index_document(filepath)
+                except Exception as err:
+                    logger.exception('Error indexing document', extra={'filepath': filepath})
+                    yield filepath, None, False
+                    continue
+                yield filepath, self.find_pages(keywords, path=path).get(path, set()), False
+
+
+    def index_after(self, filepath, word_cache):
+        """
+        Index a document after it has been searched in full, if its words were saved to the word cache by the search.
+        The document is not indexed if the search was stopped or skipped before reading every page, and is searched in full again next time.
+
+        Parameters
+        ----------
+        filepath : str (required)
+            Path to the document.
+
+        word_cache : WordCache (required)
+            Cache of words extracted from documents.
+        """
+        if word_cache.has_words(filepath):
+            try:
+                self.index_document(filepath, word_cache=word_cache)
+            except Exception as err:
+                logger.exception('Error indexing document', extra={'filepath': filepath})
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Build or update the index of the PDF documents in a folder, including subfolders.')
+    parser.add_argument('folder', help='Folder containing the documents to index.')
+    parser.add_argument('--no-cache', action='store_true', help='Do not read or save extracted words in the word cache.')
+    args = parser.parse_args(args)
+    if not os.path.isdir(args.folder):
+        parser.error(f'{args.folder} is not a folder')
+
+    index = CorpusIndex()
+    removed = index.prune(args.folder)
+    update_summary = index.update(find_documents(args.folder), word_cache=None if args.no_cache else WordCache())
+    logger.info(f'Index updated for {args.folder}: {update_summary}, {removed} removed')
+    print(f'{update_summary["indexed"]} documents indexed, {update_summary["unchanged"]} unchanged, {update_summary["failed"]} failed, {removed} removed', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,13 @@
 import os
+import time
 import pathlib
+import itertools
 import fitz
 import settings
+from query import compile_keywords
+from search_modes import SearchMode
+from word_index import WordIndex
+from metrics import Metrics
 
 # Set up logging
 logger = settings.get_logger("document")
@@ -14,27 +20,59 @@ class Document:
     ----------
     filepath : str (required)
         Path to the document.
+
+    word_cache : WordCache (default=None)
+        Cache of extracted words. If given, the words of unchanged documents are read from the cache instead of being extracted again.
+
+    metrics : Metrics (default=None)
+        Metrics of the search to add the time of each stage of searching the document to. If None, the document has its own metrics.
     """
-    def __init__(self, filepath):
+    def __init__(self, filepath, word_cache=None, metrics=None):
         self.filepath = filepath
+        self.word_cache = word_cache
+        self.metrics = Metrics() if metrics is None else metrics
         self.filename = os.path.basename(filepath)
         self.file_extension = pathlib.Path(self.filename).suffix
-        self.doc = fitz.open(filepath)
-        self.total_pages = len(self.doc)
+        self._doc = None
 
 
-    def search_for_keywords(self, keywords, word_pad=10):
+    @property
+    def doc(self):
+        """
+        The fitz document, opened on first use so that documents with cached words do not need to be opened to search them.
+        """
+        if self._doc is None:
+            with self.metrics.timer('open'):
+                self._doc = fitz.open(self.filepath)
+        return self._doc
+
+
+    @property
+    def total_pages(self):
+        """
+        Number of pages in the document.
+        """
+        return len(self.doc)
+
+
+    def search_for_keywords(self, keywords, word_pad=10, pages=None, mode=None):
         """
         Search for keywords in the document.
 
         Parameters
         ----------
-        keywords : list (required)
-            List of keywords or key phrases to search for.
+        keywords : list, KeywordMatcher or QueryMatcher (required)
+            List of keywords, key phrases or queries to search for, or a matcher already compiled from the keywords with compile_keywords.
 
         word_pad : int (default=10)
             Number of words to return either side of the keywords found.
 
+        pages : list (default=None)
+            Page numbers (starting from 0) to search. If None, all pages are searched.
+
+        mode : SearchMode (default=None)
+            Limits on the results to find, as in iter_search. If None, all results are found.
+
         Returns
         -------
         doc_results : list
@@ -43,61 +81,181 @@ class Document:
         doc_instances : dict
             Contains the list of keyword search instances found for each page of the document.
         """
-        # Get the document words
-        self.words = self.get_words()
-
-        # Loop through the pages of the document and search for keywords in each page
         doc_results = []
         doc_instances = {}
-        if self.words:
-            for pageno, page in enumerate(self.doc):
-                if not self.words[pageno]:
-                    continue
-                doc_instances[pageno] = []
-                for keyword in keywords:
-
-                    # Get the keyword instances
-                    instances = page.search_for(keyword)
-                    if instances:
-                        doc_instances[pageno] += instances
-                        for instance in instances:
-
-                            # Get a nuber of words (word_pad) either side of the keyword/ phrase, and get the bounding rect
-                            word_start, word_end = self.find_bounding_words(words=self.words[pageno], rect=instance)
-                            word_count_left, first_word = self.iterate_words_limit(words=reversed(self.words[pageno][:word_start]),
-                                                                                limit=word_pad)
-                            word_count_right, last_word = self.iterate_words_limit(words=self.words[pageno][word_end+1:],
-                                                                                limit=word_pad)
-                            text_block = page.get_textbox((0,
-                                                        self.words[pageno][word_start][1] if first_word is None else first_word[1],
-                                                        page.rect.width,
-                                                        self.words[pageno][word_end][3] if last_word is None else last_word[3]))
-
-                            # Get overflow words on the previous and next page
-                            if (word_count_left<word_pad) and pageno > 0:
-                                word_count_prev_page, first_word_prev_page = self.iterate_words_limit(words=reversed(self.words[pageno-1]),
-                                                                                                    limit=word_pad-word_count_left)
-                                text_block_prev_page = self.doc[pageno-1].get_textbox((0, first_word_prev_page[1], self.doc[pageno-1].rect.width, self.words[pageno-1][-1][3]))
-                                text_block = text_block_prev_page + '\n\n' + text_block
-                            if (word_count_right<word_pad) and (pageno < self.total_pages-1):
-                                word_count_next_page, last_word_next_page = self.iterate_words_limit(words=self.words[pageno+1],
-                                                                                                    limit=word_pad-word_count_right)
-                                text_block_next_page = self.doc[pageno+1].get_textbox((0, 0, self.doc[pageno-1].rect.width, last_word_next_page[3]))
-                                text_block = text_block + '\n\n' + text_block_next_page
-
-                            # Remove funny characters
-                            text_block = self.tidy_text(text_block)
-
-                            # Add results to be displayed in the table
-                            doc_results.append([self.filepath,
-                                                pageno+1,
-                                                keyword,
-                                                text_block,
-                                                instance])
+        for pageno, page_results, page_instances in self.iter_search(keywords=keywords, word_pad=word_pad, pages=pages, mode=mode):
+            doc_results += page_results
+            doc_instances[pageno] = page_instances
 
         return doc_results, doc_instances
 
 
+    def iter_search(self, keywords, word_pad=10, pages=None, mode=None):
+        """
+        Search for keywords in the document page by page, yielding the results of each page as soon as it has been searched.
+
+        Words are extracted one page at a time, and only the words of the previous, current, and next pages are kept, so memory use does not grow with the number of pages.
+        If pages are given, only those pages and the pages either side of them (for the text blocks) are read.
+        If the mode limits the number of results, the search stops as soon as the limits have been reached, without reading the rest of the document.
+
+        Parameters
+        ----------
+        keywords : list, KeywordMatcher or QueryMatcher (required)
+            List of keywords, key phrases or queries to search for, or a matcher already compiled from the keywords with compile_keywords.
+
+        word_pad : int (default=10)
+            Number of words to return either side of the keywords found.
+
+        pages : list (default=None)
+            Page numbers (starting from 0) to search. If None, all pages are searched.
+
+        mode : SearchMode (default=None)
+            Limits on the results to find, and whether to get the text blocks of the results. If None, all results are found with their text blocks.
+
+        Yields
+        ------
+        pageno : int
+            Page number (starting from 0), for each page with words which has been searched.
+
+        page_results : list
+            Results rows found in the page, as in search_for_keywords.
+
+        page_instances : list
+            Keyword instances found in the page.
+        """
+        # Compile the keywords so that all keywords are found in one pass over each page
+        matcher = compile_keywords(keywords)
+        pages = None if pages is None else set(pages)
+        mode = SearchMode() if mode is None else mode
+        hit_counts = {}
+
+        # Read one page ahead so that overflow words on the next page can be added to the text blocks of the results.
+        # Index the words of each page to quickly find the words around each keyword.
+        # Without text blocks, each page is searched as soon as it has been read.
+        if pages is None:
+            page_words = self.iter_page_words()
+        elif mode.text_blocks:
+            page_words = self.iter_page_words(pagenos={neighbour for pageno in pages for neighbour in (pageno-1, pageno, pageno+1)})
+        else:
+            page_words = self.iter_page_words(pagenos=pages)
+        page_window = {}
+        try:
+            for pageno, words in itertools.chain(page_words, [(None, None)]):
+                if not mode.text_blocks:
+                    if pageno is None:
+                        break
+                    page_window = {pageno: (words, None)}
+                    search_pageno = pageno
+
+                # Add the page just read, and search the page before it. At the end of the document, search the last page.
+                elif pageno is None:
+                    search_pageno = max(page_window, default=-1)
+                else:
+                    with self.metrics.timer('index_words'):
+                        page_window[pageno] = (words, WordIndex(words) if (pages is None) or (pages & {pageno-1, pageno, pageno+1}) else None)
+                    search_pageno = pageno-1
+                for old_pageno in [window_pageno for window_pageno in page_window if window_pageno < search_pageno-1]:
+                    del page_window[old_pageno]
+                if (search_pageno in page_window) and page_window[search_pageno][0] and ((pages is None) or (search_pageno in pages)):
+                    yield (search_pageno, ) + self.search_page(matcher=matcher, word_pad=word_pad, pageno=search_pageno, page_window=page_window, mode=mode, hit_counts=hit_counts)
+
+                    # Stop when the limits of the mode have been reached
+                    if mode.is_limited and mode.is_finished(hit_counts, matcher.keywords):
+                        self.metrics.count('stopped_early')
+                        break
+        finally:
+            page_words.close()
+
+
+    def search_page(self, matcher, word_pad, pageno, page_window, mode=None, hit_counts=None):
+        """
+        Search for keywords in a page of the document.
+
+        Parameters
+        ----------
+        matcher : KeywordMatcher or QueryMatcher (required)
+            The compiled keywords to search for. Instances of keywords are rects, and instances of queries are lists of rects covering all of the terms of a match, which give one result.
+
+        word_pad : int (required)
+            Number of words to return either side of the keywords found.
+
+        pageno : int (required)
+            Page number (starting from 0) to search.
+
+        page_window : dict (required)
+            Dict where the keys are page numbers, and the values are tuples of the page words and WordIndex, for the page and the pages either side of it (if they exist).
+            Without text blocks, only the words of the page are needed.
+
+        mode : SearchMode (default=None)
+            Limits on the results to find. If None, all results are found with their text blocks.
+
+        hit_counts : dict (default=None)
+            Number of results found in the document so far, as in SearchMode.take. Required if the mode limits the number of results.
+
+        Returns
+        -------
+        page_results : list
+            Results rows found in the page.
+
+        page_instances : list
+            Keyword instances found in the page.
+        """
+        words, word_index = page_window[pageno]
+        prev_words, prev_index = page_window.get(pageno-1, (None, None))
+        next_words, next_index = page_window.get(pageno+1, (None, None))
+
+        page_results = []
+        page_instances = []
+        self.metrics.count('pages_searched')
+        with self.metrics.timer('match'):
+            page_matches = matcher.search_page(words)
+        for keyword, instances in page_matches:
+            if (mode is not None) and mode.is_limited:
+                instances = mode.take(keyword, instances, hit_counts)
+
+            # Get the keyword instances
+            if instances:
+                self.metrics.count('hits', len(instances))
+                for instance in instances:
+                    text_block_start = time.perf_counter()
+                    instance_rects = instance if isinstance(instance, list) else [instance]
+                    page_instances += instance_rects
+                    if (mode is not None) and not mode.text_blocks:
+                        page_results.append([self.filepath, pageno+1, keyword, '', instance_rects[0]])
+                        continue
+
+                    # Get a nuber of words (word_pad) either side of the keyword/ phrase, and get the bounding rect
+                    word_start = word_index.find_bounding_words(rect=instance_rects[0])[0]
+                    word_end = word_index.find_bounding_words(rect=instance_rects[-1])[1]
+                    word_count_left, first_word = word_index.words_before(index=word_start, limit=word_pad)
+                    word_count_right, last_word = word_index.words_after(index=word_end+1, limit=word_pad)
+                    text_block = word_index.get_text(top=words[word_start][1] if first_word is None else first_word[1],
+                                                     bottom=words[word_end][3] if last_word is None else last_word[3])
+
+                    # Get overflow words on the previous and next page
+                    if (word_count_left<word_pad) and prev_words:
+                        word_count_prev_page, first_word_prev_page = prev_index.words_before(index=len(prev_words), limit=word_pad-word_count_left)
+                        text_block_prev_page = prev_index.get_text(top=first_word_prev_page[1], bottom=prev_words[-1][3])
+                        text_block = text_block_prev_page + '\n\n' + text_block
+                    if (word_count_right<word_pad) and next_words:
+                        word_count_next_page, last_word_next_page = next_index.words_after(index=0, limit=word_pad-word_count_right)
+                        text_block_next_page = next_index.get_text(top=0, bottom=last_word_next_page[3])
+                        text_block = text_block + '\n\n' + text_block_next_page
+
+                    # Remove funny characters
+                    text_block = self.tidy_text(text_block)
+
+                    # Add results to be displayed in the table
+                    page_results.append([self.filepath,
+                                         pageno+1,
+                                         keyword,
+                                         text_block,
+                                         instance_rects[0]])
+                    self.metrics.add_time('text_blocks', time.perf_counter()-text_block_start)
+
+        return page_results, page_instances
+
+
     def iterate_words_limit(self, words, limit):
         """
         Iterate through words, counting numbers of words accounting for special space characters, and stop when the limit is reached.
@@ -171,15 +329,93 @@ class Document:
         """
         Extract words from the document in order.
         Remove page numbers.
+        If the document has a word cache, the words are read from the cache if the document has not changed, and saved to the cache otherwise.
 
         Returns
         -------
         doc_words : dict
             List of fitz word objects for each page of the document.
         """
-        doc_words = {}
-        for page in self.doc:
-            page_words = sorted(list(page.get_text("words")), key=lambda word: [word[1], word[0]])
+        return dict(self.iter_page_words())
+
+
+    def iter_page_words(self, pagenos=None):
+        """
+        Extract words from the document in order, one page at a time.
+        If the document has a word cache, the words are read from the cache if the document has not changed, and saved to the cache otherwise.
+        Only all of the pages of a document are saved to the cache, so the words of some pages are not saved.
+
+        Parameters
+        ----------
+        pagenos : list (default=None)
+            Page numbers (starting from 0) to read. Page numbers which are not in the document are ignored. If None, all pages are read.
+
+        Yields
+        ------
+        pageno : int
+            Page number (starting from 0).
+
+        page_words : list
+            List of fitz word objects for the page, as returned by get_page_words.
+        """
+        if self.word_cache is not None:
+            if self.word_cache.has_words(self.filepath):
+                cached_pages = self.word_cache.iter_words(self.filepath, pagenos=pagenos)
+                while True:
+                    with self.metrics.timer('cache_read'):
+                        cached_page = next(cached_pages, None)
+                    if cached_page is None:
+                        return
+                    self.metrics.count('pages')
+                    yield cached_page
+            if pagenos is None:
+                cache_writer = self.word_cache.writer(self.filepath)
+
+        if pagenos is not None:
+            for pageno in sorted(pageno for pageno in set(pagenos) if 0 <= pageno < self.total_pages):
+                page_words = self.get_page_words(self.doc[pageno])
+                self.metrics.count('pages')
+                yield pageno, page_words
+            return
+
+        try:
+            for page in self.doc:
+                page_words = self.get_page_words(page)
+                self.metrics.count('pages')
+                if self.word_cache is not None:
+                    with self.metrics.timer('cache_write'):
+                        cache_writer.add_page(page.number, page_words)
+                yield page.number, page_words
+        except GeneratorExit:
+            # The search stopped before the end of the document, so its words are not complete
+            if self.word_cache is not None:
+                cache_writer.cancel()
+            raise
+
+        if self.word_cache is not None:
+            with self.metrics.timer('cache_write'):
+                cache_writer.finish(total_pages=self.total_pages)
+
+
+    def get_page_words(self, page):
+        """
+        Extract words from a page of the document in order.
+        Remove page numbers.
+
+        Parameters
+        ----------
+        page : fitz page object (required)
+            The page to extract words from.
+
+        Returns
+        -------
+        page_words : list
+            List of fitz word objects for the page.
+        """
+        with self.metrics.timer('extract'):
+            page_words = page.get_text("words")
+        with self.metrics.timer('sort'):
+            page_words = sorted(list(page_words), key=lambda word: [word[1], word[0]])
             if page_words and (len(page_words) > 1):
                 # Remove page numbers: if the last word is a long way below the previous word and an integer
                 if (page_words[-1][1]-page_words[-2][3]) > 2*(page_words[-2][3]-page_words[-2][1]):
@@ -187,9 +423,7 @@ class Document:
                         page_words = page_words[:-1]
                         if self.is_page_number(page_words[-1][4]):
                             page_words = page_words[:-1]
-            doc_words[page.number] = page_words
-
-        return doc_words
+        return page_words
 
 
     def is_page_number(self, text):
@@ -222,6 +456,7 @@ class Document:
         """
         txt = txt.replace('\xa0', ' ')\
                   .replace('\uf0b7 \n', ' - ')\
+                  .replace('\uf0b7\n', ' - ')\
                   .strip()
         return txt
 
@@ -245,4 +480,5 @@ class Document:
         """
         Close the open document.
         """
-        self.doc.close()
+        if self._doc is not None:
+            self._doc.close()
@@ -0,0 +1,83 @@
+"""
+Find copies of the same document, so that each document is only searched once
+"""
+import os
+import hashlib
+import settings
+
+# Set up logging
+logger = settings.get_logger("document_deduplicator")
+
+
+class DocumentDeduplicator:
+    """
+    Find files with the same content as a file seen before, comparing files cheaply: first by size, then by a hash of the start and end of the file, then by a hash of the whole file.
+
+    Files are only read if another file has the same size, and only hashed in full if the start and end of the files are the same.
+
+    Parameters
+    ----------
+    partial_bytes : int (default=65536)
+        Number of bytes at the start and at the end of files to hash before hashing the whole file.
+    """
+    def __init__(self, partial_bytes=65536):
+        self.partial_bytes = partial_bytes
+        self.sizes = {} # Files of each size, which are not copies of other files
+        self.partial_hashes = {}
+        self.full_hashes = {}
+        self.duplicates = {} # Original file of each copy
+
+
+    def original_of(self, filepath):
+        """
+        Find the file seen before with the same content as a file. If there is none, the file is recorded so that later copies of it are found.
+
+        Parameters
+        ----------
+        filepath : str (required)
+            Path to the file.
+
+        Returns
+        -------
+        original : str or None
+            Path of the first file seen with the same content, or None if the file is not a copy of a file seen before, or can not be read.
+        """
+        try:
+            size = os.path.getsize(filepath)
+            for candidate in self.sizes.get(size, []):
+                if (self.partial_hash(candidate) == self.partial_hash(filepath)) and (self.full_hash(candidate) == self.full_hash(filepath)):
+                    self.duplicates[filepath] = candidate
+                    return candidate
+        except OSError as err:
+            logger.warning('Could not compare with other documents', extra={'filepath': filepath, 'error': str(err)})
+            return None
+        self.sizes.setdefault(size, []).append(filepath)
+        return None
+
+
+    def partial_hash(self, filepath):
+        """
+        Hash the start and the end of a file.
+        """
+        if filepath not in self.partial_hashes:
+            file_hash = hashlib.sha1()
+            with open(filepath, 'rb') as f:
+                file_hash.update(f.read(self.partial_bytes))
+                if os.fstat(f.fileno()).st_size > 2*self.partial_bytes:
+                    f.seek(-self.partial_bytes, os.SEEK_END)
+                file_hash.update(f.read(self.partial_bytes))
+            self.partial_hashes[filepath] = file_hash.digest()
+        return self.partial_hashes[filepath]
+
+
+    def full_hash(self, filepath):
+        """
+        Hash the whole of a file.
+        """
+        if filepath not in self.full_hashes:
+            file_hash = hashlib.sha1()
+            with open(filepath, 'rb') as f:
+                for block in iter(lambda: f.read(1024*1024), b''):
+                    file_hash.update(block)
+            self.full_hashes[filepath] = file_hash.digest()
+        return self.full_hashes[filepath]
@@ -0,0 +1,352 @@
+"""
+Save copies of documents with the keywords found highlighted
+"""
+import os
+import shutil
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import settings
+from worker_pool import WorkerPool
+
+# Set up logging
+logger = settings.get_logger("document_exporter")
+
+# Ways of saving the highlighted documents, and the descriptions shown in the GUI
+EXPORT_MODES = {
+    'incremental': 'Whole documents (fast)',
+    'full': 'Whole documents (rewritten)',
+    'pages': 'Only pages containing keywords',
+}
+
+
+def export_document(filepath, export_path, page_rects, mode='incremental'):
+    """
+    Save a copy of a document with the keywords highlighted.
+
+    This is a module level function so that it can be run in worker processes.
+
+    Parameters
+    ----------
+    filepath : str (required)
+        Path to the document.
+
+    export_path : str (required)
+        Path to save the highlighted document to. Folders are created if required.
+
+    page_rects : dict (required)
+        Dict where the keys are page numbers, and the values are lists of rects to highlight, as in Document.highlight_doc.
+
+    mode : str (default='incremental')
+        How to save the document:
+        'incremental' copies the file and appends the highlights to the copy, which is fastest for large documents.
+        'full' rewrites the whole document.
+        'pages' only saves the pages containing keywords, removing the unused objects of the other pages.
+    """
+    import fitz # Imported here so that the GUI can import the export modes without loading PyMuPDF at startup
+    if mode not in EXPORT_MODES:
+        raise ValueError(f'Unknown export mode {mode}')
+    os.makedirs(os.path.dirname(os.path.abspath(export_path)), exist_ok=True)
+    pagenos = sorted([pageno for pageno, rects in page_rects.items() if rects])
+
+    if mode == 'incremental':
+        shutil.copyfile(filepath, export_path)
+        doc = fitz.open(export_path)
+    else:
+        doc = fitz.open(filepath)
+    rewrite = False
+    try:
+        for pageno in pagenos:
+            page = doc[pageno]
+            for rect in page_rects[pageno]:
+                page.add_highlight_annot(rect)
+
+        if mode == 'incremental':
+            # Some documents (for example repaired or encrypted documents) can not be appended to, so are rewritten
+            if doc.can_save_incrementally():
+                doc.saveIncr()
+            else:
+                rewrite = True
+                doc.save(export_path + '.tmp')
+        elif mode == 'pages':
+            doc.select(pagenos)
+            doc.save(export_path, garbage=1)
+        else:
+            doc.save(export_path)
+    finally:
+        doc.close()
+    if rewrite:
+        os.replace(export_path + '.tmp', export_path)
+
+
+def export_document_safely(filepath, export_path, page_rects, mode):
+    """
+    Save a highlighted copy of a document, returning an error message instead of raising an exception so that other documents are still saved.
+    """
+    try:
+        export_document(filepath, export_path, page_rects, mode=mode)
+        return None
+    except Exception as err:
+        logger.exception('Error saving highlighted document', extra={'filepath': filepath})
+        return f'Could not save {filepath}: {err}'
+
+
+def copy_export(export_path, copy_export_path):
+    """
+    Copy a saved highlighted document for a copy of the document, instead of highlighting it again.
+
+    Returns
+    -------
+    error : str or None
+        Error message if the document could not be copied.
+    """
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(copy_export_path)), exist_ok=True)
+        shutil.copyfile(export_path, copy_export_path)
+    except Exception as err:
+        logger.exception(f'Error copying highlighted document {export_path}', extra={'filepath': copy_export_path})
+        return f'Could not save {copy_export_path}: {err}'
+    return None
+
+
+class DocumentExporter:
+    """
+    Save highlighted copies of the documents containing keywords, in parallel worker processes.
+
+    Parameters
+    ----------
+    workers : int (default=1)
+        Number of worker processes to save documents in parallel. If 1, documents are saved in the current process.
+
+    mode : str (default='incremental')
+        How to save the documents, one of the keys of EXPORT_MODES. See export_document.
+
+    poll_interval : float (default=0.2)
+        Maximum time in seconds to wait for a worker process before checking whether the export has been stopped.
+    """
+    def __init__(self, workers=1, mode='incremental', poll_interval=0.2):
+        if mode not in EXPORT_MODES:
+            raise ValueError(f'Unknown export mode {mode}')
+        self.workers = max(1, int(workers))
+        self.mode = mode
+        self.poll_interval = poll_interval
+
+
+    def export_documents(self, keyword_instances, search_folder, export_folder, should_stop=None, duplicates=None):
+        """
+        Save highlighted copies of the documents containing keywords in the export folder, keeping the folder structure of the search folder.
+
+        Documents are yielded in the order they finish saving, which is not the order of keyword_instances when saving in parallel.
+        Copies of the same document are only highlighted once: the saved document is copied for the other copies.
+
+        Parameters
+        ----------
+        keyword_instances : dict (required)
+            Dict where the keys are the document paths relative to the search folder, and the values are the keyword instances found on each page, as in settings.keyword_instances. Documents without keywords are not saved.
+
+        search_folder : str (required)
+            Path to the folder which was searched, which contains the documents.
+
+        export_folder : str (required)
+            Path to the folder to save the documents to.
+
+        should_stop : function (default=None)
+            Function returning True if the export should be stopped.
+
+        duplicates : dict (default=None)
+            Dict where the keys are the paths of copies of documents relative to the search folder, and the values are the paths of the original documents, as in settings.duplicate_documents.
+
+        Yields
+        ------
+        document_path : str
+            Path of the document relative to the search folder.
+
+        error : str or None
+            Error message if the document could not be saved.
+        """
+        # Copies of each document to save, when the original is also being saved
+        duplicates = duplicates or {}
+        copies = {}
+        for document_path, page_rects in keyword_instances.items():
+            original = duplicates.get(document_path)
+            if page_rects and any(page_rects.values()) and (original in keyword_instances):
+                copies.setdefault(original, []).append(document_path)
+        copied = {document_path for document_paths in copies.values() for document_path in document_paths}
+
+        tasks = [(os.path.join(search_folder, document_path), os.path.join(export_folder, document_path), page_rects, self.mode, document_path)
+                 for document_path, page_rects in keyword_instances.items() if page_rects and any(page_rects.values()) and (document_path not in copied)]
+        for document_path, error in self.export_unique_documents(tasks, should_stop):
+            yield document_path, error
+            for copy_path in copies.get(document_path, []):
+                if should_stop and should_stop():
+                    return
+                yield copy_path, error or copy_export(os.path.join(export_folder, document_path), os.path.join(export_folder, copy_path))
+
+
+    def export_unique_documents(self, tasks, should_stop=None):
+        """
+        Save the documents of a list of export tasks, as in export_documents, yielding (document path, error) as each document is saved.
+        """
+
+        # Save in the current process
+        if self.workers == 1:
+            for *task, document_path in tasks:
+                if should_stop and should_stop():
+                    return
+                yield document_path, export_document_safely(*task)
+            return
+
+        # Save in worker processes, keeping a limited number of documents queued so that stopping is quick
+        executor = WorkerPool(self.workers, poll_interval=self.poll_interval)
+        try:
+            futures = {}
+            next_submit = 0
+            while futures or (next_submit < len(tasks)):
+                if should_stop and should_stop():
+                    return
+                while (next_submit < len(tasks)) and (len(futures) < 2*self.workers):
+                    *task, document_path = tasks[next_submit]
+                    futures[executor.submit(export_document_safely, *task, description=document_path)] = document_path
+                    next_submit += 1
+                done, _ = wait(futures, timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+                for future in done:
+                    document_path = futures.pop(future)
+                    try:
+                        error = future.result()
+                    except Exception as err:
+                        logger.exception('Error saving highlighted document', extra={'filepath': document_path})
+                        error = f'Could not save {document_path}: {err}'
+                    yield document_path, error
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+    def export_for_window(self, keyword_instances, search_folder, export_folder, window, duplicates=None):
+        """
+        Save highlighted copies of the documents containing keywords, sending progress to the window. Run in a thread so that the window does not freeze.
+
+        Sends a '-EXPORT DOCUMENTS PROGRESS-' event with (documents saved, total documents) after each document, and a '-EXPORT DOCUMENTS DONE-' event with a message when finished.
+        The export is stopped if settings.exporting is set to False.
+
+        Parameters
+        ----------
+        keyword_instances : dict (required)
+            Keyword instances of each document, as in settings.keyword_instances.
+
+        search_folder : str (required)
+            Path to the folder which was searched, which contains the documents.
+
+        export_folder : str (required)
+            Path to the folder to save the documents to.
+
+        window : PySimpleGUI window object (required)
+            Window to send the progress events to.
+
+        duplicates : dict (default=None)
+            Original document of each copy of a document, as in settings.duplicate_documents.
+        """
+        total = len([page_rects for page_rects in keyword_instances.values() if page_rects and any(page_rects.values())])
+        saved = failed = 0
+        try:
+            for document_path, error in self.export_documents(keyword_instances, search_folder, export_folder, should_stop=lambda: not settings.exporting, duplicates=duplicates):
+                if error:
+                    failed += 1
+                else:
+                    saved += 1
+                window.write_event_value('-EXPORT DOCUMENTS PROGRESS-', (saved+failed, total))
+        except Exception as err:
+            logger.exception('Error saving highlighted documents')
+            failed = total-saved
+        if not settings.exporting:
+            message = f'Saving documents cancelled, {saved} of {total} documents saved'
+        elif failed:
+            message = f'{saved} documents saved, {failed} could not be saved'
+        else:
+            message = f'{saved} documents saved successfully'
+        logger.info(message)
+        settings.exporting = False
+        window.write_event_value('-EXPORT DOCUMENTS DONE-', message)
+
+
+class HighlightedCopies:
+    """
+    Highlighted copies of documents to open in another application, reused while the document and its highlights are unchanged.
+
+    Copies are named from a hash of the document path, size, modification time and highlights, and are saved in a background thread.
+
+    Parameters
+    ----------
+    folder : str (required)
+        Folder to save the copies in, such as a temporary directory.
+
+    mode : str (default='incremental')
+        How to save the copies, one of the keys of EXPORT_MODES.
+    """
+    def __init__(self, folder, mode='incremental'):
+        self.folder = folder
+        self.mode = mode
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.saving = set()
+        self.lock = threading.Lock()
+
+
+    def copy_path(self, filepath, page_rects):
+        """
+        Get the path of the highlighted copy of a document, which changes if the document or its highlights change.
+        """
+        stat = os.stat(filepath)
+        highlights = sorted([(pageno, [tuple(rect) for rect in rects]) for pageno, rects in page_rects.items() if rects])
+        key = hashlib.sha1(repr((os.path.abspath(filepath), stat.st_size, stat.st_mtime_ns, highlights)).encode('utf-8')).hexdigest()[:16]
+        stem, extension = os.path.splitext(os.path.basename(filepath))
+        return os.path.join(self.folder, f'{stem}-{key}{extension}')
+
+
+    def get(self, filepath, page_rects, window, event_value=None):
+        """
+        Get the highlighted copy of a document, saving it in the background if it does not exist yet.
+
+        Parameters
+        ----------
+        filepath : str (required)
+            Path to the document.
+
+        page_rects : dict (required)
+            Rects to highlight on each page, as in Document.highlight_doc.
+
+        window : PySimpleGUI window object (required)
+            Window to send a '-HIGHLIGHTED COPY READY-' event to with (copy path or None if it could not be saved, event_value) when a new copy has been saved.
+
+        event_value : object (default=None)
+            Value to send with the event, for example the page to open the copy at.
+
+        Returns
+        -------
+        copy_path : str or None
+            Path of the copy if it already exists, otherwise None.
+        """
+        copy_path = self.copy_path(filepath, page_rects)
+        if os.path.isfile(copy_path):
+            return copy_path
+        with self.lock:
+            if copy_path not in self.saving:
+                self.saving.add(copy_path)
+                self.executor.submit(self.save, filepath, copy_path, page_rects, window, event_value)
+        return None
+
+
+    def save(self, filepath, copy_path, page_rects, window, event_value):
+        """
+        Save a highlighted copy, renaming it when complete so that partly saved copies are not used. Run in the background thread.
+        """
+        partial_path = copy_path + '.partial.pdf'
+        saved_path = None
+        try:
+            export_document(filepath, partial_path, page_rects, mode=self.mode)
+            os.replace(partial_path, copy_path)
+            saved_path = copy_path
+        except Exception as err:
+            logger.exception('Error saving highlighted copy', extra={'filepath': filepath})
+        finally:
+            with self.lock:
+                self.saving.discard(copy_path)
+        window.write_event_value('-HIGHLIGHTED COPY READY-', (saved_path, event_value))
@@ -2,31 +2,631 @@
 Document class
 """
 import os
+import time
+from collections import deque
+import fnmatch
+import cProfile
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
 import settings
 from document import Document
+from query import compile_keywords
+from result_store import ResultStore
+from metrics import Metrics
+from document_deduplicator import DocumentDeduplicator
+from worker_pool import WorkerPool, WorkerLimitError
 
 # Set up logging
 logger = settings.get_logger("document_searcher")
 
 
+def find_documents(search_folder, include=None, exclude=None):
+    """
+    Find the PDF documents in a folder, including in subfolders.
+
+    Parameters
+    ----------
+    search_folder : str (required)
+        Path to the folder to search.
+
+    include, exclude : list (default=None)
+        Glob patterns of the files to include and exclude, as in DocumentFinder.
+
+    Returns
+    -------
+    filepaths : list
+        List of paths to the PDF files in the folder, in the order of DocumentFinder.
+    """
+    return list(DocumentFinder(search_folder, include=include, exclude=exclude))
+
+
+class DocumentFinder:
+    """
+    Find the documents in a folder and its subfolders, yielding each document as soon as it is found so that searching can start before all folders have been listed.
+
+    Folders are listed with os.scandir in a pool of threads, so that slow network folders are listed in parallel. Documents are yielded in a fixed order: the files of a folder in name order, then the documents of each subfolder in name order.
+    The number of documents found so far is kept in found, and finished is set to True when all folders have been listed.
+
+    Parameters
+    ----------
+    search_folder : str (required)
+        Path to the folder to search.
+
+    include : list (default=None)
+        Glob patterns of the file names to include, not case sensitive. If None, settings.DOCUMENT_INCLUDE is used (PDF files).
+
+    exclude : list (default=None)
+        Glob patterns of the file and folder names, or paths relative to the search folder, to exclude. Excluded folders are not listed.
+
+    threads : int (default=8)
+        Number of folders to list in parallel.
+
+    should_stop : function (default=None)
+        Function returning True if the search for documents should be stopped.
+
+    poll_interval : float (default=0.2)
+        Maximum time in seconds to wait for a folder to be listed before checking whether the search has been stopped.
+    """
+    def __init__(self, search_folder, include=None, exclude=None, threads=8, should_stop=None, poll_interval=0.2):
+        self.search_folder = search_folder
+        self.include = [pattern.lower() for pattern in (settings.DOCUMENT_INCLUDE if include is None else include)]
+        self.exclude = [pattern.lower() for pattern in (exclude or [])]
+        self.threads = threads
+        self.should_stop = should_stop
+        self.poll_interval = poll_interval
+        self.found = 0
+        self.finished = False
+
+
+    def is_excluded(self, relative_path, name):
+        """
+        Check whether a file or folder matches one of the exclude patterns.
+        """
+        return any(fnmatch.fnmatchcase(name.lower(), pattern) or fnmatch.fnmatchcase(relative_path.lower(), pattern) for pattern in self.exclude)
+
+
+    def scan_folder(self, executor, folder):
+        """
+        List a folder, starting to list its subfolders in the pool of threads.
+
+        Returns
+        -------
+        filepaths : list
+            Paths of the documents in the folder, in name order.
+
+        subfolders : list
+            Futures of the listings of the subfolders, in name order.
+        """
+        filepaths = []
+        subfolders = []
+        try:
+            with os.scandir(folder) as entries:
+                entries = sorted(entries, key=lambda entry: entry.name)
+        except OSError as err:
+            logger.warning('Could not list folder', extra={'filepath': folder, 'error': str(err)})
+            return filepaths, subfolders
+        for entry in entries:
+            relative_path = os.path.relpath(entry.path, self.search_folder).replace(os.sep, '/')
+            try:
+                if self.is_excluded(relative_path, entry.name):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    subfolders.append(executor.submit(self.scan_folder, executor, entry.path))
+                elif entry.is_file() and any(fnmatch.fnmatchcase(entry.name.lower(), pattern) for pattern in self.include):
+                    filepaths.append(entry.path)
+            except OSError as err:
+                logger.warning('Could not read file', extra={'filepath': entry.path, 'error': str(err)})
+            except RuntimeError:
+                # The pool of threads has been shut down because the search has been stopped
+                break
+        return filepaths, subfolders
+
+
+    def __iter__(self):
+        self.found = 0
+        self.finished = False
+        executor = ThreadPoolExecutor(max_workers=self.threads)
+        try:
+            folders = [executor.submit(self.scan_folder, executor, self.search_folder)]
+            while folders:
+                # Wait for the next folder in order, checking whether to stop
+                future = folders.pop()
+                while not future.done():
+                    if self.should_stop and self.should_stop():
+                        return
+                    wait([future], timeout=self.poll_interval)
+                filepaths, subfolders = future.result()
+                for filepath in filepaths:
+                    self.found += 1
+                    yield filepath
+                folders += reversed(subfolders)
+            self.finished = True
+            logger.info(f'Found {self.found} documents in {self.search_folder}')
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def search_document(filepath, keywords, word_pad, word_cache=None, pages=None, mode=None, metrics=None):
+    """
+    Open a document and search it for keywords. Errors are logged and do not stop the search of other documents.
+
+    The time taken is added to the metrics, and documents slower than settings.SLOW_DOCUMENT_SECONDS are logged.
+
+    This is a module level function so that it can be run in worker processes.
+
+    Parameters
+    ----------
+    filepath : str (required)
+        Path to the document to search.
+
+    keywords : list or KeywordMatcher (required)
+        The keywords to search for.
+
+    word_pad : int (required)
+        The number of words to be returned either side of the found keyword.
+
+    word_cache : WordCache (default=None)
+        Cache of words extracted from documents.
+
+    pages : list (default=None)
+        Page numbers (starting from 0) to search. If None, all pages are searched.
+
+    mode : SearchMode (default=None)
+        Limits on the results to find in the document. If None, all results are found.
+
+    metrics : Metrics (default=None)
+        Metrics of the search to add the time of each stage of searching the document to. If None, the time is not kept.
+
+    Returns
+    -------
+    results : list or None
+        Results rows found in the document, or None if the document could not be searched.
+
+    instances : dict or None
+        Keyword instances found on each page of the document, or None if the document could not be searched.
+
+    warning : str or None
+        Warning message to show to the user if the document was skipped.
+    """
+    results = instances = warning = None
+    metrics = Metrics() if metrics is None else metrics
+    start = time.perf_counter()
+    try:
+
+        # Create the document
+        doc = Document(filepath=filepath, word_cache=word_cache, metrics=metrics)
+        if doc.file_extension.lower() != '.pdf':
+            doc.close()
+            return results, instances, f'Skipping file {filepath} as it is not a PDF.'
+
+        # Search for keywords in the file
+        results = []; instances = {}
+        try:
+            results, instances = doc.search_for_keywords(keywords=keywords, word_pad=word_pad, pages=pages, mode=mode)
+            doc.close()
+        except Exception as err:
+            logger.exception('Error searching for keywords in document', extra={'filepath': filepath})
+
+    # Catch any exceptions and log to the log file
+    except Exception as err:
+        logger.exception('Error opening document', extra={'filepath': filepath})
+
+    seconds = time.perf_counter()-start
+    metrics.add_document(filepath, seconds)
+    if seconds > settings.SLOW_DOCUMENT_SECONDS:
+        logger.warning('Slow document', extra={'filepath': filepath, 'seconds': round(seconds, 1)})
+    return results, instances, warning
+
+
+def copy_outcome(outcome, original, copy_path):
+    """
+    Make the outcome of searching a copy of a document from the outcome of searching the original, as returned by search_document.
+
+    Parameters
+    ----------
+    outcome : tuple or None
+        (results, instances, warning) of the original, or None if nothing was found in the original.
+
+    original : str
+        Path of the original document.
+
+    copy_path : str
+        Path of the copy.
+
+    Returns
+    -------
+    results, instances, warning
+        As returned by search_document, with the results rows and warning given for the copy. The instances are shared with the original.
+    """
+    if outcome is None:
+        return [], {}, None
+    results, instances, warning = outcome
+    if results is not None:
+        results = [[copy_path] + list(result[1:]) for result in results]
+    if warning:
+        warning = warning.replace(original, copy_path)
+    return results, instances, warning
+
+
+# Search parameters of a worker process, set once when the worker process starts
+worker_search = {}
+
+def init_worker(keywords, word_pad, word_cache, mode=None):
+    """
+    Set the search parameters of a worker process, so that they are not sent again with every file.
+    """
+    worker_search.update(keywords=keywords, word_pad=word_pad, word_cache=word_cache, mode=mode)
+
+# Keywords compiled in a worker process of a pool shared by searches, for the last few searches
+worker_matchers = {}
+
+def search_document_in_worker(filepath, pages=None):
+    """
+    Search a document for keywords in a worker process, using the search parameters set by init_worker. If pages are given, only those pages are searched.
+
+    Returns the outcome of search_document, and the metrics of the search as a dict to combine with the metrics of the other documents.
+    """
+    file_metrics = Metrics()
+    return search_document(filepath, pages=pages, metrics=file_metrics, **worker_search), file_metrics.to_dict()
+
+def search_document_in_pool(filepath, keywords, word_pad, mode=None, pages=None):
+    """
+    Search a document for keywords in a worker process of a pool shared by searches for different keywords, such as the pool of the search service. The word cache is set by init_worker.
+
+    The keywords are compiled the first time each worker process searches a document for them, and kept for the next documents of the search. If pages are given, only those pages are searched.
+
+    Returns the outcome of search_document, and the metrics of the search as a dict to combine with the metrics of the other documents.
+    """
+    keywords = tuple(keywords)
+    matcher = worker_matchers.get(keywords)
+    if matcher is None:
+        if len(worker_matchers) >= 8:
+            worker_matchers.clear()
+        matcher = worker_matchers[keywords] = compile_keywords(list(keywords))
+    file_metrics = Metrics()
+    return search_document(filepath, matcher, word_pad, word_cache=worker_search.get('word_cache'), pages=pages, mode=mode, metrics=file_metrics), file_metrics.to_dict()
+
+
 class DocumentSearcher:
     """
     Module to loop through a given list of documents, search for keywords, and print the output to the window.
+
+    Parameters
+    ----------
+    word_cache : WordCache (default=None)
+        Cache of words extracted from documents, so that unchanged documents are not extracted again.
+
+    workers : int (default=1)
+        Number of worker processes to search documents in parallel. If 1, documents are searched in the current process.
+
+    poll_interval : float (default=0.2)
+        Maximum time in seconds to wait for a worker process before checking whether the search has been stopped.
+
+    index : CorpusIndex (default=None)
+        Inverted index of the words of the documents. If given, only the pages of documents which the index shows may contain the keywords are searched, and new and changed documents are searched in full and added to the index.
+
+    profile_path : str (default=None)
+        If given, searches are profiled with cProfile and the profile is saved to this path, to read with pstats. Documents are searched in the current process so that all of the search is profiled.
+
+    deduplicate : bool (default=True)
+        Whether to search documents with the same content only once. Copies of a document get the results of the first copy found, with their own file name.
+
+    time_limit : float (default=None)
+        Maximum time in seconds to search each document. A document taking longer is stopped and skipped with a warning. If None, documents are not limited in time.
+
+    memory_limit : int (default=None)
+        Maximum memory in bytes of the worker process searching a document. A document using more is stopped and skipped with a warning. If None, memory is not limited.
+
+    mode : SearchMode (default=None)
+        Limits on the results to find in each document, from search_modes.get_search_mode. The search of a document stops as soon as its limits have been reached. If None, all results are found.
+
+    pool : WorkerPool (default=None)
+        Pool of worker processes kept running between searches, started with init_worker to set the word cache, such as the pool of the search service. If given, documents are searched in the pool, with the time and memory limits of the pool, and the pool is left running after the search.
+
+    If there is a time or memory limit, documents are always searched in worker processes, so that they can be stopped, even if there is only one worker. The limits do not apply while profiling, which searches in the current process.
     """
-    def __init__(self):
-        pass
+    def __init__(self, word_cache=None, workers=1, poll_interval=0.2, index=None, profile_path=None, deduplicate=True, time_limit=None, memory_limit=None, mode=None, pool=None):
+        self.word_cache = word_cache
+        self.index = index
+        self.workers = max(1, int(workers))
+        self.poll_interval = poll_interval
+        self.profile_path = profile_path
+        self.deduplicate = deduplicate
+        self.time_limit = time_limit
+        self.memory_limit = memory_limit
+        self.mode = mode
+        self.pool = pool
+        self.metrics = Metrics()
+        self.duplicates = {}
 
 
-    def search_for_keywords(self, filepaths, search_folder, keywords, word_pad, window):
+    def search_documents(self, filepaths, keywords, word_pad, should_stop=None, journal=None):
+        """
+        Search each document in a list of files for keywords, yielding the results for each file in the order of the files.
+
+        If there is more than one worker, documents are searched in parallel in worker processes, and results which finish early are held until the results of the previous files are ready.
+        If deduplicating, copies of a document found before are not searched again, and are yielded with the results of the original once it has been searched, so may come later than their place in the files. The original of each copy is saved in self.duplicates.
+        If a journal is given, the documents already searched by the run of the journal are yielded first with the results saved in the journal, and are not searched again. The results of each document searched are saved to the journal before they are yielded.
+        The time of each stage of the search is collected in self.metrics.
+
+        Parameters
+        ----------
+        filepaths : list or iterable (required)
+            Filepaths to search, such as a list or a DocumentFinder. Files are searched as they are yielded by the iterable.
+
+        keywords : list, KeywordMatcher or QueryMatcher (required)
+            The keywords or queries to search for.
+
+        word_pad : int (required)
+            The number of words to be returned either side of the found keyword.
+
+        should_stop : function (default=None)
+            Function returning True if the search should be stopped. It is checked before each file, and at least every poll_interval seconds while waiting for worker processes.
+
+        journal : SearchJournal (default=None)
+            Journal of the run, already started with SearchJournal.start.
+
+        Yields
+        ------
+        filepath : str
+            Path of the file searched.
+
+        results, instances, warning
+            As returned by search_document.
+        """
+        self.metrics = Metrics()
+        deduplicator = DocumentDeduplicator() if self.deduplicate else None
+        self.duplicates = {} if deduplicator is None else deduplicator.duplicates
+        copies = deque() # Copies found, waiting for the original to be searched
+        originals = {} # Outcome of the search of each document, to give to its copies
+
+        # Take the documents already searched from the journal
+        finished = list(journal.finished_documents()) if journal is not None else []
+        for filepath, results, instances, warning in finished:
+            if deduplicator is not None:
+                deduplicator.original_of(filepath)
+                originals[filepath] = None if ((results == []) and not warning) else (results, instances, warning)
+            self.metrics.count('resumed')
+            yield filepath, results, instances, warning
+        if finished:
+            finished = {filepath for filepath, *_ in finished}
+            filepaths = (filepath for filepath in filepaths if filepath not in finished)
+
+        if deduplicator is not None:
+            filepaths = self.unique_documents(filepaths, deduplicator, copies)
+        profiler = None if self.profile_path is None else cProfile.Profile()
+        search = self.iter_search_documents(filepaths=filepaths, keywords=keywords, word_pad=word_pad, should_stop=should_stop, in_process=profiler is not None)
+        start = time.perf_counter()
+        try:
+            while True:
+                # Only profile the search, not the code using the results
+                if profiler is not None:
+                    profiler.enable()
+                try:
+                    item = next(search, None)
+                finally:
+                    if profiler is not None:
+                        profiler.disable()
+                if item is None:
+                    break
+                self.metrics.merge(item[4])
+                if deduplicator is not None:
+                    # Only keep the results of documents with results or warnings, as others have nothing to give to copies
+                    originals[item[0]] = None if ((item[1] == []) and not item[3]) else item[1:4]
+                if journal is not None:
+                    journal.add(*item[:4])
+                yield item[:4]
+
+                # Yield the copies of the documents searched so far
+                while copies and (copies[0][1] in originals):
+                    copy_path, original = copies.popleft()
+                    item = (copy_path, ) + copy_outcome(originals[original], original, copy_path)
+                    if journal is not None:
+                        journal.add(*item)
+                    yield item
+
+            # Yield the remaining copies, whose originals were searched out of order after the copies were found
+            for copy_path, original in copies:
+                if original in originals:
+                    item = (copy_path, ) + copy_outcome(originals[original], original, copy_path)
+                    if journal is not None:
+                        journal.add(*item)
+                    yield item
+        finally:
+            search.close()
+            if journal is not None:
+                journal.commit()
+            self.metrics.add_time('total', time.perf_counter()-start)
+            if profiler is not None:
+                profiler.dump_stats(self.profile_path)
+                logger.info(f'Search profile saved to {self.profile_path}')
+
+
+    def unique_documents(self, filepaths, deduplicator, copies):
+        """
+        Yield the files which are not copies of files yielded before, adding each copy found to copies with the path of the original.
+        """
+        for filepath in filepaths:
+            with self.metrics.timer('deduplicate'):
+                original = deduplicator.original_of(filepath)
+            if original is None:
+                yield filepath
+            else:
+                self.metrics.count('duplicates')
+                copies.append((filepath, original))
+
+
+    def iter_search_documents(self, filepaths, keywords, word_pad, should_stop=None, in_process=False):
+        """
+        Search each document in a list of files for keywords, as in search_documents, also yielding the metrics of the search of each file.
+
+        Parameters
+        ----------
+        filepaths, keywords, word_pad, should_stop
+            As in search_documents.
+
+        in_process : bool (default=False)
+            Whether to search in the current process, even if there is more than one worker.
+
+        Yields
+        ------
+        filepath, results, instances, warning
+            As yielded by search_documents.
+
+        file_metrics : dict
+            Metrics of the search of the file, as returned by Metrics.to_dict.
+        """
+        # Compile the keywords once for all documents
+        matcher = compile_keywords(keywords)
+
+        # With the corpus index, only search the pages which may contain the keywords
+        if self.index is not None:
+            targets = self.index.prefilter(filepaths, matcher, word_cache=self.word_cache, should_stop=should_stop)
+        else:
+            targets = ((filepath, None, False) for filepath in filepaths)
+        no_pages = ([], {}, None)
+
+        # Search in the current process
+        if ((self.workers == 1) and (self.time_limit is None) and (self.memory_limit is None) and (self.pool is None)) or in_process:
+            for filepath, pages, index_after in targets:
+                if should_stop and should_stop():
+                    return
+                file_metrics = Metrics()
+                outcome = no_pages if (pages is not None) and not pages else search_document(filepath, matcher, word_pad, self.word_cache, pages=pages, mode=self.mode, metrics=file_metrics)
+                if index_after:
+                    self.index.index_after(filepath, self.word_cache)
+                yield (filepath, ) + outcome + (file_metrics.to_dict(), )
+            return
+
+        # Search in worker processes, keeping a limited number of files queued so that stopping is quick
+        # Files are taken from the filepaths as they are needed, so that searching can start while documents are still being found
+        # Documents which go over the time or memory limits are stopped by killing their worker process
+        if self.pool is None:
+            executor = WorkerPool(self.workers, initializer=init_worker, initargs=(matcher, word_pad, self.word_cache, self.mode), time_limit=self.time_limit, memory_limit=self.memory_limit,
+                                  poll_interval=self.poll_interval)
+            submit_search = lambda filepath, pages: executor.submit(search_document_in_worker, filepath, pages, description=filepath)
+        else:
+            executor = self.pool
+            submit_search = lambda filepath, pages: executor.submit(search_document_in_pool, filepath, matcher.keywords, word_pad, self.mode, pages, description=filepath)
+
+        def submit(filepath, pages):
+            # Documents without any pages to search do not need to be sent to a worker
+            if (pages is not None) and not pages:
+                future = Future()
+                future.set_result((no_pages, {}))
+                return future
+            return submit_search(filepath, pages)
+
+        targets = iter(targets)
+        pending = deque()
+        try:
+            more_files = True
+            while more_files or pending:
+                if should_stop and should_stop():
+                    return
+                while more_files and (len(pending) < 2*self.workers):
+                    target = next(targets, None)
+                    if target is None:
+                        more_files = False
+                    else:
+                        filepath, pages, index_after = target
+                        pending.append((filepath, submit(filepath, pages), index_after))
+                if not pending:
+                    break
+
+                # Wait for the next file in order, and yield all the files which are ready
+                wait([pending[0][1]], timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+                while pending and pending[0][1].done():
+                    filepath, future, index_after = pending.popleft()
+                    try:
+                        outcome, file_metrics = future.result()
+                    except WorkerLimitError as err:
+                        outcome, file_metrics = (None, None, f'Skipping file {filepath} as it {err}.'), {'counts': {'stopped': 1}}
+                    except Exception as err:
+                        logger.exception('Error searching document in worker process', extra={'filepath': filepath})
+                        outcome, file_metrics = (None, None, None), {}
+                    if index_after:
+                        self.index.index_after(filepath, self.word_cache)
+                    yield (filepath, ) + outcome + (file_metrics, )
+        finally:
+            if self.pool is None:
+                executor.shutdown(wait=False, cancel_futures=True)
+            else:
+                for filepath, future, index_after in pending:
+                    future.cancel()
+
+
+    def search_folder(self, search_folder, keywords, word_pad, should_stop=None, include=None, exclude=None, journal=None, resume=False):
+        """
+        Search all PDF documents in a folder for keywords, yielding the results for each document as soon as it has been searched.
+
+        This does not need a GUI window, so can be used to run searches from scripts.
+
+        Parameters
+        ----------
+        search_folder : str (required)
+            Path to the folder to search, including subfolders.
+
+        keywords : list, KeywordMatcher or QueryMatcher (required)
+            The keywords or queries to search for.
+
+        word_pad : int (required)
+            The number of words to be returned either side of the found keyword.
+
+        should_stop : function (default=None)
+            Function returning True if the search should be stopped.
+
+        include, exclude : list (default=None)
+            Glob patterns of the files to include and exclude, as in DocumentFinder.
+
+        journal : SearchJournal (default=None)
+            If given, the results of each document are saved to the journal, so that the search can be resumed if it is stopped. The run is removed from the journal when the search finishes.
+
+        resume : bool (default=False)
+            Whether to resume an unfinished run in the journal with the same folder, keywords and word padding, instead of starting again.
+
+        Yields
+        ------
+        filepath : str
+            Path of the document relative to the search folder.
+
+        results : list
+            Results rows found in the document, with the file name given relative to the search folder. None if the document could not be searched.
+
+        instances : dict
+            Keyword instances found on each page of the document. None if the document could not be searched.
+
+        warning : str
+            Warning message if the document was skipped, otherwise None.
+        """
+        filepaths = DocumentFinder(search_folder, include=include, exclude=exclude, should_stop=should_stop)
+        if journal is not None:
+            journal.start(search_folder, keywords, word_pad, resume=resume, mode=self.mode)
+        completed = False
+        try:
+            for filepath, results, instances, warning in self.search_documents(filepaths=filepaths, keywords=keywords, word_pad=word_pad, should_stop=should_stop, journal=journal):
+                for result in results or []:
+                    result[0] = os.path.relpath(result[0], search_folder)
+                yield os.path.relpath(filepath, search_folder), results, instances, warning
+            completed = not (should_stop and should_stop())
+        finally:
+            if journal is not None:
+                if completed:
+                    journal.finish()
+                journal.close()
+
+
+    def search_for_keywords(self, filepaths, search_folder, keywords, word_pad, window, sink=None, journal=None, resume=False, generation=None):
         """
         Loop through a list of files (with paths) and search for keywords in each document.
 
-        Convert to PDF if necessary.
+        Run in a thread. The window is not updated directly from this thread: progress is sent to the window as '-SEARCH PROGRESS-' events, at most every settings.PROGRESS_INTERVAL seconds, and a '-SEARCH DONE-' event is sent when the search has finished.
+        The event values are dicts with the number of documents searched ('searched') out of the total ('total'), whether documents are still being found ('finding'), the number of keywords found ('keywords'), the number of documents with keywords found ('documents'), the number of results rows which can be read from settings.keyword_results ('results'), the number of copies of documents which were not searched again ('duplicates'), the number of documents taken from the journal of a previous search ('resumed'), and the warnings since the last event ('warnings'). The '-SEARCH DONE-' event also has a summary of the search metrics ('metrics').
+        Each event also has the generation of the search ('generation'), so that the window can ignore the events of a cancelled search which is still stopping after a new search has started. The results of the search are only given to settings while it is the current search.
 
         Parameters
         ----------
-        filepaths : list (required)
-            List of filepaths to search. Keyword searching will be run on each file.
+        filepaths : list or DocumentFinder (required)
+            Filepaths to search. Keyword searching will be run on each file. If a DocumentFinder is given, files are searched as they are found, and the total in the progress is the number of files found so far.
 
         search_folder : str (required)
             Path to the folder which is being searched, which contains the filepaths.
@@ -38,66 +638,101 @@ class DocumentSearcher:
             The number of words to be returned either side of the found keyword.
 
         window : PySimpleGUI window object (required)
-            PySimpleGUI window so that GUI features can be updated as searching is run, such as the progress bar.
-        """
-        # Get global variables
-        settings.keyword_results=None
-        settings.keyword_instances={}
+            PySimpleGUI window to send the progress events to.
 
-        # Loop through the files in the folder
-        results_summary = {'keywords': 0, 'documents': 0}
-        for i, filepath in enumerate(filepaths):
+        sink : ResultSink (default=None)
+            If given, results are also written to the sink as they are found. The sink is closed when the search finishes, or left as a partial file if the search is cancelled.
 
-            # Break if the search has been stopped
-            if not settings.searching:
-                break
+        journal : SearchJournal (default=None)
+            If given, the results of each document are saved to the journal, so that the search can be resumed if it is cancelled or the program crashes. The run is removed from the journal when the search finishes.
 
+        resume : bool (default=False)
+            Whether to resume an unfinished run in the journal with the same folder, keywords and word padding, instead of starting again.
+
+        generation : int (default=None)
+            Generation of the search, from settings.start_search. The search stops when it is cancelled or a newer search starts. If None, the current generation is used.
+        """
+        # Keep the results of this search, so that a cancelled search which is still stopping does not add to the results of the next search
+        generation = settings.search_generation if generation is None else generation
+        should_stop = lambda: not settings.is_current_search(generation)
+        keyword_results = settings.keyword_results = ResultStore()
+        keyword_instances = settings.keyword_instances = {}
+        settings.duplicate_documents = {}
+
+        # Loop through the files in the folder, stopping if the search has been stopped
+        finder = filepaths if isinstance(filepaths, DocumentFinder) else None
+        progress = {'generation': generation, 'searched': 0, 'total': 0 if finder else len(filepaths), 'finding': finder is not None, 'keywords': 0, 'documents': 0, 'results': 0, 'duplicates': 0, 'resumed': 0, 'warnings': []}
+        last_progress = time.monotonic()
+        if journal is not None:
             try:
+                journal.start(search_folder, keywords, word_pad, resume=resume, mode=self.mode)
+            except Exception as err:
+                logger.exception('Error starting the search journal')
+                journal = None
+        completed = False
+        search = self.search_documents(filepaths=filepaths, keywords=keywords, word_pad=word_pad, should_stop=should_stop, journal=journal)
+        try:
+            for filepath, results, instances, warning in search:
+                progress['searched'] += 1
+                if finder is not None:
+                    progress['total'] = max(finder.found, progress['searched']) # Documents taken from the journal are given before they are found
+                    progress['finding'] = not finder.finished
+                progress['duplicates'] = len(self.duplicates)
+                progress['resumed'] = self.metrics.counts.get('resumed', 0)
 
-                # Create the document
-                doc = Document(filepath=filepath)
-                if doc.file_extension != '.pdf':
-                    warning_text = window['-SEARCH WARNING-']
-                    warning_message = f'Skipping file {filepath} as it is not a PDF.'
-                    if warning_text.get():
-                        warning_message = f'{warning_text.get()}\n{warning_message}'
-                    warning_text.update(value=warning_message, visible=True)
-                    window.refresh()
-                    continue
+                # Show a warning if the file was skipped
+                if warning:
+                    progress['warnings'].append(warning)
 
-                # Search for keywords in the file
-                results = []; instances = {}
+                elif results is not None:
+
+                    # Update the global keyword results variable. Change the full path to a relative path to display in the results.
+                    for result in results:
+                        result[0] = os.path.relpath(result[0], search_folder)
+                    keyword_instances[os.path.relpath(filepath, search_folder)] = instances
+                    keyword_results += results
+                    progress['results'] = len(keyword_results)
+                    if sink is not None:
+                        sink.write(results)
+                    if results:
+                        progress['keywords'] += len(results)
+                        progress['documents'] += 1
+
+                # Send the progress to the window, without waiting for the window to update
+                if time.monotonic()-last_progress >= settings.PROGRESS_INTERVAL:
+                    window.write_event_value('-SEARCH PROGRESS-', dict(progress))
+                    progress['warnings'] = []
+                    last_progress = time.monotonic()
+            completed = not should_stop()
+        finally:
+            search.close()
+            if journal is not None:
+                if completed:
+                    journal.finish()
+                journal.close()
+            if generation == settings.search_generation:
+                settings.duplicate_documents = {os.path.relpath(copy_path, search_folder): os.path.relpath(original, search_folder) for copy_path, original in self.duplicates.items()}
+            # Only give the results file its final name if the search finished, otherwise leave the partial file
+            if sink is not None:
                 try:
-                    results, instances = doc.search_for_keywords(keywords=keywords, word_pad=word_pad)
-                    doc.close()
+                    if completed:
+                        sink.close()
+                    else:
+                        sink.abort()
                 except Exception as err:
-                    logger.exception('Error searching for keywords in document')
+                    logger.exception('Error closing the results file')
+                    progress['warnings'].append(f'The results file could not be saved: {err}')
 
-                # Update the global keyword results variable. Change the full path to a relative path to display in the results.
-                for result in results:
-                    result[0] = os.path.relpath(result[0], search_folder)
-                if settings.keyword_results is None:
-                    settings.keyword_results = results
-                else:
-                    settings.keyword_results += results
-                settings.keyword_instances[os.path.relpath(filepath, search_folder)] = instances
-
-                # Update the progress message
-                if results:
-                    results_summary['keywords'] += len(results)
-                    results_summary['documents'] += 1
-                    window['-RESULTS SUMMARY-'].update(value=f'Found {len(filepaths)} documents to search\n{results_summary["keywords"]} keywords found in {results_summary["documents"]} documents')
-
-            # Catch any exceptions and log to the log file
+            # Save the metrics of the search
+            try:
+                self.metrics.dump(settings.METRICS_PATH, documents=progress['searched'], keywords=len(keywords), workers=self.workers, index=self.index is not None)
             except Exception as err:
-                logger.exception('Error searching keywords in documents')
-
-            # Update the progress bar
-            percent_completed = 100*(i+1)/len(filepaths)
-            window['Percent'].update(value=f'{round(percent_completed, 1)} %')
-            window['progress'].update_bar(percent_completed)
+                logger.exception('Error saving search metrics')
+            logger.info(f'Search metrics: {self.metrics.to_dict()}')
 
-        # Once searching has finished, update the results table and set to not searching
-        settings.searching = False
-        window['-SEARCH FOR KEYWORDS-'].update('Search')
-        window['-RESULTS TABLE-'].update([item[:4] for item in settings.keyword_results])
+            # Set to not searching, and send the final progress to the window to show the results
+            if finder is not None:
+                progress['total'] = finder.found
+            progress['finding'] = False
+            settings.end_search(generation)
+            window.write_event_value('-SEARCH DONE-', dict(progress, metrics=self.metrics.summary()))
@@ -0,0 +1,157 @@
+"""
+Multi-keyword matching engine
+"""
+from bisect import bisect_right
+from collections import deque
+import fitz
+
+
+class KeywordMatcher:
+    """
+    Aho-Corasick automaton to find every keyword in a list of keywords in a single pass over the words of a page.
+
+    Matching follows the behaviour of fitz page.search_for: it is case insensitive, keywords can be found inside longer words, and phrases can run over line breaks.
+
+    Parameters
+    ----------
+    keywords : list (required)
+        List of keywords or key phrases to search for.
+    """
+    def __init__(self, keywords):
+        self.keywords = list(keywords)
+        self.patterns = [self.normalise(keyword) for keyword in self.keywords]
+
+        # Build the trie: each node is a dict of character transitions, with a list of keyword indexes ending at the node
+        self.goto = [{}]
+        self.outputs = [[]]
+        for ikeyword, pattern in enumerate(self.patterns):
+            if not pattern:
+                continue
+            node = 0
+            for char in pattern:
+                if char not in self.goto[node]:
+                    self.goto.append({})
+                    self.outputs.append([])
+                    self.goto[node][char] = len(self.goto)-1
+                node = self.goto[node][char]
+            self.outputs[node].append(ikeyword)
+
+        # Add the failure links, breadth first, merging the outputs of the failure node into each node
+        self.fail = [0]*len(self.goto)
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.outputs[child] = self.outputs[child] + self.outputs[self.fail[child]]
+
+
+    @staticmethod
+    def normalise(text):
+        """
+        Normalise text for matching: lower case, with special spaces replaced and whitespace collapsed to single spaces.
+        """
+        return ' '.join(str(text).replace('\xa0', ' ').lower().split())
+
+
+    def search_page(self, words):
+        """
+        Find all instances of the keywords in the words of a page.
+
+        Parameters
+        ----------
+        words : list of fitz word objects (required)
+            Words of the page in reading order, as returned by Document.get_words.
+
+        Returns
+        -------
+        page_matches : list
+            List of (keyword, instances) tuples, in the order of the keywords, for each keyword found on the page. The instances are the fitz.Rect objects containing the keyword, in the order they appear on the page, with one rect for each line the keyword covers.
+        """
+        if not words:
+            return []
+
+        # Join the words into one stream of text, recording the position of the start of each word
+        word_texts = [self.normalise(word[4]) for word in words]
+        word_starts = []
+        position = 0
+        for text in word_texts:
+            word_starts.append(position)
+            position += len(text)+1
+        stream = ' '.join(word_texts)
+
+        # Run the automaton over the stream, recording the matches of each keyword
+        matches = {}
+        last_end = {}
+        node = 0
+        for i, char in enumerate(stream):
+            while node and char not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(char, 0)
+            for ikeyword in self.outputs[node]:
+                start = i+1-len(self.patterns[ikeyword])
+                # Do not return overlapping instances of the same keyword
+                if start < last_end.get(ikeyword, 0):
+                    continue
+                last_end[ikeyword] = i+1
+                matches.setdefault(ikeyword, []).append((start, i+1))
+
+        # Convert the character matches into rects
+        page_matches = []
+        for ikeyword in sorted(matches):
+            instances = []
+            for start, end in matches[ikeyword]:
+                instances += self.match_rects(words, word_texts, word_starts, start, end)
+            page_matches.append((self.keywords[ikeyword], instances))
+
+        return page_matches
+
+
+    def match_rects(self, words, word_texts, word_starts, start, end):
+        """
+        Get the rects covering a match in the text stream, with one rect for each line covered.
+        Where the match starts or ends within a word, the position within the word is estimated from the share of characters, so can differ from the position given by fitz page.search_for by about one character (see tests/test_keyword_matcher.py). Matches of whole words give the same rects as fitz.
+
+        Parameters
+        ----------
+        words : list of fitz word objects (required)
+            Words of the page.
+
+        word_texts : list of str (required)
+            Normalised text of each word.
+
+        word_starts : list of int (required)
+            Position in the text stream of the start of each word.
+
+        start, end : int (required)
+            Start and end (exclusive) of the match in the text stream.
+
+        Returns
+        -------
+        rects : list of fitz.Rect
+            Rects covering the match.
+        """
+        word_start = bisect_right(word_starts, start)-1
+        word_end = bisect_right(word_starts, end-1)-1
+
+        rects = []
+        line = None
+        for i in range(word_start, word_end+1):
+            word = words[i]
+            x0, x1 = word[0], word[2]
+            length = max(len(word_texts[i]), 1)
+            if i == word_start:
+                x0 = word[0] + (word[2]-word[0])*(start-word_starts[i])/length
+            if i == word_end:
+                x1 = word[0] + (word[2]-word[0])*min(end-word_starts[i], length)/length
+            if (line is not None) and (word[5:7] == line) and rects:
+                rects[-1] |= fitz.Rect(x0, word[1], x1, word[3])
+            else:
+                rects.append(fitz.Rect(x0, word[1], x1, word[3]))
+            line = word[5:7]
+
+        return rects
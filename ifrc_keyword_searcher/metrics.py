@@ -0,0 +1,118 @@
+"""
+Timers and counters of the stages of searching documents, to find where the time of slow searches goes
+"""
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+
+class Metrics:
+    """
+    Total time and number of calls of each stage of searching, and counts such as the number of pages searched.
+
+    Each search has its own metrics, and each document searched has its own metrics, which are passed to the Document searching it and sent from the worker process as a dict to be combined with the metrics of the search. Searches running at the same time, such as the searches of the search service, and documents opened outside of searches, such as by the page renderer, do not change the metrics of other searches.
+    The metrics of a search can be read from other threads while it is running, such as the GUI thread, so changes are made holding a lock.
+    """
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.reset()
+
+
+    def reset(self):
+        """
+        Remove all of the metrics collected.
+        """
+        with self.lock:
+            self.seconds = {}
+            self.counts = {}
+            self.slowest_documents = []
+
+
+    @contextmanager
+    def timer(self, stage):
+        """
+        Time a stage, adding the time to the total of the stage and counting the call.
+
+        Example:
+            with metrics.timer('extract'):
+                words = page.get_text('words')
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter()-start)
+
+
+    def add_time(self, stage, seconds):
+        """
+        Add the time of a call of a stage.
+        """
+        with self.lock:
+            self.seconds[stage] = self.seconds.get(stage, 0) + seconds
+            self.count(stage)
+
+
+    def count(self, name, number=1):
+        """
+        Add to a counter.
+        """
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + number
+
+
+    def add_document(self, filepath, seconds, keep=10):
+        """
+        Record the time taken to search a document, keeping the slowest documents.
+        """
+        with self.lock:
+            self.add_time('document', seconds)
+            self.slowest_documents = sorted(self.slowest_documents + [(seconds, filepath)], reverse=True)[:keep]
+
+
+    def merge(self, metrics_dict):
+        """
+        Add metrics from a dict, as returned by to_dict, for example from a worker process.
+        """
+        with self.lock:
+            for stage, seconds in metrics_dict.get('seconds', {}).items():
+                self.seconds[stage] = self.seconds.get(stage, 0) + seconds
+            for name, number in metrics_dict.get('counts', {}).items():
+                self.count(name, number)
+            self.slowest_documents = sorted(self.slowest_documents + [tuple(document) for document in metrics_dict.get('slowest_documents', [])], reverse=True)[:10]
+
+
+    def to_dict(self):
+        """
+        Get the metrics as a dict which can be saved as JSON.
+        """
+        with self.lock:
+            return {'seconds': dict(self.seconds), 'counts': dict(self.counts), 'slowest_documents': [list(document) for document in self.slowest_documents]}
+
+
+    def dump(self, path, **details):
+        """
+        Save the metrics to a JSON file, with any other details of the run given as keyword arguments.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        metrics_dict = self.to_dict()
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(dict(metrics_dict, **details), f, indent=2)
+
+
+    def summary(self):
+        """
+        Describe the time of the main stages and the slowest document in one or two short lines.
+        """
+        metrics_dict = self.to_dict()
+        stages = [(stage, seconds) for stage, seconds in metrics_dict['seconds'].items() if stage not in ('document', 'total')]
+        if not stages:
+            return ''
+        stages = sorted(stages, key=lambda stage: stage[1], reverse=True)[:5]
+        summary = f'Total {metrics_dict["seconds"].get("total", 0):.1f}s: ' + ', '.join([f'{stage} {seconds:.1f}s' for stage, seconds in stages])
+        if metrics_dict['slowest_documents']:
+            seconds, filepath = metrics_dict['slowest_documents'][0]
+            summary += f'\nSlowest document: {filepath} ({seconds:.1f}s)'
+        return summary
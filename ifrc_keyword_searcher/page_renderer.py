@@ -0,0 +1,247 @@
+"""
+Render pages of documents for the document viewer in the background, keeping recently rendered pages in memory
+"""
+import threading
+from collections import OrderedDict
+import fitz
+import settings
+from document import Document
+
+# Set up logging
+logger = settings.get_logger("page_renderer")
+
+
+class PageImageCache:
+    """
+    Least recently used cache of rendered page images, shared by all documents and limited to a total size in bytes.
+
+    Parameters
+    ----------
+    max_bytes : int (default=settings.PAGE_CACHE_BYTES)
+        Maximum total size of the images to keep. The least recently used images are removed when it is exceeded.
+    """
+    def __init__(self, max_bytes=settings.PAGE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.images = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.images
+
+
+    def get(self, key):
+        """
+        Get a page image, marking it as recently used.
+
+        Parameters
+        ----------
+        key : tuple (required)
+            (filepath, page number) of the page.
+
+        Returns
+        -------
+        image : bytes or None
+            PNG image of the page, or None if it is not in the cache.
+        """
+        with self.lock:
+            image = self.images.get(key)
+            if image is not None:
+                self.images.move_to_end(key)
+            return image
+
+
+    def put(self, key, image):
+        """
+        Add a page image, removing the least recently used images if the cache is full.
+        """
+        with self.lock:
+            if key in self.images:
+                self.total_bytes -= len(self.images.pop(key))
+            self.images[key] = image
+            self.total_bytes += len(image)
+            while (self.total_bytes > self.max_bytes) and (len(self.images) > 1):
+                _, removed = self.images.popitem(last=False)
+                self.total_bytes -= len(removed)
+
+
+    def clear(self):
+        """
+        Remove all images, for example when the highlights change after a new search.
+        """
+        with self.lock:
+            self.images.clear()
+            self.total_bytes = 0
+
+
+class PageRenderer:
+    """
+    Render highlighted pages of documents in a background thread, so that the window does not freeze.
+
+    The page to show is rendered first, then the pages next to it and the pages containing keywords are rendered into the cache, so that moving to them is instant.
+    All rendering is done in the one background thread, which keeps the document being viewed open.
+
+    Parameters
+    ----------
+    window : PySimpleGUI window object (required)
+        Window to send a '-PAGE RENDERED-' event to with (filepath, page number) when the page to show has been rendered.
+
+    cache : PageImageCache (default=None)
+        Cache to save rendered pages in. If None, a new cache is created.
+
+    zoom : float (default=1.5)
+        Zoom factor to render pages at.
+
+    neighbours : int (default=2)
+        Number of pages either side of the page shown to prefetch.
+
+    max_prefetch : int (default=20)
+        Maximum number of pages to prefetch for each page shown.
+    """
+    def __init__(self, window, cache=None, zoom=1.5, neighbours=2, max_prefetch=20):
+        self.window = window
+        self.cache = PageImageCache() if cache is None else cache
+        self.matrix = fitz.Matrix(zoom, zoom)
+        self.neighbours = neighbours
+        self.max_prefetch = max_prefetch
+        self.condition = threading.Condition()
+        self.wanted = None
+        self.prefetch = []
+        self.page_rects = {}
+        self.generation = 0
+        self.stopped = False
+        self.thread = None
+
+
+    def show(self, filepath, pageno, total_pages, page_rects=None):
+        """
+        Ask for a page to be shown, replacing any pages waiting to be prefetched.
+
+        Returns the page image if it is already in the cache. Otherwise None is returned, and a '-PAGE RENDERED-' event is sent when it is ready.
+
+        Parameters
+        ----------
+        filepath : str (required)
+            Path to the document.
+
+        pageno : int (required)
+            Page number (starting from 0) to show.
+
+        total_pages : int (required)
+            Number of pages in the document.
+
+        page_rects : dict (default=None)
+            Rects to highlight on each page, as in Document.highlight_doc. Pages with highlights are prefetched.
+        """
+        page_rects = page_rects or {}
+        image = self.cache.get((filepath, pageno))
+
+        # Prefetch the pages next to the page shown, then the pages with keywords in order from the page shown
+        pagenos = []
+        for distance in range(1, self.neighbours+1):
+            pagenos += [pageno+distance, pageno-distance]
+        pagenos += sorted([hit_pageno for hit_pageno, rects in page_rects.items() if rects], key=lambda hit_pageno: abs(hit_pageno-pageno))
+        prefetch = []
+        for prefetch_pageno in pagenos:
+            if (0 <= prefetch_pageno < total_pages) and (prefetch_pageno != pageno) and (prefetch_pageno not in prefetch):
+                prefetch.append(prefetch_pageno)
+        prefetch = [(filepath, prefetch_pageno) for prefetch_pageno in prefetch[:self.max_prefetch]]
+
+        with self.condition:
+            self.wanted = None if image is not None else (filepath, pageno)
+            self.prefetch = prefetch
+            self.page_rects = page_rects
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+            self.condition.notify()
+        return image
+
+
+    def clear(self):
+        """
+        Remove the rendered pages and stop prefetching, for example when the highlights change after a new search.
+        """
+        with self.condition:
+            self.generation += 1
+            self.wanted = None
+            self.prefetch = []
+            self.cache.clear()
+
+
+    def close(self):
+        """
+        Stop the background thread.
+        """
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+
+
+    def next_page(self):
+        """
+        Wait for the next page to render, giving the page to show before pages to prefetch.
+
+        Returns
+        -------
+        key : tuple or None
+            (filepath, page number) of the page, or None if the renderer has been stopped.
+
+        show : bool
+            Whether the page is to be shown.
+
+        page_rects : dict
+            Rects to highlight in the document.
+
+        generation : int
+            Number of times the renderer has been cleared, so that pages rendered with old highlights are not saved.
+        """
+        with self.condition:
+            while True:
+                if self.stopped:
+                    return None, False, {}, self.generation
+                if self.wanted is not None:
+                    key, self.wanted = self.wanted, None
+                    return key, True, self.page_rects, self.generation
+                while self.prefetch:
+                    key = self.prefetch.pop(0)
+                    if key not in self.cache:
+                        return key, False, self.page_rects, self.generation
+                self.condition.wait()
+
+
+    def run(self):
+        """
+        Render pages until stopped. Run in the background thread.
+        """
+        doc = None
+        doc_key = None
+        try:
+            while True:
+                key, show, page_rects, generation = self.next_page()
+                if key is None:
+                    break
+                filepath, pageno = key
+                try:
+                    # Open the document with the highlights, keeping it open for the next pages
+                    if (filepath, generation) != doc_key:
+                        if doc is not None:
+                            doc.close()
+                            doc = None
+                        doc_key = (filepath, generation)
+                        doc = Document(filepath=filepath)
+                        doc.highlight_doc(page_rects)
+                    if key not in self.cache:
+                        image = doc.doc[pageno].get_pixmap(alpha=False, matrix=self.matrix).tobytes(output='png')
+                        with self.condition:
+                            if generation == self.generation:
+                                self.cache.put(key, image)
+                except Exception as err:
+                    logger.exception(f'Error rendering page {pageno+1}', extra={'filepath': filepath})
+                if show:
+                    self.window.write_event_value('-PAGE RENDERED-', key)
+        finally:
+            if doc is not None:
+                doc.close()
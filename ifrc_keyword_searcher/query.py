@@ -0,0 +1,356 @@
+"""
+Boolean and proximity queries, evaluated on the positions of the words of each page
+
+Keywords starting with query: are compiled as queries, for example:
+    query: cholera NEAR/10 vaccin*
+    query: (flood OR flooding) AND "early warning" NOT drill
+    query: =WASH AND hygiene
+All other keywords are searched for as literal phrases, even if they contain query operators.
+
+Terms match whole words and are not case sensitive. A term ending in * matches words starting with the term, and a term starting with = is case sensitive.
+Quoted phrases match consecutive words. Terms next to each other without an operator must all be on the page, as with AND.
+Operators are written in capitals: NOT binds most tightly, then NEAR/n (within n words, in either order), then AND, then OR. Parentheses group terms.
+Queries find pages where the query is true, and return a result for each match of the terms which make it true.
+"""
+import re
+from bisect import bisect_left
+import fitz
+from keyword_matcher import KeywordMatcher
+
+# Tokens of a query: parentheses, quoted phrases, NEAR/n operators, and other words
+QUERY_TOKEN_PATTERN = re.compile(r'\(|\)|"[^"]*"|[^\s()"]+')
+NEAR_PATTERN = re.compile(r'NEAR/(\d+)$')
+OPERATORS = {'AND', 'OR', 'NOT'}
+
+# Prefix of the keywords which are queries, so that query syntax is only used when asked for
+QUERY_PREFIX = 'query:'
+
+# Words of the text of a page, or of a term
+WORD_PATTERN = re.compile(r'\w+')
+
+
+class QueryError(ValueError):
+    """
+    Raised when a query can not be compiled, with a message to show to the user.
+    """
+    pass
+
+
+def is_query(keyword):
+    """
+    Check whether a keyword starts with the query prefix (ignoring case), so should be compiled as a query rather than searched for as a literal phrase.
+    """
+    return str(keyword).lstrip().lower().startswith(QUERY_PREFIX)
+
+
+def compile_keywords(keywords):
+    """
+    Compile keywords for searching, so that all pages are searched in one pass.
+
+    Parameters
+    ----------
+    keywords : list, KeywordMatcher or QueryMatcher (required)
+        The keywords or key phrases to search for, which can include queries. Already compiled keywords are returned as they are.
+
+    Returns
+    -------
+    matcher : KeywordMatcher or QueryMatcher
+        A KeywordMatcher if there are no queries, otherwise a QueryMatcher.
+    """
+    if isinstance(keywords, (KeywordMatcher, QueryMatcher)):
+        return keywords
+    keywords = list(keywords)
+    if any(is_query(keyword) for keyword in keywords):
+        return QueryMatcher(keywords)
+    return KeywordMatcher(keywords)
+
+
+class PageTokens:
+    """
+    Words of a page split into tokens for evaluating queries, with the positions of each token.
+
+    Parameters
+    ----------
+    words : list of fitz word objects (required)
+        Words of the page in reading order, as returned by Document.get_words.
+    """
+    def __init__(self, words):
+        self.words = words
+        self.token_words = [] # Index of the word of each token
+        self.positions = {} # Positions of each case folded token
+        self.exact_positions = {} # Positions of each token, keeping the case
+        for iword, word in enumerate(words):
+            for token in WORD_PATTERN.findall(word[4]):
+                position = len(self.token_words)
+                self.token_words.append(iword)
+                self.positions.setdefault(token.casefold(), []).append(position)
+                self.exact_positions.setdefault(token, []).append(position)
+
+
+    def term_positions(self, text, prefix=False, case_sensitive=False):
+        """
+        Get the positions of the tokens matching a term, in order.
+        """
+        positions = self.exact_positions if case_sensitive else self.positions
+        text = text if case_sensitive else text.casefold()
+        if not prefix:
+            return positions.get(text, [])
+        return sorted([position for token, token_positions in positions.items() if token.startswith(text) for position in token_positions])
+
+
+    def rects(self, positions):
+        """
+        Get the rects of the words of a match, joining the rects of consecutive words on the same line, as in KeywordMatcher.match_rects.
+        """
+        rects = []
+        line = None
+        last_word = None
+        for position in positions:
+            iword = self.token_words[position]
+            if iword == last_word:
+                continue
+            word = self.words[iword]
+            if (last_word is not None) and (iword == last_word+1) and (word[5:7] == line):
+                rects[-1] |= fitz.Rect(word[:4])
+            else:
+                rects.append(fitz.Rect(word[:4]))
+            line = word[5:7]
+            last_word = iword
+        return rects
+
+
+class Term:
+    """
+    Query term of one or more words, matching consecutive words of the page.
+    """
+    def __init__(self, text):
+        self.case_sensitive = text.startswith('=')
+        text = text.lstrip('=')
+        # Each word of a phrase can end in * to match words starting with it
+        self.parts = [(part, part_end == '*') for part, part_end in re.findall(r'(\w+)(\*?)', text)]
+        if not self.parts:
+            raise QueryError(f'The term {text} does not contain any words')
+
+
+    def words(self):
+        return [part for part, prefix in self.parts]
+
+
+    def evaluate(self, page):
+        """
+        Find the matches of the term on a page.
+
+        Returns
+        -------
+        matches : list
+            List of matches in order, where each match is a tuple of the positions of the matching tokens.
+        """
+        matches = [(position, ) for position in page.term_positions(self.parts[0][0], prefix=self.parts[0][1], case_sensitive=self.case_sensitive)]
+        for offset, (part, prefix) in enumerate(self.parts[1:], start=1):
+            if not matches:
+                break
+            next_positions = set(page.term_positions(part, prefix=prefix, case_sensitive=self.case_sensitive))
+            matches = [match + (match[0]+offset, ) for match in matches if match[0]+offset in next_positions]
+        return matches
+
+
+class Operation:
+    """
+    Query operation combining the matches of two parts of a query.
+    """
+    def __init__(self, operator, left, right, distance=None):
+        self.operator = operator
+        self.left = left
+        self.right = right
+        self.distance = distance
+
+
+    def words(self):
+        # Words after NOT can not make a page match, so are not needed to find the pages which may match
+        return self.left.words() if self.operator == 'NOT' else self.left.words() + self.right.words()
+
+
+    def evaluate(self, page):
+        left = self.left.evaluate(page)
+        if (not left) and (self.operator != 'OR'):
+            return []
+        right = self.right.evaluate(page)
+        if self.operator == 'OR':
+            return sorted(set(left + right))
+        if self.operator == 'AND':
+            return sorted(set(left + right)) if right else []
+        if self.operator == 'NOT':
+            return [] if right else left
+
+        # NEAR: match each left match with the nearest right match within the distance, before or after it
+        right_starts = [match[0] for match in right]
+        matches = []
+        for match in left:
+            i = bisect_left(right_starts, match[0])
+            nearest = None
+            for candidate in right[max(i-1, 0):i+1]:
+                # Number of words between the matches, which is negative if they overlap
+                gap = candidate[0]-match[-1]-1 if candidate[0] > match[-1] else match[0]-candidate[-1]-1
+                if (gap <= self.distance) and ((nearest is None) or (gap < nearest[0])):
+                    nearest = (gap, candidate)
+            if nearest is not None:
+                matches.append(tuple(sorted(set(match + nearest[1]))))
+        return sorted(set(matches))
+
+
+class Query:
+    """
+    Compiled boolean and proximity query.
+
+    Parameters
+    ----------
+    text : str (required)
+        The query, as described in the module documentation. The query prefix is optional.
+
+    Raises
+    ------
+    QueryError
+        If the query is not valid.
+    """
+    def __init__(self, text):
+        self.text = text
+        if is_query(text):
+            text = text.lstrip()[len(QUERY_PREFIX):]
+        if text.count('"') % 2:
+            raise QueryError(f'Missing closing " in query: {self.text}')
+        self.tokens = QUERY_TOKEN_PATTERN.findall(text)
+        self.position = 0
+        if not self.tokens:
+            raise QueryError('The query is empty')
+        self.root = self.parse_or()
+        if self.position < len(self.tokens):
+            raise QueryError(f'Unexpected {self.tokens[self.position]} in query: {self.text}')
+
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+
+    def take(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+
+    def parse_or(self):
+        node = self.parse_and()
+        while self.peek() == 'OR':
+            self.take()
+            node = Operation('OR', node, self.parse_and())
+        return node
+
+
+    def parse_and(self):
+        node = self.parse_near()
+        while (self.peek() is not None) and (self.peek() not in ('OR', ')')):
+            if self.peek() == 'AND':
+                self.take()
+            if self.peek() == 'NOT':
+                self.take()
+                node = Operation('NOT', node, self.parse_near())
+            else:
+                node = Operation('AND', node, self.parse_near())
+        return node
+
+
+    def parse_near(self):
+        node = self.parse_term()
+        while (self.peek() is not None) and NEAR_PATTERN.match(self.peek()):
+            distance = int(NEAR_PATTERN.match(self.take()).group(1))
+            node = Operation('NEAR', node, self.parse_term(), distance=distance)
+        return node
+
+
+    def parse_term(self):
+        token = self.take()
+        if token is None:
+            raise QueryError(f'The query ends unexpectedly: {self.text}')
+        if token == '(':
+            node = self.parse_or()
+            if self.take() != ')':
+                raise QueryError(f'Missing ) in query: {self.text}')
+            return node
+        if token == 'NOT':
+            raise QueryError(f'NOT must follow the terms to find, for example "flood NOT drill": {self.text}')
+        if (token in OPERATORS) or (token == ')') or NEAR_PATTERN.match(token):
+            raise QueryError(f'Unexpected {token} in query: {self.text}')
+        if token.startswith('"'):
+            return Term(token.strip('"'))
+        return Term(token)
+
+
+    def words(self):
+        """
+        Get the words of the terms which can make the query match, to find the pages which may match.
+        """
+        return self.root.words()
+
+
+    def evaluate(self, page):
+        """
+        Find the matches of the query on a page.
+
+        Parameters
+        ----------
+        page : PageTokens (required)
+            Tokens of the page.
+
+        Returns
+        -------
+        matches : list
+            List of matches in order, where each match is a tuple of the positions of the matching tokens.
+        """
+        return self.root.evaluate(page)
+
+
+class QueryMatcher:
+    """
+    Find keywords and queries in a single pass over the words of each page, with the same interface as KeywordMatcher.
+
+    Literal keywords are found with a KeywordMatcher. Each match of a query is returned as a list of rects, covering all of the terms of the match, so that it gives one result.
+
+    Parameters
+    ----------
+    keywords : list (required)
+        List of keywords, key phrases and queries to search for.
+
+    Raises
+    ------
+    QueryError
+        If a query is not valid.
+    """
+    def __init__(self, keywords):
+        self.keywords = list(keywords)
+        self.queries = {ikeyword: Query(keyword) for ikeyword, keyword in enumerate(self.keywords) if is_query(keyword)}
+        self.literals = [ikeyword for ikeyword in range(len(self.keywords)) if ikeyword not in self.queries]
+        self.literal_matcher = KeywordMatcher([self.keywords[ikeyword] for ikeyword in self.literals])
+        self.literal_ids = {}
+        for ikeyword in reversed(self.literals):
+            self.literal_ids[self.keywords[ikeyword]] = ikeyword
+
+
+    def search_page(self, words):
+        """
+        Find all instances of the keywords and queries in the words of a page.
+
+        Returns
+        -------
+        page_matches : list
+            List of (keyword, instances) tuples, in the order of the keywords, as returned by KeywordMatcher.search_page. The instances of queries are lists of rects.
+        """
+        if not words:
+            return []
+        found = {}
+        for keyword, instances in self.literal_matcher.search_page(words):
+            found[self.literal_ids[keyword]] = (keyword, instances)
+        page = PageTokens(words)
+        for ikeyword, query in self.queries.items():
+            matches = query.evaluate(page)
+            if matches:
+                found[ikeyword] = (self.keywords[ikeyword], [page.rects(match) for match in matches])
+        return [found[ikeyword] for ikeyword in sorted(found)]
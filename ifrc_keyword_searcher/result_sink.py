@@ -0,0 +1,276 @@
+"""
+Sinks to write keyword search results to files while searching
+"""
+import os
+import csv
+import json
+import time
+import settings
+
+# Set up logging
+logger = settings.get_logger("result_sink")
+
+
+class ResultSink:
+    """
+    Base class for sinks which write results rows to a file as they are found, buffering rows to write them in bulk.
+
+    When writing to a path, the results are written to a ".partial" file which is renamed to the path when the sink is closed. Each bulk write is flushed to disk, so if the search stops unexpectedly the results found so far are kept in the partial file.
+
+    Parameters
+    ----------
+    output : str or file object (required)
+        Path of the file to write to, or an open text file (such as sys.stdout).
+
+    buffer_rows : int (default=1000)
+        Number of rows to buffer before writing them.
+
+    buffer_seconds : float (default=5)
+        Maximum time in seconds to keep rows in the buffer before writing them.
+    """
+    binary = False
+
+    def __init__(self, output, buffer_rows=1000, buffer_seconds=5):
+        self.buffer_rows = buffer_rows
+        self.buffer_seconds = buffer_seconds
+        self.buffer = []
+        self.last_write = time.monotonic()
+        self.rows_written = 0
+        if isinstance(output, str):
+            self.path = output
+            self.partial_path = output + '.partial'
+            self.f = None if self.binary else open(self.partial_path, 'w', newline='', encoding='utf-8')
+        else:
+            self.path = self.partial_path = None
+            self.f = output
+        self.open()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+    @classmethod
+    def check_output(cls, output):
+        """
+        Check that the sink can write to the output, before starting a search, raising ValueError or ImportError if it can not.
+        """
+        pass
+
+
+    def open(self):
+        """
+        Start the file, for example by writing a header row.
+        """
+        pass
+
+
+    def write(self, results):
+        """
+        Add results rows of [file name, page, keyword, text block, rect], writing them if the buffer is full.
+        """
+        self.buffer += results
+        if (len(self.buffer) >= self.buffer_rows) or (time.monotonic()-self.last_write >= self.buffer_seconds):
+            self.flush()
+
+
+    def flush(self):
+        """
+        Write the buffered rows to the file, and flush the file to disk.
+        """
+        if self.buffer:
+            self.write_rows(self.buffer)
+            self.rows_written += len(self.buffer)
+            self.buffer = []
+        if self.f is not None:
+            self.f.flush()
+            if self.path is not None:
+                os.fsync(self.f.fileno())
+        self.last_write = time.monotonic()
+
+
+    def write_rows(self, rows):
+        """
+        Write rows to the file.
+        """
+        raise NotImplementedError
+
+
+    def close(self):
+        """
+        Write the remaining rows, close the file, and move the partial file to the final path.
+        If the rows can not be written, the file is closed and the partial file is kept.
+        """
+        try:
+            self.flush()
+            self.finish()
+        finally:
+            if (self.path is not None) and (self.f is not None):
+                self.f.close()
+        if self.path is not None:
+            os.replace(self.partial_path, self.path)
+            logger.info(f'{self.rows_written} results written to {self.path}')
+
+
+    def abort(self):
+        """
+        Write the remaining rows and close the file, keeping the partial file so that it is clear the results are not complete.
+        """
+        try:
+            self.flush()
+        finally:
+            if (self.path is not None) and (self.f is not None):
+                self.f.close()
+        logger.warning(f'{self.rows_written} results written to {self.partial_path} before stopping')
+
+
+    def finish(self):
+        """
+        End the file, for example by writing a footer.
+        """
+        pass
+
+
+    def rect_values(self, row):
+        """
+        Get the coordinates of the rect of a results row as floats.
+        """
+        return [float(coord) for coord in tuple(row[4])[:4]]
+
+
+class CSVResultSink(ResultSink):
+    """
+    Write results rows to a CSV file with a header row. The rects are not written.
+    """
+    def open(self):
+        self.writer = csv.writer(self.f)
+        self.writer.writerow(settings.RESULTS_HEADERS)
+
+    def write_rows(self, rows):
+        self.writer.writerows([row[:4] for row in rows])
+
+
+class JSONLResultSink(ResultSink):
+    """
+    Write results rows to a JSON lines file, with one JSON object for each row, including the coordinates of the keyword.
+    """
+    def write_rows(self, rows):
+        self.f.write(''.join([json.dumps(dict(zip(settings.RESULTS_HEADERS, row[:4]), Rect=self.rect_values(row)), ensure_ascii=False)+'\n' for row in rows]))
+
+
+class ParquetResultSink(ResultSink):
+    """
+    Write results rows to a Parquet file, with each bulk write as a row group, including the coordinates of the keyword in columns x0, y0, x1, y1.
+
+    Requires pandas and pyarrow. The partial file can only be read once the sink has been closed.
+    """
+    binary = True
+
+    @classmethod
+    def check_output(cls, output):
+        if not isinstance(output, str):
+            raise ValueError('Parquet results can only be written to a file path')
+        try:
+            import pandas
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as err:
+            raise ImportError('Writing results to Parquet requires pandas and pyarrow to be installed, with pip install -r requirements.txt') from err
+
+
+    def open(self):
+        self.check_output(self.path)
+        import pandas as pd
+        import pyarrow
+        import pyarrow.parquet
+        self.pd = pd
+        self.pyarrow = pyarrow
+        self.writer = None
+
+    def write_rows(self, rows):
+        df = self.pd.DataFrame([row[:4] + self.rect_values(row) for row in rows], columns=settings.RESULTS_HEADERS + ['x0', 'y0', 'x1', 'y1'])
+        table = self.pyarrow.Table.from_pandas(df, preserve_index=False)
+        if self.writer is None:
+            self.writer = self.pyarrow.parquet.ParquetWriter(self.partial_path, table.schema)
+        self.writer.write_table(table)
+
+    def abort(self):
+        try:
+            super().abort()
+        finally:
+            if self.writer is not None:
+                self.writer.close()
+
+    def finish(self):
+        if self.writer is not None:
+            self.writer.close()
+        else:
+            # Write an empty file with the results columns
+            self.pd.DataFrame([], columns=settings.RESULTS_HEADERS + ['x0', 'y0', 'x1', 'y1']).to_parquet(self.partial_path, index=False)
+
+
+RESULT_SINKS = {'csv': CSVResultSink, 'jsonl': JSONLResultSink, 'parquet': ParquetResultSink}
+
+
+def get_result_sink(output, output_format=None):
+    """
+    Get the class of the sink to write results to an output.
+
+    Parameters
+    ----------
+    output : str or file object (required)
+        Path of the file to write to, or an open text file.
+
+    output_format : str (default=None)
+        Format to write, one of 'csv', 'jsonl' or 'parquet'. If None, the format is taken from the file extension of the path, or is CSV.
+    """
+    if output_format is None:
+        extension = os.path.splitext(output)[1].lower().lstrip('.') if isinstance(output, str) else ''
+        output_format = extension if extension in RESULT_SINKS else 'csv'
+    if output_format not in RESULT_SINKS:
+        raise ValueError(f'Unknown results format {output_format}')
+    return RESULT_SINKS[output_format]
+
+
+def open_result_sink(output, output_format=None, **kwargs):
+    """
+    Open a sink to write results to.
+
+    Parameters
+    ----------
+    output : str or file object (required)
+        Path of the file to write to, or an open text file.
+
+    output_format : str (default=None)
+        Format to write, as in get_result_sink.
+
+    Other keyword arguments are passed to the sink.
+    """
+    return get_result_sink(output, output_format)(output, **kwargs)
+
+
+def export_results(results, output, output_format=None):
+    """
+    Write all results rows to a file.
+
+    Parameters
+    ----------
+    results : iterable (required)
+        Results rows, such as settings.keyword_results.
+
+    output : str or file object (required)
+        Path of the file to write to, or an open text file.
+
+    output_format : str (default=None)
+        Format to write, as in open_result_sink.
+    """
+    with open_result_sink(output, output_format=output_format, buffer_rows=10000) as sink:
+        for row in results:
+            sink.write([row])
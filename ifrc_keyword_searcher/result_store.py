@@ -0,0 +1,106 @@
+"""
+Compact store of keyword search results
+"""
+from array import array
+
+
+class ResultStore:
+    """
+    Column store of results rows, using much less memory than a list of lists for large numbers of results.
+
+    File names and keywords are stored once and referred to by id, pages, ids and rect coordinates are stored in arrays, and text blocks are stored in one UTF-8 buffer.
+    Rows can be read by index or slice like a list, and are returned as lists of [file name, page, keyword, text block, rect], where the rect is a tuple of (x0, y0, x1, y1).
+    """
+    def __init__(self):
+        self.filepaths = []
+        self.filepath_ids = {}
+        self.keywords = []
+        self.keyword_ids = {}
+        self.filepath_column = array('L')
+        self.page_column = array('L')
+        self.keyword_column = array('L')
+        self.rect_column = array('d')
+        self.text_buffer = bytearray()
+        self.text_offsets = array('Q', [0])
+
+
+    def __len__(self):
+        return len(self.page_column)
+
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('result index out of range')
+        return [self.filepaths[self.filepath_column[i]],
+                self.page_column[i],
+                self.keywords[self.keyword_column[i]],
+                self.text_buffer[self.text_offsets[i]:self.text_offsets[i+1]].decode('utf-8'),
+                tuple(self.rect_column[4*i:4*i+4])]
+
+
+    def __iadd__(self, rows):
+        self.extend(rows)
+        return self
+
+
+    def intern(self, value, values, ids):
+        """
+        Get the id of a file name or keyword, adding it if it is new.
+        """
+        if value not in ids:
+            ids[value] = len(values)
+            values.append(value)
+        return ids[value]
+
+
+    def append(self, row):
+        """
+        Add a results row of [file name, page, keyword, text block, rect].
+        """
+        self.filepath_column.append(self.intern(row[0], self.filepaths, self.filepath_ids))
+        self.page_column.append(row[1])
+        self.keyword_column.append(self.intern(row[2], self.keywords, self.keyword_ids))
+        self.text_buffer += row[3].encode('utf-8')
+        self.text_offsets.append(len(self.text_buffer))
+        self.rect_column.extend([float(coord) for coord in tuple(row[4])[:4]])
+
+
+    def extend(self, rows):
+        """
+        Add a list of results rows.
+        """
+        for row in rows:
+            self.append(row)
+
+
+    def display_rows(self, start, stop):
+        """
+        Get results rows to display in the results table, without the rect.
+
+        Parameters
+        ----------
+        start : int (required)
+            Index of the first row.
+
+        stop : int (required)
+            Index after the last row.
+        """
+        return [row[:4] for row in self[start:stop]]
+
+
+    def page_description(self, start, page_size):
+        """
+        Describe the rows shown on a page of the results table, for example "Results 1-200 of 5000".
+        """
+        if not len(self):
+            return ''
+        return f'Results {start+1}-{min(start+page_size, len(self))} of {len(self)}'
@@ -0,0 +1,241 @@
+"""
+Client of the search service, so that the GUI can run searches in the service instead of searching documents itself. This only uses the standard library, so does not load PyMuPDF.
+"""
+import json
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import settings
+from result_store import ResultStore
+
+# Set up logging
+logger = settings.get_logger("client")
+
+
+class SearchServiceError(Exception):
+    """
+    Raised if the search service can not be reached, or does not accept a request.
+    """
+    pass
+
+
+class SearchClient:
+    """
+    Send requests to the search service API, described in search_service.py.
+
+    Parameters
+    ----------
+    url : str (default=f'http://127.0.0.1:{settings.SERVICE_PORT}')
+        Address of the service.
+
+    timeout : float (default=30)
+        Maximum time in seconds to wait for each response.
+    """
+    def __init__(self, url=f'http://127.0.0.1:{settings.SERVICE_PORT}', timeout=30):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+
+    def request(self, method, path, body=None, query=None, raw=False):
+        """
+        Send a request to the service.
+
+        Parameters
+        ----------
+        method : str (required)
+            HTTP method of the request.
+
+        path : str (required)
+            Path of the API, such as '/searches'.
+
+        body : dict (default=None)
+            Value to send as JSON in the body of the request.
+
+        query : dict (default=None)
+            Parameters to add to the URL. Parameters which are None are not sent.
+
+        raw : bool (default=False)
+            Whether to return the body of the response as bytes, instead of reading it as JSON.
+
+        Raises
+        ------
+        SearchServiceError
+            If the service could not be reached, or sent an error response.
+        """
+        url = self.url + path
+        if query:
+            url += '?' + urllib.parse.urlencode({name: value for name, value in query.items() if value is not None})
+        data = None if body is None else json.dumps(body).encode('utf-8')
+        request = urllib.request.Request(url, data=data, method=method, headers={'Content-Type': 'application/json'} if data is not None else {})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                content = response.read()
+        except urllib.error.HTTPError as err:
+            try:
+                message = json.loads(err.read().decode('utf-8'))['error']
+            except Exception:
+                message = err.reason
+            raise SearchServiceError(f'The search service could not {method} {path}: {message}') from err
+        except (urllib.error.URLError, OSError) as err:
+            raise SearchServiceError(f'Could not connect to the search service at {self.url}: {getattr(err, "reason", err)}') from err
+        return content if raw else json.loads(content.decode('utf-8'))
+
+
+    def health(self):
+        """
+        Get the status of the service.
+        """
+        return self.request('GET', '/health')
+
+
+    def start_search(self, folder, keywords, word_pad=10, **options):
+        """
+        Start a search in the service.
+
+        Parameters
+        ----------
+        folder : str (required)
+            Path to the folder to search, as seen by the service.
+
+        keywords : list (required)
+            The keywords or queries to search for.
+
+        word_pad : int (default=10)
+            The number of words to be returned either side of the found keyword.
+
+        **options
+            mode, include, exclude, max_hits_per_keyword, max_hits_per_document or text_blocks, as in SearchService.start_search.
+
+        Returns
+        -------
+        search : dict
+            Progress of the search, with its id in 'id'.
+        """
+        return self.request('POST', '/searches', body=dict(options, folder=folder, keywords=list(keywords), word_pad=word_pad))
+
+
+    def progress(self, search_id):
+        """
+        Get the progress of a search, as in SearchJob.to_dict.
+        """
+        return self.request('GET', f'/searches/{search_id}')
+
+
+    def stop_search(self, search_id):
+        """
+        Stop a search.
+        """
+        return self.request('DELETE', f'/searches/{search_id}')
+
+
+    def results_page(self, search_id, cursor=None, limit=None):
+        """
+        Get the next page of results of a search, as in SearchJob.results_page.
+
+        The rects of the results rows, and the page numbers and rects of the keyword instances, are converted back from JSON to the types given by DocumentSearcher.
+        """
+        page = self.request('GET', f'/searches/{search_id}/results', query={'cursor': cursor, 'limit': limit})
+        for document in page['documents']:
+            document['results'] = [result[:4] + [tuple(result[4])] for result in document['results']]
+            if document.get('instances') is not None:
+                document['instances'] = {int(pageno): [tuple(rect) for rect in rects] for pageno, rects in document['instances'].items()}
+        return page
+
+
+    def render_page(self, search_id, filepath, pageno, zoom=1.5):
+        """
+        Get a PNG image of a page of a document found by a search, with the keywords highlighted.
+
+        Parameters
+        ----------
+        filepath : str (required)
+            File name of the document, as given in the results.
+
+        pageno : int (required)
+            Page number (starting from 0).
+
+        zoom : float (default=1.5)
+            Zoom factor to render the page at.
+        """
+        return self.request('GET', f'/searches/{search_id}/pages', query={'file': filepath, 'page': pageno+1, 'zoom': zoom}, raw=True)
+
+
+    def search_for_keywords(self, search_folder, keywords, word_pad, window, sink=None, mode='all', include=None, exclude=None, poll_interval=0.5, generation=None):
+        """
+        Run a search in the service, reading the results page by page as they are found. Run in a thread, in place of DocumentSearcher.search_for_keywords.
+
+        The results are added to settings.keyword_results and settings.keyword_instances, and the same '-SEARCH PROGRESS-' and '-SEARCH DONE-' events are sent to the window as by DocumentSearcher.search_for_keywords.
+        The search in the service is stopped if it is cancelled, or a newer search starts, as in DocumentSearcher.search_for_keywords.
+
+        Parameters
+        ----------
+        search_folder, keywords, word_pad, window, sink, generation
+            As in DocumentSearcher.search_for_keywords.
+
+        mode : str (default='all')
+            Name of the search mode, as in search_modes.get_search_mode.
+
+        include, exclude : list (default=None)
+            Glob patterns of the files to include and exclude, as in DocumentFinder.
+
+        poll_interval : float (default=0.5)
+            Time in seconds to wait before asking for more results when there are no new results.
+        """
+        generation = settings.search_generation if generation is None else generation
+        keyword_results = settings.keyword_results = ResultStore()
+        keyword_instances = settings.keyword_instances = {}
+        settings.duplicate_documents = {}
+        progress = {'generation': generation, 'searched': 0, 'total': 0, 'finding': True, 'keywords': 0, 'documents': 0, 'results': 0, 'duplicates': 0, 'resumed': 0, 'warnings': []}
+        metrics_summary = ''
+        search_id = None
+        completed = False
+        try:
+            search_id = self.start_search(search_folder, keywords, word_pad, mode=mode, include=include, exclude=exclude)['id']
+            cursor = None
+            while settings.is_current_search(generation):
+                page = self.results_page(search_id, cursor=cursor)
+                cursor = page['next_cursor']
+                for document in page['documents']:
+                    if document.get('warning'):
+                        progress['warnings'].append(document['warning'])
+                    if document.get('instances') is not None:
+                        keyword_instances[document['file']] = document['instances']
+                    if document['results']:
+                        keyword_results += document['results']
+                        if sink is not None:
+                            sink.write(document['results'])
+                progress['results'] = len(keyword_results)
+
+                # Take the counts from the service, which also counts the documents without results
+                search_progress = self.progress(search_id)
+                progress.update({name: search_progress[name] for name in ('searched', 'total', 'finding', 'keywords', 'documents', 'duplicates')})
+                window.write_event_value('-SEARCH PROGRESS-', dict(progress))
+                progress['warnings'] = []
+                if page['finished']:
+                    completed = search_progress['status'] == 'finished'
+                    metrics_summary = search_progress.get('metrics') or ''
+                    break
+                if not page['documents']:
+                    time.sleep(poll_interval)
+        except SearchServiceError as err:
+            logger.warning(str(err))
+            progress['warnings'].append(str(err))
+        finally:
+            if (search_id is not None) and not completed:
+                try:
+                    self.stop_search(search_id)
+                except SearchServiceError as err:
+                    logger.warning(str(err))
+            if sink is not None:
+                try:
+                    if completed:
+                        sink.close()
+                    else:
+                        sink.abort()
+                except Exception as err:
+                    logger.exception('Error closing the results file')
+                    progress['warnings'].append(f'The results file could not be saved: {err}')
+            progress['finding'] = False
+            settings.end_search(generation)
+            window.write_event_value('-SEARCH DONE-', dict(progress, metrics=metrics_summary))
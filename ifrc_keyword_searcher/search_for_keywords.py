@@ -1,309 +1,537 @@
 import os
+import time
 import pathlib
+import threading
+import multiprocessing
 import PySimpleGUI as sg
 import settings
-from document_searcher import DocumentSearcher
-from document import Document
+from document_exporter import EXPORT_MODES
+from search_modes import SEARCH_MODES, get_search_mode
 """
 GUI application to search for keywords in IFRC documents.
+
+The modules which search and show documents load PyMuPDF, which is slow to load (especially in the packaged application, where each library is scanned by Windows security).
+They are imported where they are used, and loaded in the background once the window has appeared, so that the window appears quickly.
 """
 # Set up logging
 logger = settings.get_logger("base")
 
-
-"""
-Define the window layout
-"""
-logger.info('Program starting')
-sg.change_look_and_feel('Default1')
-new_page = 0
-image_elem = sg.Image(key='-DOC VIEWER-', expand_x=True, expand_y=True)
-goto = sg.InputText(str(new_page + 1), size=(5, 1), key='-SET PAGE-')
-results_headers = ['File name', 'Page', 'Keyword', 'Text block']
-
-# Full layout
-layout = [
-    [
-        sg.Column([
-            [
-                sg.Image(os.path.join(settings.CURRENT_DIR, 'static/ifrc_nsd_logo.png')),
-                sg.VSeparator(),
-                sg.Text('Keyword Searcher', key='-TITLE-', font = ('OpenSans-Regular', 16), text_color='Black')
-            ],
-            [sg.Text('Select a folder with documents to search')],
-            [sg.Combo(sorted(sg.user_settings_get_entry('-foldernames-', [])), default_value=sg.user_settings_get_entry('-last foldername-', ''), size=(45, 1), key='-FOLDERNAME-')],
-            [sg.FolderBrowse(target='-FOLDERNAME-'), sg.B('Clear History')],
-            [sg.Text('Enter keywords (one per line)', pad=((5, 185), 3))],
-            [sg.Multiline('\n'.join(sg.user_settings_get_entry('-keywords-', [])), size=(45, 5), key='-KEYWORDS-')],
-            [sg.Text('Number of words as padding in results'), sg.InputText(10 if not sg.user_settings_get_entry('-LAST WORD PAD-') else sg.user_settings_get_entry('-LAST WORD PAD-'), size=(5, 1), key='-SET WORD PAD-')],
-            [sg.Button('Search', key='-SEARCH FOR KEYWORDS-'), sg.Text('', key='-SEARCH ERROR-', text_color='red')],
-            [sg.Text('', key='-SEARCH WARNING-', text_color='red', visible=False)],
-            [sg.ProgressBar(max_value=100, orientation='h', size=(20, 20), key='progress'),
-            sg.Text("0 %", size=(6, 1), key='Percent')],
-            [sg.Text("", key='-RESULTS SUMMARY-')],
-            [sg.Table(values=[[]],
-                      headings=results_headers,
-                      auto_size_columns=False,
-                      col_widths=(10, 5, 7, 13),
-                      key="-RESULTS TABLE-",
-                      enable_events=True,
-                      justification='left',
-                      expand_y=True)],
-            [sg.Multiline('', size=(45, 10), visible=False, key='-TEXTBLOCK-')],
-            [sg.InputText('', do_not_clear=False, visible=False, key='-EXPORT RESULTS-', enable_events=True),
-            sg.FileSaveAs('Save results', target='-EXPORT RESULTS-', file_types=(("CSV Files", "*.csv"),)),
-            sg.InputText('', do_not_clear=False, visible=False, key='-SAVE KEYWORD DOCUMENTS-', enable_events=True),
-            sg.FolderBrowse('Save all documents containing keywords', target='-SAVE KEYWORD DOCUMENTS-')],
-            [sg.Text('', key='-SAVE MESSAGE-', text_color='green')],
-        ], expand_y=True, expand_x=False, key='-SEARCH COLUMN-', scrollable=True, vertical_scroll_only=True),
-        sg.VSeparator(),
-        sg.Column([
-            [
-                sg.Text('', key='-DOCUMENT NAME-'),
-                sg.Button('Prev', key='-PREV PAGE-'),
-                sg.Button('Next', key='-NEXT PAGE-'),
-                sg.Text('Page:'),
-                goto,
-                sg.Text('', key='-TOTAL PAGES-'),
-            ],
-            [image_elem],
-        ], key='-DOC VIEWER COLUMN-', visible=False, scrollable=True, vertical_scroll_only=False, size=(920, None), expand_x=True, expand_y=True)
+# File types the results can be saved as
+RESULTS_FILE_TYPES = (("CSV Files", "*.csv"), ("JSON Lines Files", "*.jsonl"), ("Parquet Files", "*.parquet"))
+
+
+def export_results_in_background(results, export_filename, window):
+    """
+    Save results to a file, and send an event to the window with a message when finished. Run in a thread so that the window does not freeze.
+    """
+    from result_sink import export_results
+    try:
+        export_results(results, export_filename)
+        message = 'Results saved successfully'
+    except Exception as err:
+        logger.exception('Error saving results')
+        message = 'Results could not be saved'
+    window.write_event_value('-EXPORT RESULTS DONE-', message)
+
+
+def open_highlighted_copy(temp_filepath, selected_page):
+    """
+    Open a highlighted copy of a document in the default application, trying to open it at the selected page.
+    """
+    import webbrowser
+    try:
+        open_path = pathlib.Path(temp_filepath).as_uri()
+        webbrowser.open(f'{open_path}#page={selected_page}') # The page information is being stripped....
+    except Exception as err:
+        os.startfile(temp_filepath)
+
+
+def load_search_modules():
+    """
+    Import the modules used to search and show documents, so that they are ready when they are first used. Run in a thread after the window has appeared.
+    """
+    start = time.perf_counter()
+    try:
+        import document_searcher, corpus_index, word_cache, result_sink, page_renderer, query, search_journal, search_client
+    except Exception as err:
+        logger.exception('Error loading search modules')
+        return
+    logger.info(f'Search modules loaded in {time.perf_counter()-start:.2f}s')
+
+
+def build_doc_viewer(window):
+    """
+    Add the document viewer to its column the first time a document is shown, so that it is not built before the window appears.
+
+    Returns
+    -------
+    image_elem : PySimpleGUI Image element
+        Element to show pages in.
+
+    goto : PySimpleGUI InputText element
+        Input of the page number to show.
+    """
+    image_elem = sg.Image(key='-DOC VIEWER-', expand_x=True, expand_y=True)
+    goto = sg.InputText('1', size=(5, 1), key='-SET PAGE-')
+    window.extend_layout(window['-DOC VIEWER COLUMN-'], [
+        [
+            sg.Text('', key='-DOCUMENT NAME-'),
+            sg.Button('Prev', key='-PREV PAGE-'),
+            sg.Button('Next', key='-NEXT PAGE-'),
+            sg.Text('Page:'),
+            goto,
+            sg.Text('', key='-TOTAL PAGES-'),
+        ],
+        [image_elem],
+    ])
+    window['-SET PAGE-'].bind("<Return>", "_enter")
+    window['-DOC VIEWER-'].bind('<Enter>', '_hover')
+    window['-DOC VIEWER-'].bind('<Leave>', '_away')
+    return image_elem, goto
+
+
+def main():
+    """
+    Run the GUI application.
+    """
+    """
+    Define the window layout
+    """
+    logger.info('Program starting')
+    start = time.perf_counter()
+    sg.change_look_and_feel('Default1')
+    new_page = 0
+    image_elem = goto = None # The document viewer is built when the first document is shown
+    results_headers = settings.RESULTS_HEADERS
+
+    # Full layout
+    layout = [
+        [
+            sg.Column([
+                [
+                    sg.Image(os.path.join(settings.CURRENT_DIR, 'static/ifrc_nsd_logo.png')),
+                    sg.VSeparator(),
+                    sg.Text('Keyword Searcher', key='-TITLE-', font = ('OpenSans-Regular', 16), text_color='Black')
+                ],
+                [sg.Text('Select a folder with documents to search')],
+                [sg.Combo(sorted(sg.user_settings_get_entry('-foldernames-', [])), default_value=sg.user_settings_get_entry('-last foldername-', ''), size=(45, 1), key='-FOLDERNAME-')],
+                [sg.FolderBrowse(target='-FOLDERNAME-'), sg.B('Clear History')],
+                [sg.Text('Enter keywords or queries (one per line)', pad=((5, 135), 3))],
+                [sg.Multiline('\n'.join(sg.user_settings_get_entry('-keywords-', [])), size=(45, 5), key='-KEYWORDS-', tooltip='Start a line with query: to search for a query, such as query: cholera NEAR/10 vaccin*')],
+                [sg.Text('Number of words as padding in results'), sg.InputText(10 if not sg.user_settings_get_entry('-LAST WORD PAD-') else sg.user_settings_get_entry('-LAST WORD PAD-'), size=(5, 1), key='-SET WORD PAD-')],
+                [sg.Text('Number of documents to search in parallel'), sg.InputText(sg.user_settings_get_entry('-LAST WORKERS-', os.cpu_count() or 1), size=(5, 1), key='-SET WORKERS-')],
+                [sg.Text('Files to search'), sg.InputText(sg.user_settings_get_entry('-INCLUDE-', ', '.join(settings.DOCUMENT_INCLUDE)), size=(25, 1), key='-INCLUDE-')],
+                [sg.Text('Files and folders to skip'), sg.InputText(sg.user_settings_get_entry('-EXCLUDE-', ''), size=(20, 1), key='-EXCLUDE-')],
+                [sg.Text('Find'), sg.Combo(list(SEARCH_MODES.values()), default_value=SEARCH_MODES.get(sg.user_settings_get_entry('-SEARCH MODE-', 'all'), SEARCH_MODES['all']), readonly=True, key='-SEARCH MODE-')],
+                [sg.Checkbox('Use search index (faster repeat searches of the same folder)', default=sg.user_settings_get_entry('-USE INDEX-', False), key='-USE INDEX-')],
+                [sg.Text('Search service address (optional)'), sg.InputText(sg.user_settings_get_entry('-SEARCH SERVICE-', ''), size=(20, 1), key='-SEARCH SERVICE-')],
+                [sg.Text('Save results to a file while searching (optional)')],
+                [sg.InputText(sg.user_settings_get_entry('-STREAM RESULTS FILE-', ''), size=(35, 1), key='-STREAM RESULTS FILE-'),
+                sg.FileSaveAs('Browse', target='-STREAM RESULTS FILE-', file_types=RESULTS_FILE_TYPES)],
+                [sg.Button('Search', key='-SEARCH FOR KEYWORDS-'), sg.Text('', key='-SEARCH ERROR-', text_color='red')],
+                [sg.Text('', key='-SEARCH WARNING-', text_color='red', visible=False)],
+                [sg.ProgressBar(max_value=100, orientation='h', size=(20, 20), key='progress'),
+                sg.Text("0 %", size=(6, 1), key='Percent')],
+                [sg.Text("", key='-RESULTS SUMMARY-')],
+                [sg.Text("", key='-METRICS SUMMARY-', font=('OpenSans-Regular', 8), text_color='grey')],
+                [sg.Table(values=[[]],
+                          headings=results_headers,
+                          auto_size_columns=False,
+                          col_widths=(10, 5, 7, 13),
+                          key="-RESULTS TABLE-",
+                          enable_events=True,
+                          justification='left',
+                          expand_y=True)],
+                [sg.Button('<', key='-PREV RESULTS-'), sg.Text('', key='-RESULTS PAGE-'), sg.Button('>', key='-NEXT RESULTS-')],
+                [sg.Multiline('', size=(45, 10), visible=False, key='-TEXTBLOCK-')],
+                [sg.InputText('', do_not_clear=False, visible=False, key='-EXPORT RESULTS-', enable_events=True),
+                sg.FileSaveAs('Save results', target='-EXPORT RESULTS-', file_types=RESULTS_FILE_TYPES),
+                sg.InputText('', do_not_clear=False, visible=False, key='-SAVE KEYWORD DOCUMENTS-', enable_events=True),
+                sg.FolderBrowse('Save all documents containing keywords', target='-SAVE KEYWORD DOCUMENTS-')],
+                [sg.Text('Save documents as'),
+                sg.Combo(list(EXPORT_MODES.values()), default_value=EXPORT_MODES.get(sg.user_settings_get_entry('-EXPORT MODE-', 'incremental'), EXPORT_MODES['incremental']), readonly=True, key='-EXPORT MODE-')],
+                [sg.Text('', key='-SAVE MESSAGE-', text_color='green')],
+            ], expand_y=True, expand_x=False, key='-SEARCH COLUMN-', scrollable=True, vertical_scroll_only=True),
+            sg.VSeparator(),
+            sg.Column([[]], key='-DOC VIEWER COLUMN-', visible=False, scrollable=True, vertical_scroll_only=False, size=(920, None), expand_x=True, expand_y=True)
+        ]
     ]
-]
-window = sg.Window('IFRC Keyword Searcher',
-                   layout,
-                   return_keyboard_events=True,
-                   finalize=True,
-                   resizable=True,
-                   size=(420,660),
-                   icon=os.path.join(settings.CURRENT_DIR, 'static/ifrc_nsd_logo.ico'))
-window['-SET PAGE-'].bind("<Return>", "_enter")
-window['-DOC VIEWER-'].bind('<Enter>', '_hover')
-window['-DOC VIEWER-'].bind('<Leave>', '_away')
-window['-RESULTS TABLE-'].bind('<Double-Button-1>', '_double_click')
-window['-RESULTS TABLE-'].bind("<Return>", "_enter")
-
-"""
-Create an event loop
-"""
-# Create the event loop
-search_folder = search_keywords = None
-doc_viewer_hover = False
-display_lists = []
-view_doc_viewer = False
-open_filepath = None
-temp_dir = None
-
-settings.init()
-
-
-while True:
-    event, values = window.read()
-    update_page = False
-
-    if event == sg.WIN_CLOSED:
-        settings.searching = False
-        break
-
-    # Clear the search documents folder history
-    elif event == 'Clear History':
-        sg.user_settings_set_entry('-foldernames-', [])
-        sg.user_settings_set_entry('-last foldername-', '')
-        window['-FOLDERNAME-'].update(values=[], value='')
-
-    # Search for keywords!
-    elif event == '-SEARCH FOR KEYWORDS-':
-        search_folder = values['-FOLDERNAME-']
-        keywords = [word.strip() for word in values['-KEYWORDS-'].split('\n') if word.strip()!='']
-
-        # Check there is a folder and keywords entered
-        if not os.path.isdir(search_folder):
-            window['-SEARCH ERROR-'].update(value='Please enter a valid search folder')
-            continue
-        if not search_folder and not keywords:
-            window['-SEARCH ERROR-'].update(value='Please enter a search folder and keywords')
-            continue
-        elif not search_folder:
-            window['-SEARCH ERROR-'].update(value='Please enter a search folder')
-            continue
-        elif not search_folder:
-            window['-KEYWORDS-'].update(value='Please enter keywords')
-            continue
-
-        # If searching already, then cancel the search
-        if settings.searching:
-            logger.info("Keyword searching cancelling")
+    window = sg.Window('IFRC Keyword Searcher',
+                       layout,
+                       return_keyboard_events=True,
+                       finalize=True,
+                       resizable=True,
+                       size=(420,660),
+                       icon=os.path.join(settings.CURRENT_DIR, 'static/ifrc_nsd_logo.ico'))
+    window['-RESULTS TABLE-'].bind('<Double-Button-1>', '_double_click')
+    window['-RESULTS TABLE-'].bind("<Return>", "_enter")
+    page_renderer = None # Created when the first document is shown
+    logger.info(f'Window shown in {time.perf_counter()-start:.2f}s')
+
+    # Load the search modules while the user enters the search
+    threading.Thread(target=load_search_modules, daemon=True).start()
+
+    """
+    Create an event loop
+    """
+    # Create the event loop
+    search_folder = search_keywords = None
+    doc_viewer_hover = False
+    view_doc_viewer = False
+    open_filepath = None
+    open_file = None
+    temp_dir = None
+    highlighted_copies = None
+    results_offset = 0 # Index of the first result shown in the results table
+    results_shown = 0 # Number of results shown in the results table while searching
+
+    settings.init()
+
+
+    while True:
+        event, values = window.read()
+        update_page = False
+
+        if event == sg.WIN_CLOSED:
             settings.searching = False
-            window['-SEARCH FOR KEYWORDS-'].update('Search')
-
-        # Else begin searching
-        else:
-            logger.info("Keyword searching starting")
-            window['-SEARCH ERROR-'].update(value='')
-            settings.searching = True
-            open_filepath = open_page = open_file = None # Refresh to set everything as closed
-            if view_doc_viewer:
-                view_doc_viewer = False
-                window['-DOC VIEWER COLUMN-'].update(visible=view_doc_viewer)
-                window.refresh()
-            window['-SEARCH WARNING-'].update(visible=False, value='')
-            window['-SAVE MESSAGE-'].update(visible=False, value='')
-            window['-SEARCH FOR KEYWORDS-'].update('Cancel')
-            window['-RESULTS TABLE-'].update([[]])
-            window['-RESULTS SUMMARY-'].update(value=f'0 keywords found in 0 documents')
-            window['-TEXTBLOCK-'].update(visible=False, value='')
-
-            # Save the keywords, and folder path for next time
-            sg.user_settings_set_entry('-keywords-', list(set(keywords)))
-            sg.user_settings_set_entry('-foldernames-', list(set(sg.user_settings_get_entry('-foldernames-', []) + [search_folder, ])))
-            sg.user_settings_set_entry('-last foldername-', search_folder)
-
-            # Set the word padding based on the user input
+            settings.exporting = False
+            if page_renderer is not None:
+                page_renderer.close()
+            break
+
+        # Clear the search documents folder history
+        elif event == 'Clear History':
+            sg.user_settings_set_entry('-foldernames-', [])
+            sg.user_settings_set_entry('-last foldername-', '')
+            window['-FOLDERNAME-'].update(values=[], value='')
+
+        # Search for keywords!
+        elif event == '-SEARCH FOR KEYWORDS-':
+            search_folder = values['-FOLDERNAME-']
+            keywords = [word.strip() for word in values['-KEYWORDS-'].split('\n') if word.strip()!='']
+
+            # Check there is a folder and keywords entered
+            if not os.path.isdir(search_folder):
+                window['-SEARCH ERROR-'].update(value='Please enter a valid search folder')
+                continue
+            if not search_folder and not keywords:
+                window['-SEARCH ERROR-'].update(value='Please enter a search folder and keywords')
+                continue
+            elif not search_folder:
+                window['-SEARCH ERROR-'].update(value='Please enter a search folder')
+                continue
+            elif not search_folder:
+                window['-KEYWORDS-'].update(value='Please enter keywords')
+                continue
+
+            # If searching already, then cancel the search
+            # The search thread stops in the background, and ends the search when it has stopped
+            if settings.searching:
+                logger.info("Keyword searching cancelling")
+                settings.searching = False
+                window['-SEARCH FOR KEYWORDS-'].update('Search')
+
+            # Else begin searching
+            else:
+
+                from document_searcher import DocumentSearcher, DocumentFinder
+                from word_cache import WordCache
+                from corpus_index import CorpusIndex
+                from result_sink import open_result_sink
+                from query import QueryError, compile_keywords
+
+                # Check the queries in the keywords can be compiled
+                try:
+                    compile_keywords(keywords)
+                except QueryError as err:
+                    window['-SEARCH ERROR-'].update(value=str(err))
+                    continue
+
+                # Open the file to save results to while searching
+                sink = None
+                stream_filename = values['-STREAM RESULTS FILE-'].strip()
+                sg.user_settings_set_entry('-STREAM RESULTS FILE-', stream_filename)
+                if stream_filename:
+                    try:
+                        sink = open_result_sink(stream_filename)
+                    except Exception as err:
+                        logger.exception('Error opening file to save results')
+                        window['-SEARCH ERROR-'].update(value=f'Could not save results to {stream_filename}')
+                        continue
+
+                logger.info("Keyword searching starting")
+                window['-SEARCH ERROR-'].update(value='')
+                generation = settings.start_search()
+                if open_file: open_file.close()
+                open_filepath = open_page = open_file = None # Refresh to set everything as closed
+                if page_renderer is not None:
+                    page_renderer.clear()
+                if view_doc_viewer:
+                    view_doc_viewer = False
+                    window['-DOC VIEWER COLUMN-'].update(visible=view_doc_viewer)
+                    window.refresh()
+                window['-SEARCH WARNING-'].update(visible=False, value='')
+                window['-SAVE MESSAGE-'].update(visible=False, value='')
+                window['-SEARCH FOR KEYWORDS-'].update('Cancel')
+                window['-RESULTS TABLE-'].update([[]])
+                window['-RESULTS PAGE-'].update(value='')
+                results_offset = results_shown = 0
+                window['-RESULTS SUMMARY-'].update(value=f'0 keywords found in 0 documents')
+                window['-METRICS SUMMARY-'].update(value='')
+                window['-TEXTBLOCK-'].update(visible=False, value='')
+
+                # Save the keywords, and folder path for next time
+                sg.user_settings_set_entry('-keywords-', list(set(keywords)))
+                sg.user_settings_set_entry('-foldernames-', list(set(sg.user_settings_get_entry('-foldernames-', []) + [search_folder, ])))
+                sg.user_settings_set_entry('-last foldername-', search_folder)
+                sg.user_settings_set_entry('-USE INDEX-', values['-USE INDEX-'])
+
+                # Set the word padding based on the user input
+                try:
+                    word_pad = int(values['-SET WORD PAD-'])
+                    sg.user_settings_set_entry('-LAST WORD PAD-', word_pad)
+                except Exception as err:
+                    word_pad = 10
+                    window['-SET WORD PAD-'].update(10)
+
+                # Set the number of parallel searches based on the user input
+                try:
+                    workers = max(1, int(values['-SET WORKERS-']))
+                    sg.user_settings_set_entry('-LAST WORKERS-', workers)
+                except Exception as err:
+                    workers = os.cpu_count() or 1
+                    window['-SET WORKERS-'].update(workers)
+
+                # Set the patterns of the files to search and skip, separated by commas
+                include = [pattern.strip() for pattern in values['-INCLUDE-'].split(',') if pattern.strip()] or settings.DOCUMENT_INCLUDE
+                exclude = [pattern.strip() for pattern in values['-EXCLUDE-'].split(',') if pattern.strip()]
+                sg.user_settings_set_entry('-INCLUDE-', ', '.join(include))
+                sg.user_settings_set_entry('-EXCLUDE-', ', '.join(exclude))
+
+                # Set the results to find in each document, so that triage searches stop searching each document early
+                search_mode_name = next((mode for mode, description in SEARCH_MODES.items() if description==values['-SEARCH MODE-']), 'all')
+                sg.user_settings_set_entry('-SEARCH MODE-', search_mode_name)
+                search_mode = get_search_mode(search_mode_name)
+
+                # Run the search in the search service if its address is given, so that documents already extracted by the service are not extracted again
+                # The service searches the folder as it sees it, so the folder must be given as a path which is the same on both computers, such as a shared drive
+                service_url = values['-SEARCH SERVICE-'].strip()
+                sg.user_settings_set_entry('-SEARCH SERVICE-', service_url)
+                if service_url:
+                    from search_client import SearchClient
+                    window['-RESULTS SUMMARY-'].update(value=f'Searching with the search service at {service_url}')
+                    thread = threading.Thread(target=SearchClient(service_url if '://' in service_url else f'http://{service_url}').search_for_keywords,
+                                              args=(search_folder, keywords, word_pad, window, sink, search_mode_name, include, exclude), kwargs={'generation': generation})
+                    thread.start()
+                    continue
+
+                # Offer to resume the last search with the same folder, keywords, word padding and search mode if it did not finish
+                from search_journal import SearchJournal
+                journal = SearchJournal()
+                unfinished = journal.unfinished_documents(search_folder, keywords, word_pad, mode=search_mode)
+                journal.close()
+                resume = bool(unfinished) and sg.popup_yes_no(f'A search of this folder for the same keywords did not finish, after searching {unfinished} documents.\n\nResume it, only searching the remaining documents?',
+                                                              title='Resume search') == 'Yes'
+
+                # Loop through files in the folder (recursively) as they are found, and search for keywords
+                filepaths_to_search = DocumentFinder(search_folder, include=include, exclude=exclude, should_stop=lambda generation=generation: not settings.is_current_search(generation))
+                window['-RESULTS SUMMARY-'].update(value=f'Looking for documents to search')
+                thread = threading.Thread(target=DocumentSearcher(word_cache=WordCache(), workers=workers, index=CorpusIndex() if values['-USE INDEX-'] else None,
+                                                         time_limit=settings.DOCUMENT_TIME_LIMIT, memory_limit=settings.DOCUMENT_MEMORY_LIMIT, mode=search_mode).search_for_keywords, args=(filepaths_to_search, search_folder, keywords, word_pad, window, sink, journal, resume, generation))
+                thread.start()
+
+        # Show the progress of the search, sent from the search thread
+        elif event in ('-SEARCH PROGRESS-', '-SEARCH DONE-'):
+            progress = values[event]
+
+            # Ignore the events of a cancelled search which was still stopping when a new search started
+            if progress['generation'] != settings.search_generation:
+                continue
+            if progress['warnings']:
+                warning_text = window['-SEARCH WARNING-']
+                warning_message = '\n'.join(progress['warnings'])
+                if warning_text.get():
+                    warning_message = f'{warning_text.get()}\n{warning_message}'
+                warning_text.update(value=warning_message, visible=True)
+            percent_completed = 100*progress['searched']/progress['total'] if progress['total'] else 100
+            window['Percent'].update(value=f'{round(percent_completed, 1)} %')
+            window['progress'].update_bar(percent_completed)
+            window['-RESULTS SUMMARY-'].update(value=f'Found {progress["total"]} documents to search{" so far" if progress["finding"] else ""}\n{progress["keywords"]} keywords found in {progress["documents"]} documents' + (f'\n{progress["duplicates"]} copies of documents not searched again' if progress['duplicates'] else '')
+                                                 + (f'\n{progress["resumed"]} documents taken from the unfinished search' if progress['resumed'] else ''))
+
+            # Show the first results while searching, until the first page of the results table is full
+            if event == '-SEARCH PROGRESS-':
+                if results_shown < min(progress['results'], settings.RESULTS_PAGE_SIZE):
+                    results_shown = min(progress['results'], settings.RESULTS_PAGE_SIZE)
+                    window['-RESULTS TABLE-'].update(settings.keyword_results.display_rows(0, results_shown))
+            else:
+                results_offset = 0
+                window['-SEARCH FOR KEYWORDS-'].update('Search')
+                window['-RESULTS TABLE-'].update(settings.keyword_results.display_rows(0, settings.RESULTS_PAGE_SIZE))
+                window['-RESULTS PAGE-'].update(value=settings.keyword_results.page_description(0, settings.RESULTS_PAGE_SIZE))
+                window['-METRICS SUMMARY-'].update(value=progress['metrics'])
+
+        # Export the results in the background
+        elif event=='-EXPORT RESULTS-':
+            export_filename = values['-EXPORT RESULTS-']
+            if export_filename:
+                if settings.keyword_results:
+                    window['-SAVE MESSAGE-'].update(value='Saving results...', visible=True)
+                    threading.Thread(target=export_results_in_background, args=(settings.keyword_results, export_filename, window), daemon=True).start()
+        elif event=='-EXPORT RESULTS DONE-':
+            window['-SAVE MESSAGE-'].update(value=values[event], visible=True)
+
+        # Save all documents containing keywords in the background, in parallel
+        elif event=='-SAVE KEYWORD DOCUMENTS-':
+            export_foldername = values['-SAVE KEYWORD DOCUMENTS-']
+            if export_foldername and not settings.exporting:
+                if settings.keyword_instances:
+                    export_mode = next(mode for mode, description in EXPORT_MODES.items() if description==values['-EXPORT MODE-'])
+                    sg.user_settings_set_entry('-EXPORT MODE-', export_mode)
+                    try:
+                        workers = max(1, int(values['-SET WORKERS-']))
+                    except Exception as err:
+                        workers = os.cpu_count() or 1
+                    settings.exporting = True
+                    window['-SAVE MESSAGE-'].update(value='Saving documents...', visible=True)
+                    from document_exporter import DocumentExporter
+                    exporter = DocumentExporter(workers=workers, mode=export_mode)
+                    threading.Thread(target=exporter.export_for_window, args=(dict(settings.keyword_instances), search_folder, export_foldername, window, dict(settings.duplicate_documents)), daemon=True).start()
+        elif event=='-EXPORT DOCUMENTS PROGRESS-':
+            if settings.exporting:
+                window['-SAVE MESSAGE-'].update(value=f'Saving documents... {values[event][0]} of {values[event][1]}', visible=True)
+        elif event=='-EXPORT DOCUMENTS DONE-':
+            window['-SAVE MESSAGE-'].update(value=values[event], visible=True)
+
+        # Show the previous or next page of results in the table
+        elif event in ('-PREV RESULTS-', '-NEXT RESULTS-'):
+            if settings.keyword_results and not settings.searching:
+                step = settings.RESULTS_PAGE_SIZE if event=='-NEXT RESULTS-' else -settings.RESULTS_PAGE_SIZE
+                if 0 <= results_offset+step < len(settings.keyword_results):
+                    results_offset += step
+                    window['-RESULTS TABLE-'].update(settings.keyword_results.display_rows(results_offset, results_offset+settings.RESULTS_PAGE_SIZE))
+                    window['-RESULTS PAGE-'].update(value=settings.keyword_results.page_description(results_offset, settings.RESULTS_PAGE_SIZE))
+
+        # Display PDFs with keyword when clicked on in table
+        elif event=='-RESULTS TABLE-':
+            if settings.keyword_results and values[event]:
+
+                # Get the filename, keyword, and page from the selected row
+                selected_row = settings.keyword_results[results_offset+values[event][0]]
+                selected_filepath = selected_row[0]
+                new_page = selected_row[1]-1
+                selected_keyword = selected_row[2]
+
+                # Update the textblock
+                window['-TEXTBLOCK-'].update(selected_row[3], visible=bool(selected_row[3]))
+
+                # Clicking to open a NEW file: open the file with fitz to get the pages. Pages are rendered with highlighting by the page renderer.
+                if selected_filepath!=open_filepath:
+                    update_page = True
+                    if open_file: open_file.close()
+
+                    # Open the file with fitz
+                    from document import Document
+                    if image_elem is None:
+                        image_elem, goto = build_doc_viewer(window)
+                    open_document_path = os.path.join(search_folder, selected_filepath)
+                    doc = Document(filepath=open_document_path)
+                    total_pages = doc.total_pages
+                    open_filepath = selected_filepath
+                    open_file = doc.doc
+
+                    # Set the total pages text
+                    window['-DOCUMENT NAME-'].update(f'{os.path.basename(open_filepath)}')
+                    window['-TOTAL PAGES-'].update(f'Total pages: {doc.total_pages}')
+
+                # Update the position
+                keyword_position = selected_row[4][1]
+                page_height = open_file[new_page].rect.height
+                window["-DOC VIEWER COLUMN-"].Widget.canvas.yview_moveto(keyword_position/page_height)
+
+        # Double clicking a row in the results table should open the file
+        elif event in('-RESULTS TABLE-_double_click', '-RESULTS TABLE-_enter'):
+            if settings.keyword_results and values['-RESULTS TABLE-']:
+
+                # Get information on the selected row from the table
+                selected_row = settings.keyword_results[results_offset+values['-RESULTS TABLE-'][0]]
+                selected_filepath = selected_row[0]
+                selected_page = selected_row[1]-1
+
+                # Get the highlighted copy of the document, which is saved in the background the first time it is opened
+                import tempfile
+                if temp_dir is None:
+                    from document_exporter import HighlightedCopies
+                    temp_dir = tempfile.TemporaryDirectory()
+                    highlighted_copies = HighlightedCopies(temp_dir.name)
+                try:
+                    temp_filepath = highlighted_copies.get(os.path.join(search_folder, selected_filepath), settings.keyword_instances[selected_filepath], window, event_value=selected_page)
+                except Exception as err:
+                    logger.exception('Error opening highlighted document')
+                    continue
+                if temp_filepath is None:
+                    window['-SAVE MESSAGE-'].update(value='Opening document...', visible=True)
+                else:
+                    open_highlighted_copy(temp_filepath, selected_page)
+        elif event=='-HIGHLIGHTED COPY READY-':
+            temp_filepath, selected_page = values[event]
+            if temp_filepath is None:
+                window['-SAVE MESSAGE-'].update(value='The document could not be opened', visible=True)
+            else:
+                window['-SAVE MESSAGE-'].update(value='', visible=False)
+                open_highlighted_copy(temp_filepath, selected_page)
+
+        # Change pages of the document
+        elif event=='-SET PAGE-_enter':
             try:
-                word_pad = int(values['-SET WORD PAD-'])
-                sg.user_settings_set_entry('-LAST WORD PAD-', word_pad)
-            except Exception as err:
-                word_pad = 10
-                window['-SET WORD PAD-'].update(10)
-
-            # Loop through files in the folder (recursively) and search for keywords
-            filepaths_to_search = [str(item) for item in sorted(list(pathlib.Path(search_folder).rglob("*.pdf"))) if os.path.isfile(item)]
-            window['-RESULTS SUMMARY-'].update(value=f'Found {len(filepaths_to_search)} documents to search')
-            logger.info(f"Found {len(filepaths_to_search)} files to search")
-            import fitz
-            from threading import Thread
-            thread = Thread(target=DocumentSearcher().search_for_keywords, args=(filepaths_to_search, search_folder, keywords, word_pad, window))
-            thread.start()
-
-    # Export the results
-    elif event=='-EXPORT RESULTS-':
-        export_filename = values['-EXPORT RESULTS-']
-        if export_filename:
-            if settings.keyword_results:
-                import csv
-                with open(export_filename, 'w', newline='',  encoding='utf-8') as f:
-                    writer = csv.writer(f)
-                    writer.writerow(results_headers)
-                    writer.writerows(settings.keyword_results)
-                window['-SAVE MESSAGE-'].update(value='Results saved successfully', visible=True)
-    
-    # Save all documents containing keywords
-    elif event=='-SAVE KEYWORD DOCUMENTS-':
-        export_foldername = values['-SAVE KEYWORD DOCUMENTS-']
-        if export_foldername:
-            if settings.keyword_instances is not None:
-                if settings.keyword_instances.keys():
-
-                    # Loop through the documents containing keywords, applying highlighting, and save
-                    for document_path in settings.keyword_instances.keys():
-                        highlighted_doc = Document(filepath=os.path.join(search_folder, document_path)).highlight_doc(settings.keyword_instances[document_path])
-                        
-                        # Save the document in the same folder structure, creating folders if required
-                        path_components = os.path.normpath(document_path).split(os.sep)
-                        for i, dir in enumerate(path_components[:-1]):
-                            dir_path = os.path.join(export_foldername, *path_components[:i], dir)
-                            if not (os.path.exists(dir_path) and os.path.isdir(dir_path)):
-                                os.mkdir(dir_path)
-                        highlighted_doc.save(os.path.join(export_foldername, document_path))
-
-                    window['-SAVE MESSAGE-'].update(value='Documents saved successfully', visible=True)
-
-    # Display PDFs with keyword when clicked on in table
-    elif event=='-RESULTS TABLE-':
-        if settings.keyword_results and values[event]:
-
-            # Get the filename, keyword, and page from the selected row
-            selected_row = settings.keyword_results[values[event][0]]
-            selected_filepath = selected_row[0]
-            new_page = selected_row[1]-1
-            selected_keyword = selected_row[2]
-
-            # Update the textblock
-            window['-TEXTBLOCK-'].update(selected_row[3], visible=True)
-
-            # Clicking to open a NEW file: open the file with fitz and apply highlighting
-            if selected_filepath!=open_filepath:
+                new_page = int(values['-SET PAGE-'])-1
+            except:
+                pass
+        elif event == "-NEXT PAGE-":
+            new_page += 1
+        elif event == "-PREV PAGE-":
+            new_page -= 1
+        elif event == "-DOC VIEWER-_hover":
+            doc_viewer_hover = True
+        elif event == "-DOC VIEWER-_away":
+            doc_viewer_hover = False
+
+        # Show a page when it has been rendered in the background, if it is still the page to show
+        elif event == '-PAGE RENDERED-':
+            if (open_filepath is not None) and (values[event] == (open_document_path, open_page)):
+                image = page_renderer.cache.get(values[event])
+                if image is not None:
+                    image_elem.update(data=image)
+
+        # Update the document page if required
+        if open_filepath is not None:
+            if new_page > total_pages-1:
+                new_page = total_pages-1
+            elif new_page < 0:
+                new_page = 0
+            if (new_page!=open_page):
                 update_page = True
-                if open_file: open_file.close()
 
-                # Open the file with fitz
-                doc = Document(filepath=os.path.join(search_folder, selected_filepath))
-                total_pages = doc.total_pages
-                open_filepath = selected_filepath
-                display_lists = [None]*doc.total_pages
-
-                # Set the total pages text
-                window['-DOCUMENT NAME-'].update(f'{os.path.basename(open_filepath)}')
-                window['-TOTAL PAGES-'].update(f'Total pages: {doc.total_pages}')
-
-                # Add highlighting found by previous keyword searching to each page in the file
-                open_file = doc.highlight_doc(page_rects=settings.keyword_instances[selected_filepath])
-
-            # Update the position
-            keyword_position = selected_row[4][1]
-            page_height = open_file[new_page].rect.height
-            window["-DOC VIEWER COLUMN-"].Widget.canvas.yview_moveto(keyword_position/page_height)
-
-    # Double clicking a row in the results table should open the file
-    elif event in('-RESULTS TABLE-_double_click', '-RESULTS TABLE-_enter'):
-        if settings.keyword_results and values['-RESULTS TABLE-']:
-
-            # Get information on the selected row from the table
-            selected_row = settings.keyword_results[values['-RESULTS TABLE-'][0]]
-            selected_filepath = selected_row[0]
-            selected_page = selected_row[1]-1
-
-            # Open the document, apply highlighting, and open
-            highlighted_doc = Document(filepath=os.path.join(search_folder, selected_filepath)).highlight_doc(page_rects=settings.keyword_instances[selected_filepath])
-            import tempfile
-            if temp_dir is None:
-                temp_dir = tempfile.TemporaryDirectory()
-            temp_filepath = os.path.join(temp_dir.name, os.path.basename(selected_filepath))
-            highlighted_doc.save(temp_filepath)
-
-            # Try to open the file at the right page
-            import webbrowser
-            try:
-                open_path = pathlib.Path(temp_filepath).as_uri()
-                webbrowser.open(f'{open_path}#page={selected_page}') # The page information is being stripped....
-            except Exception as err:
-                os.startfile(temp_filepath)
-
-    # Change pages of the document
-    elif event=='-SET PAGE-_enter':
-        try:
-            new_page = int(values['-SET PAGE-'])-1
-        except:
-            pass
-    elif event == "-NEXT PAGE-":
-        new_page += 1
-    elif event == "-PREV PAGE-":
-        new_page -= 1
-    elif event == "-DOC VIEWER-_hover":
-        doc_viewer_hover = True
-    elif event == "-DOC VIEWER-_away":
-        doc_viewer_hover = False
-
-    # Update the document page if required
-    if open_filepath is not None:
-        if new_page > total_pages-1:
-            new_page = total_pages-1
-        elif new_page < 0:
-            new_page = 0
-        if (new_page!=open_page):
-            update_page = True
-
-        # Open the page of the document if it has been updated
-        if update_page:
-            if not view_doc_viewer:
-                window['-DOC VIEWER COLUMN-'].update(visible=True)
-                view_doc_viewer = True
-            if not display_lists[new_page]:  # create if not yet there
-                display_lists[new_page] = open_file[new_page].get_displaylist()
-            dlist = display_lists[new_page]
-            pix = dlist.get_pixmap(alpha=False, matrix=fitz.Matrix(1.5, 1.5))
-            image_elem.update(data=pix.tobytes(output='png'))
-            open_page = new_page # Set that the currently open page is the new page
-            goto.update(str(new_page + 1))
-
-window.close()
+            # Open the page of the document if it has been updated
+            if update_page:
+                if not view_doc_viewer:
+                    window['-DOC VIEWER COLUMN-'].update(visible=True)
+                    window['-DOC VIEWER COLUMN-'].contents_changed()
+                    view_doc_viewer = True
+                if page_renderer is None:
+                    from page_renderer import PageRenderer
+                    page_renderer = PageRenderer(window)
+
+                # Show the page straight away if it has been rendered, otherwise it is shown when the page renderer has rendered it
+                image = page_renderer.show(open_document_path, new_page, total_pages, page_rects=settings.keyword_instances.get(open_filepath))
+                if image is not None:
+                    image_elem.update(data=image)
+                open_page = new_page # Set that the currently open page is the new page
+                goto.update(str(new_page + 1))
+
+    window.close()
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    main()
@@ -0,0 +1,209 @@
+"""
+Journal of the documents searched so far, so that a search which is stopped can be resumed without searching the same documents again
+"""
+import os
+import json
+import time
+import pickle
+import sqlite3
+import hashlib
+import threading
+import settings
+
+# Set up logging
+logger = settings.get_logger("search_journal")
+
+
+class SearchJournal:
+    """
+    SQLite journal of the results of each document searched, saved as the search goes.
+
+    Each search is a run, identified by the search folder, keywords, word padding and search mode. Results are saved for each document as it is searched, and committed at most every commit_interval seconds, so that at most a few seconds of searching is lost if the program crashes.
+    When a run finishes it is removed from the journal. A run which did not finish can be resumed by a later search with the same folder, keywords and word padding, which takes the results of the documents already searched from the journal. Documents which have changed since they were searched are searched again.
+
+    Parameters
+    ----------
+    path : str (default=settings.SEARCH_JOURNAL_PATH)
+        Path to the SQLite database file. It is created if it does not exist.
+
+    commit_interval : float (default=1.0)
+        Maximum time in seconds between saving the results of documents to the file.
+    """
+    def __init__(self, path=settings.SEARCH_JOURNAL_PATH, commit_interval=1.0):
+        self.path = path
+        self.commit_interval = commit_interval
+        self.local = threading.local()
+        self.key = None
+        self.last_commit = time.monotonic()
+
+
+    @property
+    def connection(self):
+        """
+        SQLite connection for the current thread, opened and set up on first use.
+        """
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS runs (key TEXT PRIMARY KEY, folder TEXT, keywords TEXT, word_pad INTEGER, started REAL)')
+            connection.execute('CREATE TABLE IF NOT EXISTS documents (key TEXT, path TEXT, size INTEGER, mtime INTEGER, results BLOB, instances BLOB, warning TEXT, PRIMARY KEY (key, path))')
+            self.local.connection = connection
+        return connection
+
+
+    @staticmethod
+    def run_key(search_folder, keywords, word_pad, mode=None):
+        """
+        Get the key of the run of a search, which is the same for searches with the same folder, keywords, word padding and search mode.
+        """
+        run = [os.path.abspath(search_folder), [str(keyword) for keyword in keywords], int(word_pad)]
+        if (mode is not None) and (mode.is_limited or not mode.text_blocks):
+            run.append(repr(mode))
+        run = json.dumps(run)
+        return hashlib.sha1(run.encode('utf-8')).hexdigest()
+
+
+    def unfinished_documents(self, search_folder, keywords, word_pad, mode=None):
+        """
+        Get the number of documents searched by a run with the same parameters which did not finish.
+
+        Parameters
+        ----------
+        search_folder : str (required)
+            Path to the folder being searched.
+
+        keywords : list (required)
+            The keywords or queries being searched for.
+
+        word_pad : int (required)
+            The number of words returned either side of the keywords found.
+
+        mode : SearchMode (default=None)
+            The search mode. If None, all results are found.
+
+        Returns
+        -------
+        documents : int
+            Number of documents searched, or 0 if there is no run to resume.
+        """
+        key = self.run_key(search_folder, keywords, word_pad, mode)
+        try:
+            if self.connection.execute('SELECT COUNT(*) FROM runs WHERE key=?', (key,)).fetchone()[0] == 0:
+                return 0
+            return self.connection.execute('SELECT COUNT(*) FROM documents WHERE key=?', (key,)).fetchone()[0]
+        except sqlite3.Error as err:
+            logger.warning(f'Could not read the search journal: {err}')
+            return 0
+
+
+    def start(self, search_folder, keywords, word_pad, resume=False, mode=None):
+        """
+        Start recording a search.
+
+        Parameters
+        ----------
+        search_folder, keywords, word_pad
+            As in unfinished_documents.
+
+        resume : bool (default=False)
+            Whether to keep the documents already searched by an unfinished run with the same parameters, to resume it. Otherwise they are removed.
+
+        mode : SearchMode (default=None)
+            As in unfinished_documents.
+        """
+        self.key = self.run_key(search_folder, keywords, word_pad, mode)
+        with self.connection as connection:
+            if not resume:
+                connection.execute('DELETE FROM documents WHERE key=?', (self.key,))
+            if connection.execute('SELECT COUNT(*) FROM runs WHERE key=?', (self.key,)).fetchone()[0] == 0:
+                connection.execute('INSERT INTO runs VALUES (?, ?, ?, ?, ?)', (self.key, os.path.abspath(search_folder), json.dumps([str(keyword) for keyword in keywords]), int(word_pad), time.time()))
+        self.last_commit = time.monotonic()
+
+
+    def finished_documents(self):
+        """
+        Get the results of the documents already searched by the run, skipping documents which have been changed or removed since.
+
+        Yields
+        ------
+        filepath : str
+            Path of the document.
+
+        results, instances, warning
+            As returned by search_document.
+        """
+        rows = self.connection.execute('SELECT path, size, mtime, results, instances, warning FROM documents WHERE key=? ORDER BY rowid', (self.key,))
+        for filepath, size, mtime, results, instances, warning in rows:
+            try:
+                stat = os.stat(filepath)
+                if (stat.st_size != size) or (stat.st_mtime_ns != mtime):
+                    continue
+                yield filepath, pickle.loads(results), pickle.loads(instances), warning
+            except (OSError, pickle.UnpicklingError):
+                continue
+
+
+    def add(self, filepath, results, instances, warning):
+        """
+        Record the results of a document which has been searched, saving them to the file if commit_interval seconds have passed since the last save.
+
+        Parameters
+        ----------
+        filepath : str (required)
+            Path of the document.
+
+        results, instances, warning
+            As returned by search_document.
+        """
+        if self.key is None:
+            return
+        try:
+            stat = os.stat(filepath)
+            self.connection.execute('INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                    (self.key, filepath, stat.st_size, stat.st_mtime_ns, pickle.dumps(results, protocol=pickle.HIGHEST_PROTOCOL),
+                                     pickle.dumps(instances, protocol=pickle.HIGHEST_PROTOCOL), warning))
+        except (OSError, sqlite3.Error) as err:
+            logger.warning('Could not save to the search journal', extra={'filepath': filepath, 'error': str(err)})
+            return
+        if time.monotonic()-self.last_commit >= self.commit_interval:
+            self.commit()
+
+
+    def commit(self):
+        """
+        Save the documents recorded to the file.
+        """
+        try:
+            self.connection.commit()
+        except sqlite3.Error as err:
+            logger.warning(f'Could not save the search journal: {err}')
+        self.last_commit = time.monotonic()
+
+
+    def finish(self):
+        """
+        Remove the run from the journal when the search has finished, as it does not need to be resumed.
+        """
+        if self.key is None:
+            return
+        try:
+            with self.connection as connection:
+                connection.execute('DELETE FROM documents WHERE key=?', (self.key,))
+                connection.execute('DELETE FROM runs WHERE key=?', (self.key,))
+        except sqlite3.Error as err:
+            logger.warning(f'Could not remove the search from the search journal: {err}')
+        self.key = None
+
+
+    def close(self):
+        """
+        Save the documents recorded, and close the connection of the current thread. The run can be resumed by a later search.
+        """
+        connection = getattr(self.local, 'connection', None)
+        if connection is not None:
+            self.commit()
+            connection.close()
+            self.local.connection = None
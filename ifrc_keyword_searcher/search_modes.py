@@ -0,0 +1,131 @@
+"""
+Search modes limiting the results found in each document, so that triage searches can stop searching a document early
+"""
+
+
+class SearchMode:
+    """
+    Limits on the results found in each document. A document stops being searched as soon as the limits have been reached, so that later pages are not read.
+
+    Parameters
+    ----------
+    max_hits_per_keyword : int (default=None)
+        Maximum number of results of each keyword in each document. If None, all results of each keyword are found.
+
+    max_hits_per_document : int (default=None)
+        Maximum number of results of all keywords in each document. If None, all results are found.
+
+    text_blocks : bool (default=True)
+        Whether to get the text around each keyword found. If False, the text block of each result is empty, and each page is searched as soon as it has been read, without reading the next page for the text overflowing onto it.
+    """
+    def __init__(self, max_hits_per_keyword=None, max_hits_per_document=None, text_blocks=True):
+        self.max_hits_per_keyword = max_hits_per_keyword
+        self.max_hits_per_document = max_hits_per_document
+        self.text_blocks = text_blocks
+
+
+    def __repr__(self):
+        return f'SearchMode(max_hits_per_keyword={self.max_hits_per_keyword}, max_hits_per_document={self.max_hits_per_document}, text_blocks={self.text_blocks})'
+
+
+    @property
+    def is_limited(self):
+        """
+        Whether the number of results of a document is limited, so the search of a document can stop early.
+        """
+        return (self.max_hits_per_keyword is not None) or (self.max_hits_per_document is not None)
+
+
+    def take(self, keyword, instances, hit_counts):
+        """
+        Take the instances of a keyword found on a page which are within the limits, counting them.
+
+        Parameters
+        ----------
+        keyword : str (required)
+            The keyword found.
+
+        instances : list (required)
+            The instances of the keyword found on the page, in order.
+
+        hit_counts : dict (required)
+            Number of results of each keyword found in the document so far, and the total number of results with the key None. Updated with the instances taken.
+
+        Returns
+        -------
+        instances : list
+            The first instances, up to the limits.
+        """
+        allowed = len(instances)
+        if self.max_hits_per_keyword is not None:
+            allowed = min(allowed, self.max_hits_per_keyword-hit_counts.get(keyword, 0))
+        if self.max_hits_per_document is not None:
+            allowed = min(allowed, self.max_hits_per_document-hit_counts.get(None, 0))
+        allowed = max(allowed, 0)
+        hit_counts[keyword] = hit_counts.get(keyword, 0)+allowed
+        hit_counts[None] = hit_counts.get(None, 0)+allowed
+        return instances[:allowed]
+
+
+    def is_finished(self, hit_counts, keywords):
+        """
+        Check whether the limits have been reached, so the rest of the document does not need to be searched.
+
+        Parameters
+        ----------
+        hit_counts : dict (required)
+            Number of results found so far, as updated by take.
+
+        keywords : list (required)
+            All of the keywords being searched for.
+        """
+        if (self.max_hits_per_document is not None) and (hit_counts.get(None, 0) >= self.max_hits_per_document):
+            return True
+        if self.max_hits_per_keyword is not None:
+            return all(hit_counts.get(keyword, 0) >= self.max_hits_per_keyword for keyword in keywords)
+        return False
+
+
+# Search modes which can be chosen in the GUI and from the command line, and their descriptions shown in the GUI
+SEARCH_MODES = {
+    'all': 'All results',
+    'first': 'First result of each keyword in each document',
+    'documents': 'Only the documents containing keywords (fastest)',
+}
+
+
+def get_search_mode(name='all', max_hits_per_keyword=None, max_hits_per_document=None, text_blocks=None):
+    """
+    Get the limits of a search mode.
+
+    Parameters
+    ----------
+    name : str (default='all')
+        One of the keys of SEARCH_MODES:
+        'all' finds all results, with their text blocks.
+        'first' finds the first result of each keyword in each document, without text blocks.
+        'documents' finds the first result in each document, without text blocks, to find which documents contain keywords.
+
+    max_hits_per_keyword, max_hits_per_document, text_blocks (default=None)
+        If given, used instead of the limits of the mode, as in SearchMode.
+
+    Returns
+    -------
+    mode : SearchMode
+        The limits of the mode.
+
+    Raises
+    ------
+    ValueError
+        If the mode is not known.
+    """
+    if name not in SEARCH_MODES:
+        raise ValueError(f'Unknown search mode {name}')
+    mode = {'all': SearchMode(), 'first': SearchMode(max_hits_per_keyword=1, text_blocks=False), 'documents': SearchMode(max_hits_per_document=1, text_blocks=False)}[name]
+    if max_hits_per_keyword is not None:
+        mode.max_hits_per_keyword = max_hits_per_keyword
+    if max_hits_per_document is not None:
+        mode.max_hits_per_document = max_hits_per_document
+    if text_blocks is not None:
+        mode.text_blocks = text_blocks
+    return mode
@@ -0,0 +1,497 @@
+"""
+Local search service, which searches folders for keywords sent to it over an HTTP/JSON API, so that several users searching the same shared folder share one pool of worker processes and one word cache.
+
+Example:
+    python search_service.py --port 8765 --workers 4
+
+API (all responses are JSON, except page images):
+    GET    /health                                        Status of the service.
+    POST   /searches                                      Start a search. The body is a JSON object with folder, keywords, and optionally word_pad, mode, include, exclude, max_hits_per_keyword, max_hits_per_document and text_blocks.
+    GET    /searches/<id>                                 Progress of a search.
+    DELETE /searches/<id>                                 Stop a search.
+    GET    /searches/<id>/results?cursor=&limit=          Next page of results, starting from the cursor returned with the previous page.
+    GET    /searches/<id>/pages?file=&page=&zoom=         PNG image of a page of a document found by the search, with the keywords highlighted.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import threading
+import multiprocessing
+from collections import OrderedDict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import fitz
+import settings
+from document import Document
+from document_searcher import DocumentSearcher, DocumentFinder, init_worker
+from word_cache import WordCache
+from worker_pool import WorkerPool
+from page_renderer import PageImageCache
+from query import compile_keywords
+from search_modes import get_search_mode
+
+# Set up logging
+logger = settings.get_logger("service")
+
+
+def result_to_json(result):
+    """
+    Convert a results row to a list which can be saved as JSON, with the rect as a list of coordinates.
+    """
+    return list(result[:4]) + [[float(coord) for coord in tuple(result[4])[:4]]]
+
+
+def instances_to_json(instances):
+    """
+    Convert the keyword instances of a document to a dict which can be saved as JSON, with page numbers as strings and rects as lists of coordinates.
+    """
+    return {str(pageno): [[float(coord) for coord in tuple(rect)[:4]] for rect in rects] for pageno, rects in (instances or {}).items()}
+
+
+class SearchJob:
+    """
+    A search run by the search service, keeping the results of the documents searched so far so that they can be sent to clients page by page.
+
+    Only the documents with results or warnings are kept. Results are only added to the end, so a cursor giving the position of the next result stays valid while the search runs.
+
+    Parameters
+    ----------
+    search_folder : str (required)
+        Path to the folder to search, including subfolders.
+
+    keywords : list (required)
+        The keywords or queries to search for.
+
+    word_pad : int (required)
+        The number of words to be returned either side of the found keyword.
+
+    mode : SearchMode (required)
+        Limits on the results to find in each document.
+
+    include, exclude : list (default=None)
+        Glob patterns of the files to include and exclude, as in DocumentFinder.
+    """
+    def __init__(self, search_folder, keywords, word_pad, mode, include=None, exclude=None):
+        self.id = uuid.uuid4().hex
+        self.search_folder = search_folder
+        self.keywords = keywords
+        self.word_pad = word_pad
+        self.mode = mode
+        self.include = include
+        self.exclude = exclude
+        self.lock = threading.Lock()
+        self.status = 'running'
+        self.stopped = False
+        self.started = time.time()
+        self.finished = None
+        self.finder = None
+        self.progress = {'searched': 0, 'keywords': 0, 'documents': 0, 'skipped': 0, 'duplicates': 0}
+        self.documents = [] # (file name, results, instances, warning) of each document with results or warnings, with file names relative to the search folder
+        self.instances = {} # Keyword instances of each document with results, to highlight pages
+        self.metrics = None
+
+
+    def to_dict(self):
+        """
+        Get the progress of the search, with the numbers of documents searched, keywords found, documents with keywords, documents skipped and copies of documents not searched again.
+        """
+        with self.lock:
+            return dict(self.progress, id=self.id, status=self.status, folder=self.search_folder, word_pad=self.word_pad,
+                        total=max(self.finder.found, self.progress['searched']) if self.finder is not None else 0,
+                        finding=(self.finder is not None) and (not self.finder.finished) and (self.status == 'running'),
+                        started=self.started, finished=self.finished, metrics=self.metrics)
+
+
+    def add(self, filepath, results, instances, warning):
+        """
+        Add the outcome of searching a document, as yielded by DocumentSearcher.search_folder.
+        """
+        with self.lock:
+            self.progress['searched'] += 1
+            if results is None:
+                self.progress['skipped'] += 1
+            elif results:
+                self.progress['keywords'] += len(results)
+                self.progress['documents'] += 1
+                self.instances[filepath] = instances
+            if results or warning:
+                self.documents.append((filepath, results, instances, warning))
+
+
+    def results_page(self, cursor=None, limit=settings.SERVICE_RESULTS_PAGE_SIZE):
+        """
+        Get the next page of results.
+
+        Parameters
+        ----------
+        cursor : str (default=None)
+            Position of the first result to get, as returned by the previous page. If None, the page starts from the first result.
+
+        limit : int (default=settings.SERVICE_RESULTS_PAGE_SIZE)
+            Maximum number of results rows in the page. A page has fewer rows if the search has not found more results yet.
+
+        Returns
+        -------
+        page : dict
+            The documents of the page ('documents'), the cursor of the next page ('next_cursor'), and whether all of the results have been given ('finished').
+            Each document has its file name relative to the search folder ('file') and results rows ('results'). The first page with each document also has its keyword instances ('instances') and warning ('warning').
+            The results of a document with more results than the limit are split over several pages.
+
+        Raises
+        ------
+        ValueError
+            If the cursor or limit is not valid.
+        """
+        try:
+            doc_index, row_index = (int(position) for position in (cursor or '0.0').split('.'))
+        except ValueError:
+            raise ValueError(f'Invalid cursor {cursor}')
+        limit = int(limit)
+        if (doc_index < 0) or (row_index < 0) or (limit < 1):
+            raise ValueError('The cursor must not be negative, and the limit must be at least 1')
+        documents = []
+        rows = 0
+        with self.lock:
+            while (doc_index < len(self.documents)) and (rows < limit):
+                filepath, results, instances, warning = self.documents[doc_index]
+                chunk = (results or [])[row_index:row_index+limit-rows]
+                document = {'file': filepath, 'results': [result_to_json(result) for result in chunk]}
+                if row_index == 0:
+                    document.update(instances=None if instances is None else instances_to_json(instances), warning=warning)
+                documents.append(document)
+                rows += len(chunk)
+                row_index += len(chunk)
+                if row_index >= len(results or []):
+                    doc_index += 1
+                    row_index = 0
+            finished = (self.status != 'running') and (doc_index >= len(self.documents))
+        return {'documents': documents, 'next_cursor': f'{doc_index}.{row_index}', 'finished': finished}
+
+
+class SearchService:
+    """
+    Run searches in a pool of worker processes which is kept running between searches, with a word cache shared by all searches, so that documents searched before are not extracted again.
+
+    Searches run in the background, and their results are kept until settings.SERVICE_MAX_SEARCHES newer searches have been started. Searches started at the same time share the worker processes.
+
+    Parameters
+    ----------
+    workers : int (default=os.cpu_count())
+        Number of worker processes.
+
+    word_cache : WordCache (default=None)
+        Cache of words extracted from documents. If None, the default word cache is used.
+
+    time_limit, memory_limit (default=settings.DOCUMENT_TIME_LIMIT, settings.DOCUMENT_MEMORY_LIMIT)
+        Maximum time in seconds and memory in bytes to search each document, as in WorkerPool.
+
+    deduplicate : bool (default=True)
+        Whether to search documents with the same content only once, as in DocumentSearcher.
+
+    max_searches : int (default=settings.SERVICE_MAX_SEARCHES)
+        Number of searches to keep the results of.
+    """
+    def __init__(self, workers=None, word_cache=None, time_limit=settings.DOCUMENT_TIME_LIMIT, memory_limit=settings.DOCUMENT_MEMORY_LIMIT, deduplicate=True,
+                 max_searches=settings.SERVICE_MAX_SEARCHES):
+        self.workers = max(1, int(workers or os.cpu_count() or 1))
+        self.word_cache = WordCache() if word_cache is None else word_cache
+        self.deduplicate = deduplicate
+        self.max_searches = max_searches
+        self.pool = WorkerPool(self.workers, initializer=init_worker, initargs=(None, None, self.word_cache), time_limit=time_limit, memory_limit=memory_limit)
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+        self.page_cache = PageImageCache()
+
+
+    def start_search(self, folder, keywords, word_pad=10, mode='all', include=None, exclude=None, max_hits_per_keyword=None, max_hits_per_document=None, text_blocks=None):
+        """
+        Start a search in the background.
+
+        Parameters
+        ----------
+        folder : str (required)
+            Path to the folder to search, including subfolders, as seen by the service.
+
+        keywords : list (required)
+            The keywords or queries to search for.
+
+        word_pad : int (default=10)
+            The number of words to be returned either side of the found keyword.
+
+        mode, max_hits_per_keyword, max_hits_per_document, text_blocks
+            The results to find in each document, as in search_modes.get_search_mode.
+
+        include, exclude : list (default=None)
+            Glob patterns of the files to include and exclude, as in DocumentFinder.
+
+        Returns
+        -------
+        job : SearchJob
+            The search.
+
+        Raises
+        ------
+        ValueError
+            If the folder does not exist, or the keywords or other parameters are not valid.
+        """
+        if not (isinstance(folder, str) and os.path.isdir(folder)):
+            raise ValueError(f'{folder} is not a folder')
+        if not (isinstance(keywords, list) and keywords and all(isinstance(keyword, str) and keyword.strip() for keyword in keywords)):
+            raise ValueError('keywords must be a list of keywords')
+        compile_keywords(keywords)
+        for patterns in (include, exclude):
+            if (patterns is not None) and not (isinstance(patterns, list) and all(isinstance(pattern, str) for pattern in patterns)):
+                raise ValueError('include and exclude must be lists of patterns')
+        job = SearchJob(folder, keywords, int(word_pad), get_search_mode(mode, max_hits_per_keyword=max_hits_per_keyword, max_hits_per_document=max_hits_per_document, text_blocks=text_blocks),
+                        include=include, exclude=exclude)
+        with self.lock:
+            self.jobs[job.id] = job
+            while len(self.jobs) > self.max_searches:
+                old_job = self.jobs.pop(next(iter(self.jobs)))
+                old_job.stopped = True
+        threading.Thread(target=self.run_search, args=(job, ), daemon=True).start()
+        logger.info(f'Search {job.id} started in {folder} for {len(keywords)} keywords')
+        return job
+
+
+    def run_search(self, job):
+        """
+        Search the documents of a search job, adding the results of each document as it is searched. Run in a thread.
+        """
+        searcher = DocumentSearcher(word_cache=self.word_cache, workers=self.workers, deduplicate=self.deduplicate, mode=job.mode, pool=self.pool)
+        should_stop = lambda: job.stopped
+        job.finder = DocumentFinder(job.search_folder, include=job.include, exclude=job.exclude, should_stop=should_stop)
+        status = 'failed'
+        try:
+            for filepath, results, instances, warning in searcher.search_documents(filepaths=job.finder, keywords=job.keywords, word_pad=job.word_pad, should_stop=should_stop):
+                for result in results or []:
+                    result[0] = os.path.relpath(result[0], job.search_folder)
+                job.add(os.path.relpath(filepath, job.search_folder), results, instances, warning)
+            status = 'stopped' if job.stopped else 'finished'
+        except Exception as err:
+            logger.exception(f'Error running search {job.id}')
+        finally:
+            with job.lock:
+                job.progress['duplicates'] = len(searcher.duplicates)
+                job.metrics = searcher.metrics.summary()
+                job.status = status
+                job.finished = time.time()
+            logger.info(f'Search {job.id} {status}: {job.progress}')
+
+
+    def get_job(self, job_id):
+        """
+        Get a search by its id, raising a KeyError if there is no search with the id.
+        """
+        with self.lock:
+            return self.jobs[job_id]
+
+
+    def stop_search(self, job_id):
+        """
+        Stop a search. The results found so far are kept.
+        """
+        job = self.get_job(job_id)
+        job.stopped = True
+        return job
+
+
+    def render_page(self, job_id, filepath, pageno, zoom=1.5):
+        """
+        Render a page of a document found by a search, with the keywords highlighted.
+
+        Parameters
+        ----------
+        job_id : str (required)
+            Id of the search.
+
+        filepath : str (required)
+            File name of the document relative to the search folder, as given in the results.
+
+        pageno : int (required)
+            Page number (starting from 0) to render.
+
+        zoom : float (default=1.5)
+            Zoom factor to render the page at.
+
+        Returns
+        -------
+        image : bytes
+            PNG image of the page.
+
+        Raises
+        ------
+        KeyError
+            If the search did not find keywords in the document, so only documents in the search results can be rendered.
+
+        ValueError
+            If the page or zoom is not valid.
+        """
+        job = self.get_job(job_id)
+        with job.lock:
+            page_rects = job.instances[filepath]
+        zoom = float(zoom)
+        if not 0.1 <= zoom <= 5:
+            raise ValueError('zoom must be between 0.1 and 5')
+        key = (job_id, filepath, pageno, zoom)
+        image = self.page_cache.get(key)
+        if image is None:
+            doc = Document(filepath=os.path.join(job.search_folder, filepath))
+            try:
+                if not 0 <= pageno < doc.total_pages:
+                    raise ValueError(f'{filepath} does not have a page {pageno+1}')
+                doc.highlight_doc(page_rects)
+                image = doc.doc[pageno].get_pixmap(alpha=False, matrix=fitz.Matrix(zoom, zoom)).tobytes(output='png')
+            finally:
+                doc.close()
+            self.page_cache.put(key, image)
+        return image
+
+
+    def close(self):
+        """
+        Stop the searches and the worker processes.
+        """
+        with self.lock:
+            for job in self.jobs.values():
+                job.stopped = True
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+class SearchRequestHandler(BaseHTTPRequestHandler):
+    """
+    Handle requests to the search service API. The service is given by the server.
+    """
+    server_version = 'IFRCKeywordSearcher'
+    protocol_version = 'HTTP/1.1'
+
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+
+    def do_DELETE(self):
+        self.handle_request('DELETE')
+
+
+    def handle_request(self, method):
+        """
+        Send the request to the service, and send the response. Invalid requests get a 400 response, and unknown searches or documents a 404 response, with the error in the 'error' key.
+        """
+        service = self.server.service
+        url = urlparse(self.path)
+        parts = [part for part in url.path.split('/') if part]
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        try:
+            if (method == 'GET') and (parts == ['health']):
+                self.send_json({'status': 'ok', 'workers': service.workers, 'searches': len(service.jobs)})
+            elif (method == 'POST') and (parts == ['searches']):
+                self.send_json(service.start_search(**self.read_json()).to_dict(), status=201)
+            elif (len(parts) == 2) and (parts[0] == 'searches') and (method == 'GET'):
+                self.send_json(service.get_job(parts[1]).to_dict())
+            elif (len(parts) == 2) and (parts[0] == 'searches') and (method == 'DELETE'):
+                self.send_json(service.stop_search(parts[1]).to_dict())
+            elif (len(parts) == 3) and (parts[0] == 'searches') and (parts[2] == 'results') and (method == 'GET'):
+                self.send_json(service.get_job(parts[1]).results_page(cursor=query.get('cursor'), limit=query.get('limit', settings.SERVICE_RESULTS_PAGE_SIZE)))
+            elif (len(parts) == 3) and (parts[0] == 'searches') and (parts[2] == 'pages') and (method == 'GET'):
+                image = service.render_page(parts[1], query.get('file', ''), int(query.get('page', 1))-1, zoom=query.get('zoom', 1.5))
+                self.send_body(image, 'image/png')
+            else:
+                self.send_json({'error': f'{method} {url.path} not found'}, status=404)
+        except KeyError as err:
+            self.send_json({'error': f'Not found: {err}'}, status=404)
+        except (ValueError, TypeError) as err:
+            self.send_json({'error': str(err)}, status=400)
+        except Exception as err:
+            logger.exception(f'Error handling {method} {self.path}')
+            self.send_json({'error': 'Internal error'}, status=500)
+
+
+    def read_json(self):
+        """
+        Read the JSON object in the body of the request.
+        """
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            body = json.loads(self.rfile.read(length).decode('utf-8') or '{}')
+        except (UnicodeDecodeError, json.JSONDecodeError) as err:
+            raise ValueError(f'Invalid JSON: {err}')
+        if not isinstance(body, dict):
+            raise ValueError('The body must be a JSON object')
+        return body
+
+
+    def send_json(self, value, status=200):
+        self.send_body(json.dumps(value, ensure_ascii=False).encode('utf-8'), 'application/json; charset=utf-8', status=status)
+
+
+    def send_body(self, body, content_type, status=200):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def log_message(self, format, *args):
+        logger.debug(f'{self.address_string()} {format % args}')
+
+
+def make_server(service, host='127.0.0.1', port=settings.SERVICE_PORT):
+    """
+    Create an HTTP server for a search service, handling each request in a thread. Call serve_forever on the server to run it.
+
+    Parameters
+    ----------
+    service : SearchService (required)
+        The service to send requests to.
+
+    host : str (default='127.0.0.1')
+        Address to listen on. By default only requests from the same computer are accepted.
+
+    port : int (default=settings.SERVICE_PORT)
+        Port to listen on, or 0 for any free port, which can be read from server.server_address.
+    """
+    server = ThreadingHTTPServer((host, port), SearchRequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    return server
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Run the search service, which searches folders for keywords sent to it over HTTP, keeping its worker processes and word cache between searches.')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on (default: 127.0.0.1, only accepting requests from this computer). The API has no authentication.')
+    parser.add_argument('--port', type=int, default=settings.SERVICE_PORT, help=f'Port to listen on (default: {settings.SERVICE_PORT}).')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Number of documents to search in parallel (default: number of CPUs).')
+    parser.add_argument('--no-dedup', action='store_true', help='Search every file, even if it has the same content as another file.')
+    parser.add_argument('--time-limit', type=float, default=settings.DOCUMENT_TIME_LIMIT, help=f'Maximum seconds to search each document, or 0 for no limit (default: {settings.DOCUMENT_TIME_LIMIT}).')
+    parser.add_argument('--memory-limit', type=int, default=settings.DOCUMENT_MEMORY_LIMIT//(1024*1024), help=f'Maximum MB of memory to search each document, or 0 for no limit (default: {settings.DOCUMENT_MEMORY_LIMIT//(1024*1024)}).')
+    args = parser.parse_args(args)
+
+    service = SearchService(workers=args.workers, time_limit=args.time_limit or None, memory_limit=args.memory_limit*1024*1024 or None, deduplicate=not args.no_dedup)
+    try:
+        server = make_server(service, host=args.host, port=args.port)
+    except OSError as err:
+        service.close()
+        parser.error(f'Could not listen on {args.host}:{args.port}: {err}')
+    logger.info(f'Search service listening on {args.host}:{server.server_address[1]} with {service.workers} workers')
+    print(f'Search service listening on http://{args.host}:{server.server_address[1]} (press Ctrl+C to stop)', file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    main()
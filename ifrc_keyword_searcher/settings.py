@@ -3,24 +3,135 @@ Set up and settings for the module, including defining constants, setting up log
 """
 import sys
 import os
+import json
+import queue
+import atexit
 import logging
+import logging.handlers
+import threading
+from result_store import ResultStore
 
 # Define constants
 CURRENT_DIR = os.path.dirname(os.path.realpath(__file__))
 
+# User data is stored beside the PySimpleGUI user settings
+if sys.platform.startswith('win'):
+    USER_DATA_DIR = os.path.expanduser(r'~\AppData\Local\PySimpleGUI\settings')
+elif sys.platform.startswith('darwin'):
+    USER_DATA_DIR = os.path.expanduser('~/Library/Application Support/PySimpleGUI/settings')
+else:
+    USER_DATA_DIR = os.path.expanduser('~/.config/PySimpleGUI/settings')
+WORD_CACHE_PATH = os.path.join(USER_DATA_DIR, 'keyword_searcher_word_cache.sqlite')
+
+# Number of pages of words to save to the word cache in each transaction while a document is extracted
+WORD_CACHE_BATCH_PAGES = 20
+CORPUS_INDEX_PATH = os.path.join(USER_DATA_DIR, 'keyword_searcher_index.sqlite')
+METRICS_PATH = os.path.join(USER_DATA_DIR, 'keyword_searcher_metrics.json')
+SEARCH_JOURNAL_PATH = os.path.join(USER_DATA_DIR, 'keyword_searcher_journal.sqlite')
+
+# Documents taking longer than this many seconds to search are reported in the log
+SLOW_DOCUMENT_SECONDS = 30
+
+# Documents taking longer than this many seconds, or using more than this many bytes of memory, to search are stopped and skipped
+DOCUMENT_TIME_LIMIT = 300
+DOCUMENT_MEMORY_LIMIT = 2*1024*1024*1024
+
+# Glob patterns of the names of the files to search
+DOCUMENT_INCLUDE = ['*.pdf']
+
+# Column headings of the results, and the number of results to show on each page of the results table
+RESULTS_HEADERS = ['File name', 'Page', 'Keyword', 'Text block']
+RESULTS_PAGE_SIZE = 200
+
+# Minimum time in seconds between progress updates sent to the window while searching
+PROGRESS_INTERVAL = 0.1
+
+# Maximum memory in bytes to use for rendered pages in the document viewer
+PAGE_CACHE_BYTES = 200*1024*1024
+
+# Port of the local search service, the number of results rows in each page of results it sends, and the number of searches it keeps the results of
+SERVICE_PORT = 8765
+SERVICE_RESULTS_PAGE_SIZE = 1000
+SERVICE_MAX_SEARCHES = 20
+
+# Log file, which is rotated when it reaches LOG_MAX_BYTES, keeping LOG_BACKUP_COUNT old log files
+LOG_PATH = os.path.join(CURRENT_DIR, 'log.log')
+LOG_MAX_BYTES = 5*1024*1024
+LOG_BACKUP_COUNT = 3
+
+# Fields which can be given to log calls with extra, such as the document a record is about, which are added to the end of the message as name=value
+LOG_FIELDS = ('filepath', 'task', 'seconds', 'error')
+
 # Set up logging
-def get_logger(name):
-    logging.basicConfig(filename=os.path.join(CURRENT_DIR, 'log.log'),
-                        filemode='a',
-                        encoding='utf-8',
-                        format='%(asctime)s %(name)8s %(levelname)-8s %(message)s',
-                        datefmt='%Y-%m-%d %H:%M:%S',
-                        level=logging.INFO)
-    # Handle uncaught exceptions
-    def handle_exception(exc_type, exc_value, exc_traceback):
-        logging.error("Uncaught exception", exc_info=(exc_type, exc_value, exc_traceback))
-    sys.excepthook = handle_exception
+# Log records are put on a queue and written to the log file by a listener thread, so that logging does not wait for the file and tracebacks are formatted outside of the search
+# Worker processes send their log records to the main process, which writes them to the same file (see worker_pool.py)
+log_listener = None
+log_lock = threading.Lock()
+
+
+class LogFormatter(logging.Formatter):
+    """
+    Format log records, adding the fields in LOG_FIELDS given to the log call to the end of the message.
+    """
+    def formatMessage(self, record):
+        message = super().formatMessage(record)
+        fields = [f'{field}={json.dumps(getattr(record, field), ensure_ascii=False, default=str)}' for field in LOG_FIELDS if getattr(record, field, None) is not None]
+        return ' '.join([message] + fields)
+
+
+class LocalQueueHandler(logging.handlers.QueueHandler):
+    """
+    Put log records on a queue read by a listener thread in the same process. The records are not formatted before they are put on the queue, as they do not need to be sent to another process, so formatting is done by the listener thread.
+    """
+    def prepare(self, record):
+        return record
+
 
+def handle_exception(exc_type, exc_value, exc_traceback):
+    """
+    Log uncaught exceptions.
+    """
+    logging.error("Uncaught exception", exc_info=(exc_type, exc_value, exc_traceback))
+
+
+def setup_logging():
+    """
+    Set up logging to the log file for the process, the first time it is called. Worker processes are set up to send their log records to the main process instead, so are not set up here.
+    """
+    global log_listener
+    with log_lock:
+        if log_listener is not None:
+            return
+        multiprocessing = sys.modules.get('multiprocessing')
+        if (multiprocessing is not None) and (multiprocessing.parent_process() is not None):
+            return
+        file_handler = logging.handlers.RotatingFileHandler(LOG_PATH, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8', delay=True)
+        file_handler.setFormatter(LogFormatter('%(asctime)s %(name)8s %(levelname)-8s %(message)s', datefmt='%Y-%m-%d %H:%M:%S'))
+        records = queue.SimpleQueue()
+        log_listener = logging.handlers.QueueListener(records, file_handler, respect_handler_level=True)
+        log_listener.start()
+        root = logging.getLogger()
+        root.addHandler(LocalQueueHandler(records))
+        root.setLevel(logging.INFO)
+        sys.excepthook = handle_exception
+        atexit.register(stop_logging)
+
+
+def stop_logging():
+    """
+    Write the log records still on the queue to the log file, and stop the listener thread. Called when the program exits.
+    """
+    global log_listener
+    with log_lock:
+        if log_listener is not None:
+            log_listener.stop()
+            for handler in log_listener.handlers:
+                handler.close()
+            log_listener = None
+
+
+def get_logger(name):
+    setup_logging()
     return logging.getLogger(name)
 
 # Set up variables
@@ -29,8 +140,43 @@ def init():
     global searching
     searching=False
 
+    global search_generation
+    search_generation=0
+
+    global exporting
+    exporting=False
+
     global keyword_results
-    keyword_results=[]
+    keyword_results=ResultStore()
 
     global keyword_instances
     keyword_instances={}
+
+    global duplicate_documents
+    duplicate_documents={}
+
+
+def start_search():
+    """
+    Start a new search, returning its generation. A search which is still stopping after being cancelled has an older generation, so it does not stop the new search, and its events are ignored.
+    """
+    global searching, search_generation
+    search_generation += 1
+    searching = True
+    return search_generation
+
+
+def is_current_search(generation):
+    """
+    Check whether the search with this generation is the current search and has not been cancelled.
+    """
+    return searching and (generation == search_generation)
+
+
+def end_search(generation):
+    """
+    Set to not searching when a search ends, unless a newer search has started since.
+    """
+    global searching
+    if generation == search_generation:
+        searching = False
@@ -0,0 +1,305 @@
+"""
+Persistent cache of the words extracted from documents
+"""
+import os
+import uuid
+import pickle
+import sqlite3
+import threading
+import settings
+
+# Set up logging
+logger = settings.get_logger("word_cache")
+
+
+class WordCache:
+    """
+    SQLite cache of the words extracted from documents by Document.get_words, so that documents which have not changed do not need to be extracted again.
+
+    Entries are keyed by the absolute path of the document, and are invalid if the size or modification time of the file has changed.
+    The pages of each entry are saved under a key of their own, so that pages can be saved while a document is being extracted, and only used once the documents row pointing to them has been saved.
+
+    Parameters
+    ----------
+    path : str (default=settings.WORD_CACHE_PATH)
+        Path to the SQLite database file. It is created if it does not exist.
+    """
+    def __init__(self, path=settings.WORD_CACHE_PATH):
+        self.path = path
+        self.local = threading.local()
+
+
+    def __getstate__(self):
+        # SQLite connections can not be shared, so only pass the path when sending the cache to another process
+        return {'path': self.path}
+
+
+    def __setstate__(self, state):
+        self.__init__(path=state['path'])
+
+
+    @property
+    def connection(self):
+        """
+        SQLite connection for the current thread, opened and set up on first use.
+        """
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS documents (path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, total_pages INTEGER)')
+            connection.execute('CREATE TABLE IF NOT EXISTS pages (path TEXT, pageno INTEGER, words BLOB, PRIMARY KEY (path, pageno))')
+            # Caches saved before pages had their own key keep their pages under the path of the document
+            if 'pages_key' not in [column[1] for column in connection.execute('PRAGMA table_info(documents)')]:
+                connection.execute('ALTER TABLE documents ADD COLUMN pages_key TEXT')
+            self.local.connection = connection
+        return connection
+
+
+    def file_key(self, filepath):
+        """
+        Get the absolute path, size and modification time (in nanoseconds) of a file.
+        """
+        stat = os.stat(filepath)
+        return os.path.abspath(filepath), stat.st_size, stat.st_mtime_ns
+
+
+    def has_words(self, filepath):
+        """
+        Check if the words of a document are in the cache, and the document has not changed since they were saved.
+
+        Parameters
+        ----------
+        filepath : str (required)
+            Path to the document.
+        """
+        try:
+            path, size, mtime = self.file_key(filepath)
+            row = self.connection.execute('SELECT size, mtime, total_pages, COALESCE(pages_key, path) FROM documents WHERE path=?', (path,)).fetchone()
+            if (row is None) or (row[0]!=size) or (row[1]!=mtime):
+                return False
+            return self.connection.execute('SELECT COUNT(*) FROM pages WHERE path=?', (row[3],)).fetchone()[0] == row[2]
+        except (OSError, sqlite3.Error) as err:
+            logger.warning('Could not read from the word cache', extra={'filepath': filepath, 'error': str(err)})
+            return False
+
+
+    def iter_words(self, filepath, pagenos=None):
+        """
+        Get the cached words of a document one page at a time. Check that the document is in the cache with has_words first.
+
+        Parameters
+        ----------
+        filepath : str (required)
+            Path to the document.
+
+        pagenos : list (default=None)
+            Page numbers (starting from 0) to read. If None, all pages are read.
+
+        Yields
+        ------
+        pageno : int
+            Page number (starting from 0).
+
+        words : list
+            List of fitz word objects for the page, as returned by Document.get_page_words.
+        """
+        row = self.connection.execute('SELECT COALESCE(pages_key, path) FROM documents WHERE path=?', (os.path.abspath(filepath),)).fetchone()
+        if row is None:
+            return
+        pages_key = row[0]
+        if pagenos is None:
+            for pageno, words in self.connection.execute('SELECT pageno, words FROM pages WHERE path=? ORDER BY pageno', (pages_key,)):
+                yield pageno, pickle.loads(words)
+            return
+
+        pagenos = sorted(set(pagenos))
+        for i in range(0, len(pagenos), 500):
+            batch = pagenos[i:i+500]
+            for pageno, words in self.connection.execute(f'SELECT pageno, words FROM pages WHERE path=? AND pageno IN ({",".join("?"*len(batch))}) ORDER BY pageno', [pages_key] + batch):
+                yield pageno, pickle.loads(words)
+
+
+    def get_words(self, filepath):
+        """
+        Get the cached words of a document.
+
+        Parameters
+        ----------
+        filepath : str (required)
+            Path to the document.
+
+        Returns
+        -------
+        doc_words : dict or None
+            List of fitz word objects for each page of the document, as returned by Document.get_words, or None if the document is not in the cache or has changed.
+        """
+        if not self.has_words(filepath):
+            return None
+        try:
+            return dict(self.iter_words(filepath))
+        except (sqlite3.Error, pickle.UnpicklingError) as err:
+            logger.warning('Could not read from the word cache', extra={'filepath': filepath, 'error': str(err)})
+            return None
+
+
+    def writer(self, filepath):
+        """
+        Get a writer to save the words of a document to the cache one page at a time, replacing any previous entry.
+
+        Parameters
+        ----------
+        filepath : str (required)
+            Path to the document.
+        """
+        return WordCacheWriter(self, filepath)
+
+
+    def put_words(self, filepath, doc_words):
+        """
+        Save the words of a document to the cache, replacing any previous entry.
+
+        Parameters
+        ----------
+        filepath : str (required)
+            Path to the document.
+
+        doc_words : dict (required)
+            List of fitz word objects for each page of the document, as returned by Document.get_words.
+        """
+        cache_writer = self.writer(filepath)
+        for pageno, words in doc_words.items():
+            cache_writer.add_page(pageno, words)
+        cache_writer.finish(total_pages=len(doc_words))
+
+
+    def prune(self):
+        """
+        Remove documents from the cache which no longer exist, and pages left by documents whose extraction did not finish, for example because the program was closed.
+        Pages being saved by a search running at the same time are also removed, so that document is extracted again next time.
+        """
+        paths = [row[0] for row in self.connection.execute('SELECT path FROM documents')]
+        removed = [(path,) for path in paths if not os.path.isfile(path)]
+        with self.connection:
+            self.connection.executemany('DELETE FROM documents WHERE path=?', removed)
+            self.connection.execute('DELETE FROM pages WHERE path NOT IN (SELECT COALESCE(pages_key, path) FROM documents)')
+        return len(removed)
+
+
+    def clear(self):
+        """
+        Remove all documents from the cache.
+        """
+        with self.connection:
+            self.connection.execute('DELETE FROM pages')
+            self.connection.execute('DELETE FROM documents')
+
+
+    def close(self):
+        """
+        Close the connection of the current thread.
+        """
+        connection = getattr(self.local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self.local.connection = None
+
+
+class WordCacheWriter:
+    """
+    Save the words of a document to a WordCache one page at a time.
+
+    Pages are saved in batches of settings.WORD_CACHE_BATCH_PAGES pages, each in a short transaction, so that memory use does not grow with the number of pages and the cache is not locked while the document is being extracted.
+    The pages are saved under a new pages key, and the documents row pointing to them is only saved by finish, so a document which is not extracted completely is not used, and the previous entry can be read until then.
+    The size and modification time of the document are taken before the words are extracted, so changes made during extraction make the entry invalid.
+    Errors are logged, and stop the document being saved.
+
+    Parameters
+    ----------
+    word_cache : WordCache (required)
+        The cache to save to.
+
+    filepath : str (required)
+        Path to the document.
+    """
+    def __init__(self, word_cache, filepath):
+        self.word_cache = word_cache
+        self.filepath = filepath
+        self.key = None
+        self.pages_key = uuid.uuid4().hex
+        self.pages = [] # (pages key, page number, pickled words) of the pages not yet saved
+        self.saved = False # Whether any pages have been saved under the pages key
+        try:
+            self.key = word_cache.file_key(filepath)
+        except OSError as err:
+            self.abort(err)
+
+
+    def add_page(self, pageno, words):
+        """
+        Add the words of a page to save.
+        """
+        if self.key is None:
+            return
+        self.pages.append((self.pages_key, pageno, pickle.dumps([tuple(word) for word in words], protocol=pickle.HIGHEST_PROTOCOL)))
+        if len(self.pages) >= settings.WORD_CACHE_BATCH_PAGES:
+            self.save_pages()
+
+
+    def save_pages(self):
+        """
+        Save the pages added since the last batch.
+        """
+        try:
+            with self.word_cache.connection as connection:
+                connection.executemany('INSERT OR REPLACE INTO pages VALUES (?, ?, ?)', self.pages)
+            self.saved = True
+            self.pages = []
+        except sqlite3.Error as err:
+            self.abort(err)
+
+
+    def finish(self, total_pages):
+        """
+        Save the document to the cache, replacing any previous entry.
+        """
+        if self.key is None:
+            return
+        try:
+            with self.word_cache.connection as connection:
+                connection.executemany('INSERT OR REPLACE INTO pages VALUES (?, ?, ?)', self.pages)
+                row = connection.execute('SELECT COALESCE(pages_key, path) FROM documents WHERE path=?', (self.key[0],)).fetchone()
+                for pages_key in {self.key[0]} | ({row[0]} if row is not None else set()):
+                    connection.execute('DELETE FROM pages WHERE path=?', (pages_key,))
+                connection.execute('DELETE FROM documents WHERE path=?', (self.key[0],))
+                connection.execute('INSERT INTO documents (path, size, mtime, total_pages, pages_key) VALUES (?, ?, ?, ?, ?)', self.key + (total_pages, self.pages_key))
+        except sqlite3.Error as err:
+            self.abort(err)
+        self.key = None
+        self.pages = []
+        self.saved = False
+
+
+    def cancel(self):
+        """
+        Stop saving the document without an error, for example if the search of the document stopped early, removing the pages already saved.
+        """
+        if self.saved:
+            try:
+                with self.word_cache.connection as connection:
+                    connection.execute('DELETE FROM pages WHERE path=?', (self.pages_key,))
+            except sqlite3.Error as err:
+                logger.warning('Could not remove unfinished pages from the word cache', extra={'filepath': self.filepath, 'error': str(err)})
+        self.key = None
+        self.pages = []
+        self.saved = False
+
+
+    def abort(self, err):
+        """
+        Stop saving the document, logging the error.
+        """
+        logger.warning('Could not save to the word cache', extra={'filepath': self.filepath, 'error': str(err)})
+        self.cancel()
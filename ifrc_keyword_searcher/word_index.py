@@ -0,0 +1,202 @@
+"""
+Index of the words of a page, to find words and count words quickly
+"""
+from array import array
+from bisect import bisect_left, bisect_right
+
+
+class WordIndex:
+    """
+    Index of the words of a page, to quickly find the words containing a rect, and the words a number of words before or after a word.
+
+    Gives the same results as Document.find_bounding_words and Document.iterate_words_limit, but in logarithmic rather than linear time.
+
+    Parameters
+    ----------
+    words : list of fitz word objects (required)
+        Words of the page in order, as returned by Document.get_words.
+    """
+    def __init__(self, words):
+        self.words = words
+
+        # Cumulative number of words before each word, splitting words containing special space characters
+        self.cumulative_counts = array('q', [0])
+        for word in words:
+            self.cumulative_counts.append(self.cumulative_counts[-1] + len(word[4].replace('\xa0', ' ').strip().split()))
+
+        # Group the words by the top and by the bottom of the word
+        self.rows_top = self.group_words(key=1)
+        self.rows_bottom = self.group_words(key=3)
+
+        # Tops of the words in order, and the tallest word, to find the words in a band of the page
+        self.tops = array('d', [word[1] for word in words])
+        self.max_height = max([word[3]-word[1] for word in words], default=0)
+        self.texts = {}
+
+
+    def group_words(self, key):
+        """
+        Group the words by one of their coordinates.
+
+        For each group, save the word indexes in order, the left of each word, and the running maximum of the right of the words, so that the first word containing a point can be found with bisection.
+
+        Parameters
+        ----------
+        key : int (required)
+            Index of the coordinate of the words to group by.
+
+        Returns
+        -------
+        rows : dict
+            Dict where the keys are the coordinate values, and the values are tuples of (word indexes, word lefts, running maximum word rights, whether the word lefts are in order).
+        """
+        rows = {}
+        for i, word in enumerate(self.words):
+            if word[key] not in rows:
+                rows[word[key]] = ([], array('d'), array('d'))
+            indexes, lefts, max_rights = rows[word[key]]
+            indexes.append(i)
+            lefts.append(word[0])
+            max_rights.append(word[2] if not max_rights else max(max_rights[-1], word[2]))
+        return {coord: (indexes, lefts, max_rights, all(lefts[i] <= lefts[i+1] for i in range(len(lefts)-1)))
+                for coord, (indexes, lefts, max_rights) in rows.items()}
+
+
+    def find_word(self, row, x):
+        """
+        Find the first word in a group of words which contains the horizontal position x.
+
+        Returns
+        -------
+        index : int or None
+            Index of the word in the page, or None if no word contains x.
+        """
+        if row is None:
+            return None
+        indexes, lefts, max_rights, ordered = row
+        if ordered:
+            # Words which start after x can not contain it, and the first of the remaining words which ends after x is the first which contains it
+            end = bisect_right(lefts, x)
+            i = bisect_left(max_rights, x, 0, end)
+            return indexes[i] if i < end else None
+        for i, word_index in enumerate(indexes):
+            if (lefts[i] <= x) and (self.words[word_index][2] >= x):
+                return word_index
+        return None
+
+
+    def find_bounding_words(self, rect):
+        """
+        Find the word which contains the start of the rect, and the word which contains the end of the rect.
+
+        Parameters
+        ----------
+        rect : list or tuple (required)
+            The coordinates to look for, where the first two elements are the top left corner (x1, y1) and the second two are the top right (x2, y2).
+
+        Returns
+        -------
+        istart : int
+            Index of the word containing the left of the rectangle, or the first word if not found.
+
+        iend : int
+            Index of the word containing the right of the rectangle, or the last word if not found.
+        """
+        istart = self.find_word(self.rows_top.get(rect[1]), rect[0])
+        iend = self.find_word(self.rows_bottom.get(rect[3]), rect[2])
+
+        # If the words have not been found, return all words
+        if istart is None: istart = 0
+        if iend is None: iend = len(self.words)-1
+
+        return istart, iend
+
+
+    def words_before(self, index, limit):
+        """
+        Count back through the words before a word until the limit number of words is reached.
+
+        Parameters
+        ----------
+        index : int (required)
+            Index of the word to count back from, not included in the count. Use the number of words to count back from the end of the page.
+
+        limit : int (required)
+            Stop after this many words is reached.
+
+        Returns
+        -------
+        count : int
+            Number of words counted (may be greater than limit due to special characters).
+
+        word : fitz word object
+            The last word reached, or None if there are no words before the index.
+        """
+        if index <= 0:
+            return 0, None
+        first = bisect_right(self.cumulative_counts, self.cumulative_counts[index]-limit, 0, index)-1
+        first = max(first, 0)
+        return self.cumulative_counts[index]-self.cumulative_counts[first], self.words[first]
+
+
+    def words_after(self, index, limit):
+        """
+        Count forward through the words from a word until the limit number of words is reached.
+
+        Parameters
+        ----------
+        index : int (required)
+            Index of the first word to count. Use 0 to count from the start of the page.
+
+        limit : int (required)
+            Stop after this many words is reached.
+
+        Returns
+        -------
+        count : int
+            Number of words counted (may be greater than limit due to special characters).
+
+        word : fitz word object
+            The last word reached, or None if there are no words from the index.
+        """
+        if index >= len(self.words):
+            return 0, None
+        last = bisect_left(self.cumulative_counts, self.cumulative_counts[index]+limit, index+1, len(self.cumulative_counts))-1
+        last = min(last, len(self.words)-1)
+        return self.cumulative_counts[last+1]-self.cumulative_counts[index], self.words[last]
+
+
+    def get_text(self, top, bottom):
+        """
+        Get the text of the words in a horizontal band of the page, in reading order, like fitz page.get_textbox for the full width of the page.
+
+        Words are included if their vertical centre is in the band. Words on the same line are joined by a space, and lines are separated by a new line.
+        The text of each band is saved, so that hits on the same lines reuse the text.
+
+        Parameters
+        ----------
+        top : float (required)
+            Top of the band.
+
+        bottom : float (required)
+            Bottom of the band.
+
+        Returns
+        -------
+        text : str
+            The text in the band.
+        """
+        if (top, bottom) not in self.texts:
+            start = bisect_left(self.tops, top-self.max_height)
+            end = bisect_right(self.tops, bottom)
+            band_words = sorted([word for word in self.words[start:end] if top <= (word[1]+word[3])/2 <= bottom],
+                                key=lambda word: word[5:8])
+            lines = []
+            line = None
+            for word in band_words:
+                if word[5:7] != line:
+                    lines.append([])
+                    line = word[5:7]
+                lines[-1].append(word[4])
+            self.texts[(top, bottom)] = '\n'.join([' '.join(line_words) for line_words in lines])
+        return self.texts[(top, bottom)]
@@ -0,0 +1,380 @@
+"""
+Pool of worker processes with a watchdog, which stops tasks taking too long or using too much memory by killing their worker
+"""
+import os
+import sys
+import copy
+import pickle
+import time
+import queue
+import logging
+import logging.handlers
+import threading
+import multiprocessing
+from collections import deque
+from multiprocessing.connection import wait
+from concurrent.futures import Future
+import settings
+
+# Set up logging
+logger = settings.get_logger("worker_pool")
+
+
+class WorkerLimitError(Exception):
+    """
+    Raised for a task which was stopped because it took longer than the time limit or used more memory than the memory limit, or because its worker process crashed.
+    """
+    pass
+
+
+def process_memory(pid):
+    """
+    Get the resident memory of a process in bytes.
+
+    Returns None if it can not be read, or is not available on this platform (it is available on Linux and Windows).
+    """
+    try:
+        if sys.platform.startswith('win'):
+            import ctypes
+            from ctypes import wintypes
+
+            class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+                _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD), ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                            ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t), ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+                            ('QuotaNonPagedPoolUsage', ctypes.c_size_t), ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+            kernel32 = ctypes.windll.kernel32
+            kernel32.OpenProcess.restype = wintypes.HANDLE
+            handle = kernel32.OpenProcess(0x1000, False, pid) # PROCESS_QUERY_LIMITED_INFORMATION
+            if not handle:
+                return None
+            try:
+                counters = PROCESS_MEMORY_COUNTERS()
+                counters.cb = ctypes.sizeof(counters)
+                if not ctypes.windll.psapi.GetProcessMemoryInfo(wintypes.HANDLE(handle), ctypes.byref(counters), counters.cb):
+                    return None
+                return counters.WorkingSetSize
+            finally:
+                kernel32.CloseHandle(wintypes.HANDLE(handle))
+        with open(f'/proc/{pid}/statm') as f:
+            return int(f.read().split()[1])*os.sysconf('SC_PAGE_SIZE')
+    except Exception:
+        return None
+
+
+class WorkerLogHandler(logging.handlers.QueueHandler):
+    """
+    Put the log records of a worker process on a queue, to be sent to the pool by a thread of the worker process, so that logging in the worker never waits for the pool.
+    The message and traceback of each record are formatted first, so that the record can be sent to the pool, while the fields given to the log call are kept for the log file.
+    """
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+
+def send_log_records(records, log_connection):
+    """
+    Send the log records of a worker process to the pool until the worker stops. Run in a thread of each worker process.
+    """
+    while True:
+        record = records.get()
+        if record is None:
+            break
+        try:
+            try:
+                log_connection.send(record)
+            except (pickle.PicklingError, TypeError, AttributeError):
+                # A field given to the log call could not be pickled, so only send the message
+                log_connection.send(logging.makeLogRecord({'name': record.name, 'levelno': record.levelno, 'levelname': record.levelname, 'msg': record.msg, 'exc_text': record.exc_text}))
+        except (OSError, ValueError):
+            break
+
+
+def run_worker(connection, log_connection, initializer, initargs):
+    """
+    Run tasks received from the pool until told to stop. Run in each worker process.
+    """
+    # Send log records to the pool, which writes them to the log file of the main process
+    records = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(WorkerLogHandler(records))
+    root.setLevel(logging.INFO)
+    log_thread = threading.Thread(target=send_log_records, args=(records, log_connection), daemon=True)
+    log_thread.start()
+
+    try:
+        if initializer is not None:
+            initializer(*initargs)
+        while True:
+            task = connection.recv()
+            if task is None:
+                break
+            function, args = task
+            try:
+                result = (True, function(*args))
+            except Exception as err:
+                result = (False, err)
+            try:
+                connection.send(result)
+            except Exception as err:
+                connection.send((False, RuntimeError(f'Could not send the result of the task: {err}')))
+    finally:
+        records.put(None)
+        log_thread.join(timeout=5)
+
+
+class Worker:
+    """
+    Worker process of a WorkerPool, with the task it is running.
+    The worker sends its log records over a separate pipe, so that a worker which is killed can not affect the log records of the other workers.
+    """
+    def __init__(self, initializer, initargs):
+        self.connection, worker_connection = multiprocessing.Pipe()
+        self.log_connection, worker_log_connection = multiprocessing.Pipe(duplex=False)
+        self.process = multiprocessing.Process(target=run_worker, args=(worker_connection, worker_log_connection, initializer, initargs), daemon=True)
+        self.process.start()
+        worker_connection.close()
+        worker_log_connection.close()
+        self.task = None # (future, description) of the task being run
+        self.started = None
+        self.stopping = False
+
+
+    def run(self, future, description, function, args):
+        self.connection.send((function, args))
+        self.task = (future, description)
+        self.started = time.monotonic()
+
+
+    def stop(self):
+        """
+        Ask the worker to stop once it has finished its task.
+        """
+        if not self.stopping:
+            self.stopping = True
+            try:
+                self.connection.send(None)
+            except (OSError, ValueError):
+                pass
+
+
+    def kill(self):
+        self.process.kill()
+        self.close()
+
+
+    def close(self):
+        """
+        Wait for the worker process to stop, and close the connection to it, logging its last log records.
+        """
+        self.process.join()
+        self.connection.close()
+        self.receive_logs()
+
+
+    def receive_logs(self):
+        """
+        Log the log records sent by the worker process, closing the log connection once the worker has stopped.
+        """
+        if self.log_connection.closed:
+            return
+        try:
+            while self.log_connection.poll():
+                record = self.log_connection.recv()
+                logging.getLogger(record.name).handle(record)
+        except (EOFError, OSError):
+            self.log_connection.close()
+        except Exception as err:
+            logger.warning(f'Could not read a log record of a worker process: {err}')
+
+
+class WorkerPool:
+    """
+    Pool of worker processes, running one task at a time in each worker, with the same submit and shutdown methods as ProcessPoolExecutor.
+
+    A watchdog thread checks the running tasks every poll_interval seconds. A task running for longer than time_limit seconds, or whose worker uses more than memory_limit bytes, is stopped by killing its worker, which is replaced with a new worker, and its future raises a WorkerLimitError. The future of a task whose worker crashes also raises a WorkerLimitError, so that one bad task does not stop the others.
+    A worker still using more than half of the memory limit after a task is replaced, so that memory kept from one task is not counted against the next.
+
+    Parameters
+    ----------
+    workers : int (required)
+        Number of worker processes.
+
+    initializer : function (default=None)
+        Function run in each worker process when it starts, as in ProcessPoolExecutor.
+
+    initargs : tuple (default=())
+        Arguments of the initializer.
+
+    time_limit : float (default=None)
+        Maximum time in seconds to run each task. If None, tasks are not limited in time.
+
+    memory_limit : int (default=None)
+        Maximum resident memory in bytes of a worker process. If None, or the memory of processes can not be read on this platform, memory is not limited.
+
+    poll_interval : float (default=0.2)
+        Time in seconds between checks of the running tasks.
+    """
+    def __init__(self, workers, initializer=None, initargs=(), time_limit=None, memory_limit=None, poll_interval=0.2):
+        self.initializer = initializer
+        self.initargs = initargs
+        self.time_limit = time_limit
+        self.memory_limit = memory_limit
+        self.poll_interval = poll_interval
+        self.lock = threading.Lock()
+        self.queue = deque() # (future, description, function, args) of the tasks waiting for a worker
+        self.workers = [Worker(initializer, initargs) for _ in range(max(1, int(workers)))]
+        self.shutting_down = False
+        self.wakeup_reader, self.wakeup_writer = multiprocessing.Pipe(duplex=False) # Wakes the watchdog thread when tasks are submitted
+        self.thread = threading.Thread(target=self.watch, daemon=True)
+        self.thread.start()
+
+
+    def submit(self, function, *args, description=None):
+        """
+        Submit a task to run in a worker process.
+
+        Parameters
+        ----------
+        function : function (required)
+            Module level function to run, which can be sent to the worker process.
+
+        *args
+            Arguments of the function.
+
+        description : str (default=None)
+            Description of the task in error messages, such as the file being searched.
+
+        Returns
+        -------
+        future : Future
+            Future of the result of the function.
+        """
+        future = Future()
+        with self.lock:
+            if self.shutting_down:
+                raise RuntimeError('Can not submit tasks after the pool has been shut down')
+            self.queue.append((future, description or getattr(function, '__name__', 'task'), function, args))
+            self.wakeup_writer.send(None)
+        return future
+
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        """
+        Stop the worker processes once they have finished their tasks, as in ProcessPoolExecutor.shutdown. Running tasks are still stopped if they go over the limits.
+        """
+        with self.lock:
+            self.shutting_down = True
+            if cancel_futures:
+                while self.queue:
+                    self.queue.popleft()[0].cancel()
+            self.wakeup_writer.send(None)
+        if wait:
+            self.thread.join()
+
+
+    def watch(self):
+        """
+        Send tasks to the workers, collect the results, and stop tasks which go over the limits. Run in the watchdog thread until the pool has been shut down and all of the tasks have finished.
+        """
+        while True:
+            with self.lock:
+                # Give the waiting tasks to the idle workers
+                for worker in self.workers:
+                    while (worker.task is None) and (not worker.stopping) and self.queue:
+                        future, description, function, args = self.queue.popleft()
+                        if future.set_running_or_notify_cancel():
+                            try:
+                                worker.run(future, description, function, args)
+                            except Exception as err:
+                                future.set_exception(err)
+                    if (worker.task is None) and self.shutting_down and not self.queue:
+                        worker.stop()
+                if self.shutting_down and not self.queue and all(worker.task is None for worker in self.workers):
+                    break
+
+            # Wait for results, log records or new tasks
+            busy = {worker.connection: worker for worker in self.workers if worker.task is not None}
+            logging_workers = {worker.log_connection: worker for worker in self.workers if not worker.log_connection.closed}
+            for connection in wait(list(busy) + list(logging_workers) + [self.wakeup_reader], timeout=self.poll_interval):
+                if connection is self.wakeup_reader:
+                    while self.wakeup_reader.poll():
+                        self.wakeup_reader.recv()
+                elif connection in logging_workers:
+                    logging_workers[connection].receive_logs()
+                else:
+                    self.finish_task(busy[connection])
+
+            # Stop tasks over the limits
+            for worker in list(self.workers):
+                if worker.task is None:
+                    # Replace idle workers which have crashed
+                    if (not worker.stopping) and (not worker.process.is_alive()):
+                        self.replace(worker)
+                    continue
+                error = None
+                memory = process_memory(worker.process.pid) if self.memory_limit else None
+                if (self.time_limit is not None) and (time.monotonic()-worker.started > self.time_limit):
+                    error = f'took longer than {self.time_limit:g} seconds'
+                elif (memory is not None) and (memory > self.memory_limit):
+                    error = f'used more than {self.memory_limit/1024/1024:.0f} MB of memory'
+                elif not worker.process.is_alive():
+                    error = f'stopped unexpectedly (exit code {worker.process.exitcode})'
+                if error is not None:
+                    future, description = worker.task
+                    logger.warning(f'Task {error}, so its worker process has been replaced', extra={'task': description})
+                    self.replace(worker)
+                    future.set_exception(WorkerLimitError(error))
+
+        for worker in self.workers:
+            worker.close()
+        self.wakeup_reader.close()
+        self.wakeup_writer.close()
+
+
+    def finish_task(self, worker):
+        """
+        Set the result of the task of a worker which has finished.
+        """
+        future, description = worker.task
+        try:
+            succeeded, result = worker.connection.recv()
+        except (EOFError, OSError):
+            # The worker crashed, which is reported when checking the limits
+            return
+        worker.task = None
+        if succeeded:
+            future.set_result(result)
+        else:
+            future.set_exception(result)
+
+        # Replace workers which kept a lot of memory from the task
+        if self.memory_limit:
+            memory = process_memory(worker.process.pid)
+            if (memory is not None) and (memory > self.memory_limit/2):
+                self.replace(worker, kill=False)
+
+
+    def replace(self, worker, kill=True):
+        """
+        Replace a worker with a new worker, killing it or letting it stop by itself.
+        """
+        if kill:
+            worker.kill()
+        else:
+            worker.stop()
+            threading.Thread(target=worker.close, daemon=True).start()
+        if self.shutting_down:
+            with self.lock:
+                self.workers.remove(worker)
+            return
+        new_worker = Worker(self.initializer, self.initargs)
+        with self.lock:
+            self.workers[self.workers.index(worker)] = new_worker
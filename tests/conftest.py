@@ -0,0 +1,37 @@
+"""
+Shared fixtures of the tests. The modules of the keyword searcher import each other by name, so their folder is added to the path.
+"""
+import os
+import sys
+import tempfile
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'ifrc_keyword_searcher'))
+
+import settings
+
+# Keep the log of the tests out of the log file of the program
+settings.LOG_PATH = os.path.join(tempfile.mkdtemp(), 'test.log')
+settings.init()
+
+
+@pytest.fixture(scope='session')
+def corpus(tmp_path_factory):
+    """
+    Small generated corpus of PDF documents containing the benchmark keywords.
+    """
+    from benchmark import generate_corpus
+    folder = str(tmp_path_factory.mktemp('corpus') / 'documents')
+    generate_corpus(folder, documents=6, pages=3, lines=20, words_per_line=10, hit_rate=0.05, subfolders=2)
+    return folder
+
+
+@pytest.fixture(scope='session')
+def large_corpus(tmp_path_factory):
+    """
+    Generated corpus large enough that searching it takes a few seconds, to stop searches part way through.
+    """
+    from benchmark import generate_corpus
+    folder = str(tmp_path_factory.mktemp('large_corpus') / 'documents')
+    generate_corpus(folder, documents=20, pages=5, subfolders=2)
+    return folder
@@ -0,0 +1,52 @@
+"""
+Tests of the command line search, checking that arguments are validated before searching and that errors while searching are not reported as usage errors.
+"""
+import pytest
+import batch_search
+from document_searcher import DocumentSearcher
+
+
+@pytest.fixture
+def keywords_file(tmp_path):
+    path = tmp_path / 'keywords.txt'
+    path.write_text('cholera\nred cross\n', encoding='utf-8')
+    return str(path)
+
+
+@pytest.mark.parametrize('args, message', [(['--format', 'parquet'], 'Parquet results can only be written to a file path'),
+                                           (['--max-hits-per-keyword', '0'], '--max-hits-per-keyword must be at least 1')])
+def test_invalid_arguments(corpus, keywords_file, monkeypatch, capsys, args, message):
+    monkeypatch.setattr(DocumentSearcher, 'search_folder', lambda *args, **kwargs: pytest.fail('searched with invalid arguments'))
+    with pytest.raises(SystemExit) as exit_info:
+        batch_search.main([str(corpus), keywords_file, '--no-journal'] + args)
+    assert exit_info.value.code == 2
+    assert message in capsys.readouterr().err
+
+
+def test_invalid_keywords(corpus, tmp_path, capsys):
+    keywords_file = tmp_path / 'queries.txt'
+    keywords_file.write_text('query: NOT cholera\n', encoding='utf-8')
+    with pytest.raises(SystemExit):
+        batch_search.main([str(corpus), str(keywords_file), '--no-journal'])
+    with pytest.raises(SystemExit):
+        batch_search.main([str(corpus), str(tmp_path / 'missing.txt'), '--no-journal'])
+    assert 'missing.txt' in capsys.readouterr().err
+
+
+def test_search_errors_are_raised(corpus, keywords_file, monkeypatch):
+    def search_folder(*args, **kwargs):
+        raise ValueError('error while searching')
+        yield
+    monkeypatch.setattr(DocumentSearcher, 'search_folder', search_folder)
+    with pytest.raises(ValueError, match='error while searching'):
+        batch_search.main([str(corpus), keywords_file, '--no-journal', '--no-cache', '--workers', '1'])
+
+
+def test_skipped_documents_are_reported(corpus, keywords_file, tmp_path, monkeypatch, capsys):
+    def search_folder(*args, **kwargs):
+        yield 'bad.pdf', None, None, 'Skipped bad.pdf, which took longer than the time limit'
+    monkeypatch.setattr(DocumentSearcher, 'search_folder', search_folder)
+    batch_search.main([str(corpus), keywords_file, '--no-journal', '--no-cache', '--workers', '1', '--output', str(tmp_path / 'results.csv')])
+    err = capsys.readouterr().err
+    assert 'Skipped bad.pdf, which took longer than the time limit' in err
+    assert '(1 searched, 1 skipped' in err
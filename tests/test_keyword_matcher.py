@@ -0,0 +1,99 @@
+"""
+Tests that KeywordMatcher finds the same keywords as fitz page.search_for, with the same rects for whole words.
+
+Where a match starts or ends inside a word, its edge is estimated from the share of the characters of the word before it, as if all of the characters were the same width, so can differ from the edge given by fitz by up to PARTIAL_WORD_TOLERANCE average character widths of the word (narrow characters such as l and wide characters such as m give the largest differences).
+"""
+import fitz
+import pytest
+from document import Document
+from keyword_matcher import KeywordMatcher
+
+# Largest difference between an estimated edge inside a word and the edge given by fitz, in average character widths of the word
+PARTIAL_WORD_TOLERANCE = 1.5
+
+LINES = ['The red cross society responded to the flood',
+         'cholera vaccination campaign in the redcrossing area',
+         'Shelter and hygiene, WASH and water response',
+         'flood response teams and red',
+         'cross volunteers watered the shelters',
+         'unflooded floodresponse cholera. RED CROSS']
+
+KEYWORDS = ['red cross', 'cholera', 'flood', 'flood response', 'water', 'shelter', 'cross', 'd cr', 'ood', 'hygiene,', 'Red Cross', 'zzz']
+
+
+@pytest.fixture(scope='module')
+def page_and_words(tmp_path_factory):
+    filepath = str(tmp_path_factory.mktemp('keyword_matcher') / 'document.pdf')
+    doc = fitz.open()
+    page = doc.new_page()
+    for i, line in enumerate(LINES):
+        page.insert_text((50, 60+20*i), line, fontsize=11)
+    doc.save(filepath)
+    doc.close()
+    document = Document(filepath)
+    yield document.doc[0], document.get_page_words(document.doc[0])
+    document.close()
+
+
+def containing_word(words, rect, x):
+    """
+    Get the word on the line of the rect which contains the horizontal position x.
+    """
+    return next(word for word in words if (abs(word[1]-rect.y0) < 0.01) and (word[0]-0.01 <= x <= word[2]+0.01))
+
+
+def test_same_keywords_as_search_for(page_and_words):
+    page, words = page_and_words
+    page_matches = dict(KeywordMatcher(KEYWORDS).search_page(words))
+    for keyword in KEYWORDS:
+        assert len(page_matches.get(keyword, [])) == len(page.search_for(keyword)), keyword
+    assert 'zzz' not in page_matches
+
+
+def test_rects_match_search_for(page_and_words):
+    page, words = page_and_words
+    page_matches = dict(KeywordMatcher(KEYWORDS).search_page(words))
+    whole_edges = partial_edges = 0
+    for keyword, instances in page_matches.items():
+        for rect, expected in zip(instances, page.search_for(keyword)):
+            assert rect.y0 == pytest.approx(expected.y0, abs=0.01)
+            assert rect.y1 == pytest.approx(expected.y1, abs=0.01)
+            for x, expected_x, word_edge in ((rect.x0, expected.x0, 0), (rect.x1, expected.x1, 2)):
+                word = containing_word(words, expected, expected_x)
+                if abs(word[word_edge]-expected_x) < 0.01:
+                    # Edges at the start or end of a word are exact
+                    assert x == pytest.approx(expected_x, abs=0.01), keyword
+                    whole_edges += 1
+                else:
+                    # Edges inside a word are estimated within the tolerance, and are inside the word
+                    assert abs(x-expected_x) <= PARTIAL_WORD_TOLERANCE*(word[2]-word[0])/len(word[4]), keyword
+                    assert word[0] <= x <= word[2]
+                    partial_edges += 1
+    assert whole_edges and partial_edges
+
+
+def test_whole_words_identical_to_search_for(page_and_words):
+    page, words = page_and_words
+    keywords = ['red cross', 'flood response', 'cholera vaccination campaign', 'hygiene,', 'WASH']
+    for keyword, instances in KeywordMatcher(keywords).search_page(words):
+        assert [tuple(rect) for rect in instances] == pytest.approx([tuple(rect) for rect in page.search_for(keyword)], abs=0.01), keyword
+
+
+def test_phrase_over_line_break(page_and_words):
+    page, words = page_and_words
+    # 'red' ends the fourth line and 'cross' starts the fifth, giving one rect for each line
+    instances = dict(KeywordMatcher(['red cross']).search_page(words))['red cross']
+    assert len(instances) == 4
+    assert instances[1].y1 < instances[2].y0
+
+
+def test_overlapping_instances_are_not_repeated():
+    words = [(0.0, 0.0, 40.0, 10.0, 'aaaa', 0, 0, 0)]
+    instances = dict(KeywordMatcher(['aa']).search_page(words))['aa']
+    assert [tuple(rect) for rect in instances] == [(0, 0, 20, 10), (20, 0, 40, 10)]
+
+
+def test_normalise():
+    assert KeywordMatcher.normalise('  Red\xa0 CROSS\n') == 'red cross'
+    assert KeywordMatcher([]).search_page([(0, 0, 1, 1, 'x', 0, 0, 0)]) == []
+    assert KeywordMatcher(['x']).search_page([]) == []
@@ -0,0 +1,38 @@
+"""
+Tests that each search collects its own metrics, so that searches running at the same time and documents opened outside of searches do not change them.
+"""
+import os
+from document import Document
+from document_searcher import DocumentSearcher
+from benchmark import BENCHMARK_KEYWORDS
+
+
+def test_interleaved_searches_keep_their_own_metrics(corpus):
+    alone = DocumentSearcher()
+    expected = list(alone.search_folder(corpus, BENCHMARK_KEYWORDS, 5))
+    first, second = DocumentSearcher(), DocumentSearcher()
+    first_search = first.search_folder(corpus, BENCHMARK_KEYWORDS, 5)
+    second_search = second.search_folder(corpus, BENCHMARK_KEYWORDS[:1], 5)
+    first_results = [next(first_search)]
+    second_results = list(second_search)
+    first_results += list(first_search)
+    assert first_results == expected
+    assert len(second_results) == len(expected)
+    for searcher in (first, second):
+        assert searcher.metrics.counts['document'] == len(expected)
+        assert searcher.metrics.counts['pages_searched'] == alone.metrics.counts['pages_searched']
+    assert first.metrics.counts['hits'] == alone.metrics.counts['hits']
+    assert second.metrics.counts.get('hits', 0) < alone.metrics.counts['hits']
+
+
+def test_documents_outside_searches_do_not_change_search_metrics(corpus):
+    searcher = DocumentSearcher()
+    search = searcher.search_folder(corpus, BENCHMARK_KEYWORDS, 5)
+    filepath = next(search)[0]
+    counts = dict(searcher.metrics.counts)
+    doc = Document(os.path.join(corpus, filepath))
+    doc.get_page_words(doc.doc[0])
+    doc.close()
+    assert searcher.metrics.counts == counts
+    assert doc.metrics.counts['extract'] == 1
+    search.close()
@@ -0,0 +1,122 @@
+"""
+Tests of the query parser and QueryMatcher, and of keywords without the query prefix being searched for literally.
+"""
+import fitz
+import pytest
+from keyword_matcher import KeywordMatcher
+from query import Query, QueryError, QueryMatcher, PageTokens, compile_keywords, is_query
+
+
+def make_words(text):
+    """
+    Make fitz word objects for the words of a line of text, each word 10 points wide.
+    """
+    return [(10.0*i, 0.0, 10.0*i+8, 10.0, word, 0, 0, i) for i, word in enumerate(text.split())]
+
+
+def matches(query, text):
+    return Query(query).evaluate(PageTokens(make_words(text)))
+
+
+@pytest.mark.parametrize('keyword', ['query: flood', 'QUERY:flood', '  Query: (flood OR drought)'])
+def test_prefix_makes_query(keyword):
+    assert is_query(keyword)
+    assert isinstance(compile_keywords([keyword]), QueryMatcher)
+
+
+@pytest.mark.parametrize('keyword', ['cholera AND flood', 'Red Cross (IFRC)', 'vaccin*', '"early warning"', '=WASH', 'cholera NEAR/5 vaccine', 'NOT'])
+def test_plain_keywords_are_literal(keyword):
+    assert not is_query(keyword)
+    assert isinstance(compile_keywords([keyword]), KeywordMatcher)
+
+
+def test_plain_keyword_with_operator_matches_literally():
+    matcher = compile_keywords(['cholera AND flood'])
+    assert [keyword for keyword, instances in matcher.search_page(make_words('the cholera AND flood response'))] == ['cholera AND flood']
+    assert matcher.search_page(make_words('cholera and a flood')) == []
+
+
+def test_or_binds_less_tightly_than_and():
+    # x OR (a AND b), not (x OR a) AND b
+    assert matches('query: x OR a AND b', 'x')
+    assert not matches('query: x OR a AND b', 'a')
+    assert matches('query: x OR a AND b', 'a b')
+
+
+def test_near_binds_more_tightly_than_and():
+    # a AND (b NEAR/1 c)
+    assert not matches('query: a AND b NEAR/1 c', 'a b x x c')
+    assert matches('query: a AND b NEAR/1 c', 'a b x c')
+
+
+def test_not_excludes_the_terms_before_it():
+    assert matches('query: flood NOT drill', 'flood response')
+    assert not matches('query: flood NOT drill', 'flood drill')
+    assert not matches('query: flood AND response NOT drill', 'flood response drill')
+    assert matches('query: (flood NOT drill) OR cholera', 'cholera drill')
+
+
+@pytest.mark.parametrize('query', ['query: NOT drill', 'query: (NOT drill)', 'query: flood OR NOT drill'])
+def test_leading_not_is_rejected(query):
+    with pytest.raises(QueryError, match='NOT must follow'):
+        Query(query)
+
+
+@pytest.mark.parametrize('query, error', [('query:', 'empty'), ('query: "early warning', 'Missing closing "'), ('query: (flood', 'Missing \\)'),
+                                          ('query: flood AND', 'ends unexpectedly'), ('query: flood)', 'Unexpected \\)')])
+def test_invalid_queries(query, error):
+    with pytest.raises(QueryError, match=error):
+        Query(query)
+
+
+def test_invalid_query_is_value_error():
+    with pytest.raises(ValueError):
+        compile_keywords(['flood', 'query: "early warning'])
+
+
+def test_near_distance():
+    text = 'cholera one two three vaccine'
+    assert matches('query: cholera NEAR/3 vaccine', text) == [(0, 4)]
+    assert matches('query: cholera NEAR/3 vaccine', text) == matches('query: vaccine NEAR/3 cholera', text)
+    assert not matches('query: cholera NEAR/2 vaccine', text)
+    assert matches('query: cholera NEAR/0 vaccine', 'vaccine cholera') == [(0, 1)]
+
+
+def test_near_uses_nearest_match():
+    assert matches('query: cholera NEAR/1 vaccine', 'vaccine x x x cholera x vaccine') == [(4, 6)]
+
+
+def test_terms_match_whole_words():
+    assert not matches('query: vaccin', 'vaccination campaign')
+    assert matches('query: vaccin*', 'vaccination campaign') == [(0, )]
+    assert not matches('query: vaccin*', 'revaccination')
+    assert matches('query: "vacc* camp*"', 'vaccination campaign') == [(0, 1)]
+
+
+def test_case():
+    assert matches('query: wash', 'WASH programme')
+    assert matches('query: =WASH', 'WASH programme')
+    assert not matches('query: =WASH', 'wash hands')
+
+
+def test_phrase_matches_consecutive_words():
+    assert matches('query: "early warning"', 'an early warning system') == [(1, 2)]
+    assert not matches('query: "early warning"', 'early flood warning')
+    assert matches('query: early warning', 'early flood warning') == [(0, ), (2, )]
+
+
+def test_query_words():
+    assert Query('query: (flood OR "early warning") NOT drill').words() == ['flood', 'early', 'warning']
+
+
+def test_query_matcher_mixes_literals_and_queries():
+    words = make_words('the cholera outbreak needs a vaccination campaign')
+    matcher = QueryMatcher(['vaccination', 'query: cholera NEAR/3 vacc*', 'query: zzz', 'outbreak', 'query: "vaccination campaign"'])
+    page_matches = matcher.search_page(words)
+    assert [keyword for keyword, instances in page_matches] == ['vaccination', 'query: cholera NEAR/3 vacc*', 'outbreak', 'query: "vaccination campaign"']
+
+    # Each match of a query is one instance, with a rect for each word, joining the rects of consecutive words on the same line
+    instances = dict(page_matches)
+    assert instances['query: cholera NEAR/3 vacc*'] == [[fitz.Rect(10, 0, 18, 10), fitz.Rect(50, 0, 58, 10)]]
+    assert instances['query: "vaccination campaign"'] == [[fitz.Rect(50, 0, 68, 10)]]
+    assert not matcher.search_page([])
@@ -0,0 +1,109 @@
+"""
+Tests of the search service, run on localhost on a free port, with the search client.
+"""
+import time
+import threading
+import pytest
+from benchmark import BENCHMARK_KEYWORDS
+from document_searcher import DocumentSearcher
+from search_client import SearchClient, SearchServiceError
+from search_service import SearchService, make_server
+from word_cache import WordCache
+
+
+@pytest.fixture
+def client(tmp_path):
+    service = SearchService(workers=2, word_cache=WordCache(str(tmp_path / 'word_cache.sqlite')))
+    server = make_server(service, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield SearchClient(f'http://127.0.0.1:{server.server_address[1]}')
+    finally:
+        server.shutdown()
+        server.server_close()
+        service.close()
+
+
+def wait_for(client, search_id, timeout=60):
+    """
+    Wait for a search to end, returning its progress.
+    """
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        progress = client.progress(search_id)
+        if progress['status'] != 'running':
+            return progress
+        time.sleep(0.05)
+    raise TimeoutError(f'Search {search_id} did not end')
+
+
+def read_results(client, search_id, limit):
+    """
+    Read all of the results of a search page by page, returning the results rows and the number of pages read.
+    """
+    rows = []
+    cursor = None
+    pages = 0
+    while True:
+        page = client.results_page(search_id, cursor=cursor, limit=limit)
+        pages += 1
+        cursor = page['next_cursor']
+        for document in page['documents']:
+            rows += document['results']
+        if page['finished']:
+            return rows, pages
+        if not page['documents']:
+            time.sleep(0.05)
+
+
+def test_health(client):
+    assert client.health()['status'] == 'ok'
+
+
+def test_search_pages_through_results(client, corpus):
+    search_id = client.start_search(corpus, BENCHMARK_KEYWORDS, word_pad=5)['id']
+    rows, pages = read_results(client, search_id, limit=7)
+    progress = wait_for(client, search_id)
+    assert progress['status'] == 'finished'
+    assert progress['searched'] == 6
+    assert progress['keywords'] == len(rows)
+
+    # The service gives the same results as searching the folder directly
+    expected = [result for filepath, results, instances, warning in DocumentSearcher().search_folder(corpus, BENCHMARK_KEYWORDS, 5) for result in results or []]
+    assert len(rows) > 7
+    assert pages > 1
+    assert sorted((row[0], row[1], row[2], row[3]) for row in rows) == sorted((row[0], row[1], row[2], row[3]) for row in expected)
+
+
+def test_render_page(client, corpus):
+    search_id = client.start_search(corpus, BENCHMARK_KEYWORDS, word_pad=5)['id']
+    rows, pages = read_results(client, search_id, limit=100)
+    image = client.render_page(search_id, rows[0][0], rows[0][1]-1)
+    assert image.startswith(b'\x89PNG')
+
+
+def test_stop_search(client, large_corpus):
+    search_id = client.start_search(large_corpus, BENCHMARK_KEYWORDS)['id']
+    client.stop_search(search_id)
+    progress = wait_for(client, search_id)
+    assert progress['status'] == 'stopped'
+    assert progress['searched'] < 20
+
+    # The results found before stopping can still be read
+    rows, pages = read_results(client, search_id, limit=100)
+    assert len(rows) == progress['keywords']
+
+
+def test_invalid_requests(client, corpus):
+    with pytest.raises(SearchServiceError, match='is not a folder'):
+        client.start_search(corpus + '_missing', BENCHMARK_KEYWORDS)
+    with pytest.raises(SearchServiceError, match='Missing closing'):
+        client.start_search(corpus, ['query: "flood response'])
+    with pytest.raises(SearchServiceError, match='Not found'):
+        client.progress('missing')
+    search_id = client.start_search(corpus, BENCHMARK_KEYWORDS)['id']
+    with pytest.raises(SearchServiceError, match='Invalid cursor'):
+        client.results_page(search_id, cursor='z')
+    with pytest.raises(SearchServiceError, match='Not found'):
+        client.render_page(search_id, '../../etc/passwd', 0)
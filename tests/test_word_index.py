@@ -0,0 +1,112 @@
+"""
+Tests that WordIndex gives the same results as the linear Document.find_bounding_words and Document.iterate_words_limit, and the same text as the words of a band of the page.
+"""
+import random
+import fitz
+import pytest
+from document import Document
+from word_index import WordIndex
+
+VOCABULARY = ['the', 'flood', 'red', 'cross', 'cholera', 'shelter', 'water', 'hygiene', 'appeal', 'response', 'red\xa0cross', 'a\xa0b\xa0c', '\xa0', '12']
+
+# Documents are not opened by these methods
+DOCUMENT = Document(filepath='unused.pdf')
+
+
+def make_page_words(rand, lines=12, shuffle_rows=False):
+    """
+    Make fitz word objects for a page of random lines of words. Some lines overlap vertically, and some words contain non-breaking spaces.
+    If shuffle_rows, the words of some rows are not in order from left to right, as happens with text in columns or drawn out of order.
+    """
+    words = []
+    top = 20.0
+    for line in range(lines):
+        height = rand.choice([8.0, 10.0, 12.0])
+        x = rand.choice([20.0, 50.0])
+        row = []
+        for wordno in range(rand.randint(0, 8)):
+            width = rand.choice([10.0, 20.0, 30.0])
+            row.append((x, top, x+width, top+height, rand.choice(VOCABULARY), line // 4, line, wordno))
+            x += width + rand.choice([0.0, 2.0, 4.0])
+        if shuffle_rows and (len(row) > 2) and rand.random() < 0.5:
+            rand.shuffle(row)
+        words += row
+        top += rand.choice([height/2, height, height+4])
+    return words
+
+
+def iter_pages(count=40):
+    rand = random.Random(7)
+    yield []
+    yield make_page_words(rand, lines=1)
+    for i in range(count):
+        yield make_page_words(rand, shuffle_rows=i % 2 == 1)
+
+
+def test_find_bounding_words():
+    rand = random.Random(1)
+    for words in iter_pages():
+        index = WordIndex(words)
+        rects = [word[:4] for word in words]
+        # Rects inside words, across several words, and not on any word
+        rects += [(word[0]+1, word[1], other[2]-1, other[3]) for word, other in zip(words, words[1:])]
+        rects += [(rand.uniform(0, 300), rand.choice(words)[1] if words else 0, rand.uniform(0, 300), rand.choice(words)[3] if words else 0) for _ in range(50)]
+        rects += [(0, -1, 1, -1)]
+        for rect in rects:
+            assert index.find_bounding_words(rect) == DOCUMENT.find_bounding_words(words, rect), rect
+
+
+def test_words_before_and_after():
+    for words in iter_pages():
+        index = WordIndex(words)
+        for i in range(len(words)+1):
+            for limit in (1, 2, 5, 10, 100):
+                assert index.words_before(i, limit) == DOCUMENT.iterate_words_limit(reversed(words[:i]), limit), (i, limit)
+                assert index.words_after(i, limit) == DOCUMENT.iterate_words_limit(words[i:], limit), (i, limit)
+
+
+def band_text(words, top, bottom):
+    """
+    Text of the words whose vertical centre is in a band, found by checking every word.
+    """
+    lines = {}
+    for word in sorted(words, key=lambda word: word[5:8]):
+        if top <= (word[1]+word[3])/2 <= bottom:
+            lines.setdefault(word[5:7], []).append(word[4])
+    return '\n'.join([' '.join(line_words) for line_words in lines.values()])
+
+
+def test_get_text():
+    rand = random.Random(2)
+    for words in iter_pages():
+        index = WordIndex(words)
+        for _ in range(30):
+            top, bottom = sorted([rand.uniform(0, 200), rand.uniform(0, 200)])
+            if words and rand.random() < 0.5:
+                first, last = sorted([rand.randrange(len(words)), rand.randrange(len(words))])
+                top, bottom = words[first][1], words[last][3]
+            assert index.get_text(top, bottom) == band_text(words, top, bottom)
+            # The text of each band is saved, and the saved text is the same
+            assert index.get_text(top, bottom) == band_text(words, top, bottom)
+
+
+def test_get_text_matches_get_textbox():
+    # On evenly spaced lines, the text is the same as fitz gives for the full width of the page
+    rand = random.Random(3)
+    doc = fitz.open()
+    page = doc.new_page()
+    for line in range(30):
+        page.insert_text((50 if line % 3 else 120, 50+16*line), ' '.join(rand.choice(VOCABULARY[:10]) for _ in range(rand.randint(1, 10))), fontsize=11)
+    words = sorted(page.get_text('words'), key=lambda word: [word[1], word[0]])
+    index = WordIndex(words)
+    for _ in range(100):
+        first, last = sorted([rand.randrange(len(words)), rand.randrange(len(words))])
+        top, bottom = words[first][1], words[last][3]
+        assert index.get_text(top, bottom) == page.get_textbox(fitz.Rect(0, top, page.rect.width, bottom))
+    doc.close()
+
+
+@pytest.mark.parametrize('method, args', [('find_bounding_words', ((0, 0, 1, 1), )), ('words_before', (0, 5)), ('words_after', (0, 5)), ('get_text', (0, 100))])
+def test_empty_page(method, args):
+    expected = {'find_bounding_words': DOCUMENT.find_bounding_words([], (0, 0, 1, 1)), 'words_before': (0, None), 'words_after': DOCUMENT.iterate_words_limit([], 5), 'get_text': ''}
+    assert getattr(WordIndex([]), method)(*args) == expected[method]